@@ -0,0 +1,67 @@
+"""Tempo do ranking da busca da conversa sobre muitos candidatos.
+
+Monta um estoque sintético em memória (sem banco), seleciona os candidatos
+como o InventoryIndex faz (posições dos ids) e mede rank() por mensagem.
+
+Uso, a partir de backend/:
+
+    python -m benchmarks.rank_vehicles --candidates 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from src.services.vehicle_ranking import rank, ranking_frame  # noqa: E402
+
+OPCIONAIS = ['Ar condicionado', 'Teto solar', 'Banco de couro', 'Câmera de ré', 'Multimídia', 'Airbag']
+SEARCHES = [
+    {'preco_max': 80000},
+    {'preco_min': 60000, 'preco_max': 120000, 'ano_min': 2019},
+    {'ano_max': 2018, 'opcionais': ['teto solar', 'banco de couro']},
+]
+
+
+def synthetic_inventory(total):
+    rng = np.random.default_rng(11)
+    vehicles = []
+    for i in range(1, total + 1):
+        preco = float(rng.integers(25, 300) * 1000)
+        vehicles.append(SimpleNamespace(
+            id=i, preco=preco, ano_modelo=int(rng.integers(2008, 2026)),
+            preco_promocional=preco * 0.95 if rng.random() < 0.1 else None,
+            destaque=bool(rng.random() < 0.05), destaque_ate=None,
+            itens_opcionais=';'.join(rng.choice(OPCIONAIS, size=3, replace=False))))
+    return vehicles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inventory', type=int, default=20000)
+    parser.add_argument('--candidates', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    frame = ranking_frame(synthetic_inventory(args.inventory)).sort_values('id', ignore_index=True)
+    ids = sorted(int(i) for i in np.random.default_rng(5).choice(frame['id'].to_numpy(), size=args.candidates,
+                                                                  replace=False))
+    for params in SEARCHES:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            candidates = frame.take(np.searchsorted(frame['id'].to_numpy(), np.fromiter(ids, dtype=np.int64)))
+            page = rank(candidates, params, 4)
+            rank(candidates, params, 4, after=page[-1][1])
+            samples.append((time.perf_counter() - start) * 1000 / 2)
+        print(f'{params}: {statistics.median(samples):.2f} ms por página '
+              f'({args.candidates} candidatos, mediana de {args.repeat})')
+
+
+if __name__ == '__main__':
+    main()
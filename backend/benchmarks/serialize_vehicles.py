@@ -0,0 +1,138 @@
+"""Tempo para carregar e serializar em JSON 50 mil veículos, antes e depois dos serializadores compilados.
+
+Grava um estoque sintético num SQLite em memória e mede, para a listagem
+(campos de `vehicle_model`) e para Vehicle.to_dict:
+
+- marshal: objetos do ORM + marshal do flask-restx + json.dumps (caminho antigo de GET /vehicles/)
+- to_dict antigo: objetos do ORM + dict montado campo a campo + json.dumps
+- compilado (ORM): objetos do ORM + src/serializers.py + dumps
+- compilado (Core): só as colunas (with_entities) + src/serializers.py + dumps
+
+dumps usa o orjson quando instalado; --no-orjson força o json da biblioteca padrão.
+
+Uso, a partir de backend/:
+
+    python -m benchmarks.serialize_vehicles --vehicles 50000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+import numpy as np  # noqa: E402
+from flask_restx import marshal  # noqa: E402
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import src.serializers as serializers  # noqa: E402
+from src.database import db  # noqa: E402
+from src.models import Dealership, Vehicle  # noqa: E402
+from src.routes.main import VEHICLE_LIST_FIELDS, vehicle_model  # noqa: E402
+from src.services.vehicle_listing import select_columns  # noqa: E402
+
+OPCIONAIS = ['Ar condicionado', 'Teto solar', 'Banco de couro', 'Câmera de ré', 'Multimídia', 'Airbag', 'Isofix']
+
+
+def legacy_to_dict(vehicle):
+    """Vehicle.to_dict antes dos serializadores compilados."""
+    return {
+        'id': vehicle.id, 'dealership_id': vehicle.dealership_id, 'sku': vehicle.sku, 'marca': vehicle.marca,
+        'modelo': vehicle.modelo, 'versao': vehicle.versao, 'ano_fabricacao': vehicle.ano_fabricacao,
+        'ano_modelo': vehicle.ano_modelo, 'quilometragem': vehicle.quilometragem, 'estado': vehicle.estado,
+        'cambio': vehicle.cambio, 'combustivel': vehicle.combustivel, 'motor': vehicle.motor,
+        'potencia': vehicle.potencia, 'final_placa': vehicle.final_placa, 'cor': vehicle.cor,
+        'preco': vehicle.preco, 'preco_promocional': vehicle.preco_promocional, 'destaque': vehicle.destaque,
+        'destaque_ate': vehicle.destaque_ate.isoformat() if vehicle.destaque_ate else None,
+        'vendido': vehicle.vendido,
+        'itens_opcionais': vehicle.itens_opcionais.split(';') if vehicle.itens_opcionais else [],
+        'link_fotos': vehicle.link_fotos.split(';') if vehicle.link_fotos else [],
+        'observacoes': vehicle.observacoes,
+        'data_cadastro': vehicle.data_cadastro.isoformat(),
+        'data_atualizacao': vehicle.data_atualizacao.isoformat(),
+        'data_venda': vehicle.data_venda.isoformat() if vehicle.data_venda else None,
+    }
+
+
+def populate(session, total):
+    rng = np.random.default_rng(23)
+    session.execute(insert(Dealership), [{'id': 1, 'name': 'Bench', 'whatsapp_number': '5511999999999',
+                                          'email': 'bench@example.com', 'cnpj': '00000000000000'}])
+    now = datetime.utcnow()
+    session.execute(insert(Vehicle), [{
+        'dealership_id': 1, 'sku': f'SKU{i}', 'marca': 'Chevrolet', 'modelo': 'Onix', 'versao': 'LT 1.0',
+        'ano_fabricacao': 2022, 'ano_modelo': 2023, 'quilometragem': int(rng.integers(0, 150000)),
+        'estado': 'Usado', 'cambio': 'Manual', 'combustivel': 'Flex', 'motor': '1.0', 'potencia': '82cv',
+        'final_placa': str(i % 10), 'cor': 'Prata', 'preco': float(rng.integers(40, 200) * 1000),
+        'preco_promocional': None, 'destaque': False, 'vendido': False,
+        'itens_opcionais': ';'.join(rng.choice(OPCIONAIS, size=4, replace=False)),
+        'link_fotos': ';'.join(f'https://fotos.example.com/{i}/{n}.jpg' for n in range(6)),
+        'observacoes': 'Revisado', 'data_cadastro': now, 'data_atualizacao': now,
+    } for i in range(total)])
+    session.commit()
+
+
+def timed(label, load, serialize, encode, repeat):
+    """Mediana de cada etapa: carregar do banco, montar os dicts, gerar o JSON."""
+    stages = {'carga': [], 'dicts': [], 'json': []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = load()
+        loaded = time.perf_counter()
+        data = serialize(rows)
+        serialized = time.perf_counter()
+        body = encode(data)
+        stages['carga'].append(loaded - start)
+        stages['dicts'].append(serialized - loaded)
+        stages['json'].append(time.perf_counter() - serialized)
+    medians = {stage: statistics.median(samples) * 1000 for stage, samples in stages.items()}
+    print(f"{label:34s} {sum(medians.values()):7.0f} ms = " +
+          ' + '.join(f'{stage} {value:.0f}' for stage, value in medians.items()) + f'  ({len(body) / 2 ** 20:.1f} MB)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-orjson', action='store_true')
+    args = parser.parse_args()
+    if args.no_orjson:
+        serializers.orjson = None
+    print(f"encoder: {'orjson' if serializers.orjson is not None else 'json'}")
+
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        populate(session, args.vehicles)
+        query = session.query(Vehicle)
+        listing = serializers.columns_serializer(Vehicle, VEHICLE_LIST_FIELDS)
+        listing_rows = serializers.columns_serializer(Vehicle, VEHICLE_LIST_FIELDS, positional=True)
+
+        def load():
+            session.expunge_all()
+            return query.all()
+
+        def load_columns():
+            return select_columns(query, VEHICLE_LIST_FIELDS).all()
+
+        json_dumps = lambda data: json.dumps(data).encode()  # noqa: E731
+        print(f'{args.vehicles} veículos, listagem ({len(VEHICLE_LIST_FIELDS)} campos):')
+        timed('marshal (ORM + flask-restx)', load, lambda rows: marshal(rows, vehicle_model), json_dumps, args.repeat)
+        timed('compilado (ORM)', load, listing.many, serializers.dumps, args.repeat)
+        timed('compilado (Core, só as colunas)', load_columns, listing_rows.many, serializers.dumps, args.repeat)
+
+        vehicles = load()
+        print('to_dict (objetos já carregados):')
+        timed('to_dict antigo + json.dumps', lambda: vehicles, lambda rows: [legacy_to_dict(v) for v in rows],
+              json_dumps, args.repeat)
+        timed('to_dict compilado + dumps', lambda: vehicles, lambda rows: [v.to_dict() for v in rows],
+              serializers.dumps, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
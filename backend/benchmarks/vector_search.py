@@ -0,0 +1,104 @@
+"""Recall e latência da busca semântica (índice IVF em disco) com 100 mil veículos.
+
+Gera um estoque sintético (sem banco), calcula os embeddings com o modelo
+configurado (EMBEDDING_MODEL, padrão `hashing`), grava o índice em um
+diretório temporário e compara, para cada VECTOR_NPROBE, os SEMANTIC_TOP_K
+devolvidos com a busca exata (produto interno com todos os vetores). O recall
+conta os devolvidos com nota de pelo menos a do k-ésimo da busca exata.
+
+Uso, a partir de backend/:
+
+    python -m benchmarks.vector_search --vehicles 100000
+    python -m benchmarks.vector_search --nprobe 4 8 12 24
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from src.services.embeddings import get_embedder, vehicle_text  # noqa: E402
+from src.services.vector_index import VectorIndex, write_vector_index  # noqa: E402
+
+MODELOS = [('Chevrolet', 'Onix', 'hatch'), ('Chevrolet', 'Onix Plus', 'sedan'), ('Chevrolet', 'S10', 'picape'),
+           ('Toyota', 'Corolla', 'sedan'), ('Toyota', 'Hilux', 'picape'), ('Toyota', 'SW4', 'suv'),
+           ('Fiat', 'Mobi', 'hatch'), ('Fiat', 'Toro', 'picape'), ('Fiat', 'Strada', 'picape'),
+           ('Volkswagen', 'Polo', 'hatch'), ('Volkswagen', 'Virtus', 'sedan'), ('Volkswagen', 'T-Cross', 'suv'),
+           ('Jeep', 'Renegade', 'suv'), ('Jeep', 'Compass', 'suv'), ('Honda', 'Civic', 'sedan'),
+           ('Hyundai', 'HB20', 'hatch'), ('Hyundai', 'Creta', 'suv'), ('BMW', '320i', 'sedan')]
+VERSOES = ['LT', 'LTZ', 'Premier', 'XEi', 'SRX', 'Like', 'Trekking', 'Highline', 'Comfortline', 'Sport',
+           'Limited', 'Longitude', 'Trailhawk', 'Touring', 'EXL']
+MOTORES = ['1.0', '1.0 Turbo', '1.3', '1.6', '2.0', '2.0 Turbo', '2.8 Diesel']
+OPCIONAIS = ['Ar condicionado', 'Teto solar', 'Banco de couro', 'Câmera de ré', 'Multimídia', 'Isofix',
+             'Tração 4x4', 'Sensor de estacionamento', 'Piloto automático', '7 lugares']
+QUERIES = ['carro econômico pra família', 'SUV pra estrada de terra', 'algo esportivo e potente',
+           'pra cidade, fácil de estacionar', 'picape pra carga e obra', 'sedan confortável com couro',
+           'hatch 1.0 flex barato', 'carro grande pra viagem com os filhos']
+
+
+def synthetic_inventory(total):
+    rng = np.random.default_rng(17)
+    vehicles = []
+    for i in range(1, total + 1):
+        marca, modelo, tipo = MODELOS[rng.integers(len(MODELOS))]
+        motor = MOTORES[rng.integers(len(MOTORES))]
+        vehicles.append(SimpleNamespace(
+            id=i, marca=marca, modelo=modelo, versao=f'{VERSOES[rng.integers(len(VERSOES))]} {motor}', motor=motor,
+            potencia=f'{rng.integers(70, 250)}cv', cambio='Automático' if rng.random() < 0.6 else 'Manual',
+            combustivel='Diesel' if 'Diesel' in motor else 'Flex', estado='Usado', cor=None,
+            itens_opcionais=';'.join(rng.choice(OPCIONAIS, size=3, replace=False)),
+            observacoes=f'{tipo} revisado' if rng.random() < 0.5 else None))
+    return vehicles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=100000)
+    parser.add_argument('--k', type=int, default=100)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 12, 24])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    embedder = get_embedder()
+    vehicles = synthetic_inventory(args.vehicles)
+    start = time.perf_counter()
+    vectors = embedder.encode_vehicles([vehicle_text(v) for v in vehicles])
+    print(f'embeddings ({embedder.name}, {embedder.dim} dim): {time.perf_counter() - start:.1f}s '
+          f'para {args.vehicles} veículos')
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        index = VectorIndex(write_vector_index(directory, [v.id for v in vehicles], vectors,
+                                               {'model': embedder.name}))
+        print(f'índice IVF ({index.meta["nlist"]} listas): {time.perf_counter() - start:.1f}s, '
+              f'{os.path.getsize(os.path.join(index.path, "vectors.npy")) / 2 ** 20:.0f} MB em disco')
+
+        queries = [embedder.encode_query(text) for text in QUERIES]
+        # nota do k-ésimo da busca exata: com empates, qualquer veículo com nota
+        # igual ou maior conta como acerto
+        thresholds = [np.sort(index.vectors @ q)[-args.k] for q in queries]
+        for nprobe in args.nprobe:
+            samples, recalls = [], []
+            for query, threshold in zip(queries, thresholds):
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    _, scores = index.search(query, k=args.k, nprobe=nprobe)
+                    samples.append((time.perf_counter() - start) * 1000)
+                recalls.append(float(np.sum(scores >= threshold - 1e-6)) / args.k)
+            samples.sort()
+            print(f'nprobe={nprobe:3d}: recall@{args.k} {statistics.mean(recalls):.3f}, '
+                  f'{statistics.median(samples):.2f} ms mediana, {samples[int(len(samples) * 0.95)]:.2f} ms p95')
+        start = time.perf_counter()
+        for query in queries:
+            np.argsort(-(index.vectors @ query))[:args.k]
+        print(f'busca exata: {(time.perf_counter() - start) * 1000 / len(queries):.2f} ms por consulta')
+
+
+if __name__ == '__main__':
+    main()
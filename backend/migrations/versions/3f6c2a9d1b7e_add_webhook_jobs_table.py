@@ -0,0 +1,37 @@
+"""Add webhook_jobs table
+
+Revision ID: 3f6c2a9d1b7e
+Revises: e79157b223ee
+Create Date: 2026-10-17 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a9d1b7e'
+down_revision = 'e79157b223ee'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_webhook_jobs_status_available_at', 'webhook_jobs', ['status', 'available_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_webhook_jobs_status_available_at', table_name='webhook_jobs')
+    op.drop_table('webhook_jobs')
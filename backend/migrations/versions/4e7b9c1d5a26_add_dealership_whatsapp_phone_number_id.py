@@ -0,0 +1,28 @@
+"""Add dealership whatsapp_phone_number_id
+
+Revision ID: 4e7b9c1d5a26
+Revises: 9d4a6f3b2e18
+Create Date: 2026-10-17 16:02:13.574920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7b9c1d5a26'
+down_revision = '9d4a6f3b2e18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('dealerships', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('whatsapp_phone_number_id', sa.String(length=32), nullable=True))
+        batch_op.create_unique_constraint('uq_dealerships_whatsapp_phone_number_id', ['whatsapp_phone_number_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('dealerships', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_dealerships_whatsapp_phone_number_id', type_='unique')
+        batch_op.drop_column('whatsapp_phone_number_id')
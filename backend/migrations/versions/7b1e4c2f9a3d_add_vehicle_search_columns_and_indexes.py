@@ -0,0 +1,102 @@
+"""Add vehicle search columns and indexes
+
+Revision ID: 7b1e4c2f9a3d
+Revises: 3f6c2a9d1b7e
+Create Date: 2026-10-17 11:40:08.215664
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b1e4c2f9a3d'
+down_revision = '3f6c2a9d1b7e'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+COMPOSITE_INDEXES = {
+    'ix_vehicles_dealership_vendido_preco': ['dealership_id', 'vendido', 'preco'],
+    'ix_vehicles_dealership_vendido_ano_modelo': ['dealership_id', 'vendido', 'ano_modelo'],
+    'ix_vehicles_dealership_vendido_quilometragem': ['dealership_id', 'vendido', 'quilometragem'],
+    'ix_vehicles_dealership_vendido_marca_busca': ['dealership_id', 'vendido', 'marca_busca'],
+    'ix_vehicles_dealership_vendido_modelo_busca': ['dealership_id', 'vendido', 'modelo_busca'],
+}
+
+# LIKE '%...%' (VehicleList.get, cor) só usa índice com pg_trgm
+TRIGRAM_INDEXES = {
+    'ix_vehicles_marca_busca_trgm': 'marca_busca',
+    'ix_vehicles_modelo_busca_trgm': 'modelo_busca',
+    'ix_vehicles_cor_busca_trgm': 'cor_busca',
+}
+
+
+def normalize_search_text(value):
+    """Cópia de src/text_utils.normalize_search_text nesta revisão (minúsculas,
+    sem acentos, espaços simples): a carga não muda se o app mudar depois."""
+    if value is None:
+        return None
+    text = ''.join(c for c in unicodedata.normalize('NFKD', str(value)) if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def backfill_search_columns(bind):
+    vehicles = sa.table('vehicles',
+        sa.column('id', sa.Integer), sa.column('marca', sa.String), sa.column('modelo', sa.String),
+        sa.column('cor', sa.String), sa.column('marca_busca', sa.String),
+        sa.column('modelo_busca', sa.String), sa.column('cor_busca', sa.String))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(vehicles.c.id, vehicles.c.marca, vehicles.c.modelo, vehicles.c.cor)
+            .where(vehicles.c.id > last_id).order_by(vehicles.c.id).limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            vehicles.update().where(vehicles.c.id == sa.bindparam('row_id')).values(
+                marca_busca=sa.bindparam('marca_busca'), modelo_busca=sa.bindparam('modelo_busca'),
+                cor_busca=sa.bindparam('cor_busca')),
+            [{'row_id': row.id, 'marca_busca': normalize_search_text(row.marca),
+              'modelo_busca': normalize_search_text(row.modelo), 'cor_busca': normalize_search_text(row.cor)}
+             for row in rows]
+        )
+        last_id = rows[-1].id
+
+
+def upgrade():
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('marca_busca', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('modelo_busca', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('cor_busca', sa.String(length=30), nullable=True))
+
+    bind = op.get_bind()
+    backfill_search_columns(bind)
+
+    for name, columns in COMPOSITE_INDEXES.items():
+        op.create_index(name, 'vehicles', columns, unique=False)
+
+    if bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, column in TRIGRAM_INDEXES.items():
+            op.create_index(name, 'vehicles', [column], unique=False,
+                            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+        op.execute('ANALYZE vehicles')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in TRIGRAM_INDEXES:
+            op.drop_index(name, table_name='vehicles')
+    for name in COMPOSITE_INDEXES:
+        op.drop_index(name, table_name='vehicles')
+
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.drop_column('cor_busca')
+        batch_op.drop_column('modelo_busca')
+        batch_op.drop_column('marca_busca')
@@ -0,0 +1,45 @@
+"""Add import_jobs table
+
+Revision ID: 9d4a6f3b2e18
+Revises: c5d8e2a41f70
+Create Date: 2026-10-17 15:21:44.108532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4a6f3b2e18'
+down_revision = 'c5d8e2a41f70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dealership_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('file_path', sa.String(length=500), nullable=False),
+    sa.Column('mode', sa.String(length=10), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('error_rows', sa.Integer(), nullable=False),
+    sa.Column('rows_per_second', sa.Float(), nullable=False),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['dealership_id'], ['dealerships.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_import_jobs_dealership_id', 'import_jobs', ['dealership_id'], unique=False)
+    op.create_index('ix_import_jobs_status_created_at', 'import_jobs', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_import_jobs_status_created_at', table_name='import_jobs')
+    op.drop_index('ix_import_jobs_dealership_id', table_name='import_jobs')
+    op.drop_table('import_jobs')
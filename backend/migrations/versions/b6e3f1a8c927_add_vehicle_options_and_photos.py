@@ -0,0 +1,154 @@
+"""Add vehicle_options and vehicle_photos tables
+
+Revision ID: b6e3f1a8c927
+Revises: 4e7b9c1d5a26
+Create Date: 2026-10-17 17:21:45.318207
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e3f1a8c927'
+down_revision = '4e7b9c1d5a26'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Cópia de src/vehicle_attributes.py e src/text_utils.py como estavam nesta
+# revisão: a carga da migração não muda se a normalização do app mudar depois.
+KNOWN_OPCIONAIS = [
+    "ar condicionado", "direção hidráulica", "direção elétrica", "vidros elétricos", "teto solar", "rodas de liga leve", "banco de couro", "sensor de estacionamento", "câmera de ré", "piloto automático", "airbag", "freios abs", "multimídia", "gps", "alarme", "travas elétricas"
+]
+
+OPTION_MAX_LENGTH = 255
+
+OPTION_ALIASES = {
+    'ar-condicionado': 'ar condicionado',
+    'ar cond': 'ar condicionado',
+    'ar cond.': 'ar condicionado',
+    'a/c': 'ar condicionado',
+    'ar condicionado digital': 'ar condicionado',
+    'dir. hidraulica': 'direcao hidraulica',
+    'dir hidraulica': 'direcao hidraulica',
+    'dir. eletrica': 'direcao eletrica',
+    'vidro eletrico': 'vidros eletricos',
+    'trava eletrica': 'travas eletricas',
+    'rodas de liga': 'rodas de liga leve',
+    'roda de liga leve': 'rodas de liga leve',
+    'rodas liga leve': 'rodas de liga leve',
+    'bancos de couro': 'banco de couro',
+    'banco em couro': 'banco de couro',
+    'bancos em couro': 'banco de couro',
+    'sensor de re': 'sensor de estacionamento',
+    'sensores de estacionamento': 'sensor de estacionamento',
+    'camera de estacionamento': 'camera de re',
+    'controle de cruzeiro': 'piloto automatico',
+    'airbags': 'airbag',
+    'air bag': 'airbag',
+    'air bags': 'airbag',
+    'abs': 'freios abs',
+    'freio abs': 'freios abs',
+    'central multimidia': 'multimidia',
+    'kit multimidia': 'multimidia',
+    'navegador': 'gps',
+    'teto solar panoramico': 'teto solar',
+}
+
+
+def normalize_search_text(value):
+    if value is None:
+        return None
+    text = ''.join(c for c in unicodedata.normalize('NFKD', str(value)) if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+_KNOWN = {normalize_search_text(option): option for option in KNOWN_OPCIONAIS}
+
+
+def canonical_option(item):
+    label = (item or '').strip()[:OPTION_MAX_LENGTH]
+    key = normalize_search_text(label)
+    key = OPTION_ALIASES.get(key, key)
+    return key, _KNOWN.get(key, label)
+
+
+def split_options(itens_opcionais):
+    options = {}
+    for item in (itens_opcionais or '').split(';'):
+        if item.strip():
+            key, label = canonical_option(item)
+            options.setdefault(key, label)
+    return list(options.items())
+
+
+def split_photos(link_fotos):
+    return [url.strip() for url in (link_fotos or '').split(';') if url.strip()]
+
+
+def backfill_children(bind):
+    vehicles = sa.table('vehicles',
+        sa.column('id', sa.Integer), sa.column('itens_opcionais', sa.Text), sa.column('link_fotos', sa.Text))
+    vehicle_options = sa.table('vehicle_options',
+        sa.column('vehicle_id', sa.Integer), sa.column('option', sa.String), sa.column('label', sa.String))
+    vehicle_photos = sa.table('vehicle_photos',
+        sa.column('vehicle_id', sa.Integer), sa.column('position', sa.Integer), sa.column('url', sa.Text))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(vehicles.c.id, vehicles.c.itens_opcionais, vehicles.c.link_fotos)
+            .where(vehicles.c.id > last_id).order_by(vehicles.c.id).limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        options = [{'vehicle_id': row.id, 'option': option, 'label': label}
+                   for row in rows for option, label in split_options(row.itens_opcionais)]
+        photos = [{'vehicle_id': row.id, 'position': position, 'url': url}
+                  for row in rows for position, url in enumerate(split_photos(row.link_fotos))]
+        if options:
+            bind.execute(vehicle_options.insert(), options)
+        if photos:
+            bind.execute(vehicle_photos.insert(), photos)
+        last_id = rows[-1].id
+
+
+def upgrade():
+    op.create_table('vehicle_options',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('vehicle_id', sa.Integer(), nullable=False),
+    sa.Column('option', sa.String(length=255), nullable=False),
+    sa.Column('label', sa.String(length=255), nullable=False),
+    sa.ForeignKeyConstraint(['vehicle_id'], ['vehicles.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('vehicle_id', 'option', name='uq_vehicle_options_vehicle_option')
+    )
+    op.create_table('vehicle_photos',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('vehicle_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('url', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['vehicle_id'], ['vehicles.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    bind = op.get_bind()
+    backfill_children(bind)
+
+    # Índices depois da carga: mais rápido que mantê-los linha a linha
+    op.create_index('ix_vehicle_options_option_vehicle', 'vehicle_options', ['option', 'vehicle_id'], unique=False)
+    op.create_index('ix_vehicle_photos_vehicle_position', 'vehicle_photos', ['vehicle_id', 'position'], unique=False)
+    if bind.dialect.name == 'postgresql':
+        op.execute('ANALYZE vehicle_options')
+        op.execute('ANALYZE vehicle_photos')
+
+
+def downgrade():
+    op.drop_index('ix_vehicle_photos_vehicle_position', table_name='vehicle_photos')
+    op.drop_index('ix_vehicle_options_option_vehicle', table_name='vehicle_options')
+    op.drop_table('vehicle_photos')
+    op.drop_table('vehicle_options')
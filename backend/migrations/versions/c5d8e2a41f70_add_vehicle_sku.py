@@ -0,0 +1,28 @@
+"""Add vehicle sku
+
+Revision ID: c5d8e2a41f70
+Revises: 7b1e4c2f9a3d
+Create Date: 2026-10-17 14:05:52.630914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d8e2a41f70'
+down_revision = '7b1e4c2f9a3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sku', sa.String(length=64), nullable=True))
+    op.create_index('ix_vehicles_dealership_sku', 'vehicles', ['dealership_id', 'sku'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_vehicles_dealership_sku', table_name='vehicles')
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.drop_column('sku')
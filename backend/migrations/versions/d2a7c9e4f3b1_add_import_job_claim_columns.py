@@ -0,0 +1,28 @@
+"""Add import job attempts and locked_at
+
+Revision ID: d2a7c9e4f3b1
+Revises: b6e3f1a8c927
+Create Date: 2026-10-17 18:42:10.215374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c9e4f3b1'
+down_revision = 'b6e3f1a8c927'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('locked_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.drop_column('locked_at')
+        batch_op.drop_column('attempts')
@@ -0,0 +1,26 @@
+"""Add dealership inventory_updated_at
+
+Revision ID: f4b8a1c6d2e9
+Revises: d2a7c9e4f3b1
+Create Date: 2026-10-17 19:05:37.480912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8a1c6d2e9'
+down_revision = 'd2a7c9e4f3b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('dealerships', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('inventory_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('dealerships', schema=None) as batch_op:
+        batch_op.drop_column('inventory_updated_at')
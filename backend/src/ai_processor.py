@@ -1,11 +1,21 @@
 import google.generativeai as genai
-import os
-from src.models import Vehicle, Dealership
+from src.models import Vehicle, Dealership, VehicleOption
 from src.database import db
 from sqlalchemy import or_, and_
 import json
 import logging
+import os
 import traceback
+from src.cache import create_cache
+from src.text_utils import normalize_message, normalize_search_text
+from src.vehicle_attributes import KNOWN_OPCIONAIS
+from src.services.intent_extractor import extract_fast_path, get_inventory_matcher, get_inventory_vocabulary
+from src.services.inventory_index import INVENTORY_INDEX_ENABLED, get_inventory_index
+from src.services.vehicle_ranking import RANKING_COLUMNS, rank, ranking_frame
+from src.services.vector_index import SEMANTIC_MIN_SIMILARITY, semantic_scores
+from src.services.conversation_session import get_session, save_search
+from src.services.vehicle_cards import get_vehicle_card
+from src import metrics
 
 # Configura logger para imprimir no console
 logger = logging.getLogger("ai_processor")
@@ -18,14 +28,98 @@ logger.setLevel(logging.INFO)
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 model = genai.GenerativeModel('gemini-1.5-pro-latest')
 
-# Lista de opcionais conhecidos para busca
-KNOWN_OPCIONAIS = [
-    "ar condicionado", "direção hidráulica", "direção elétrica", "vidros elétricos", "teto solar", "rodas de liga leve", "banco de couro", "sensor de estacionamento", "câmera de ré", "piloto automático", "airbag", "freios abs", "multimídia", "gps", "alarme", "travas elétricas"
-]
+# Veículos por página na conversa ("Ver mais resultados" traz a próxima)
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '3'))
+
+# Incrementar sempre que o prompt de extração mudar, para invalidar o cache
+PROMPT_VERSION = '2'
+
+# Extrator por regras na frente do Gemini (ver services/intent_extractor.py)
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', 'true').lower() == 'true'
+
+# Cache da extração de parâmetros: mensagens repetidas ("oi", "tem corolla?",
+# títulos de botões) não voltam ao Gemini
+extraction_cache = create_cache(
+    'ai_extraction',
+    maxsize=int(os.getenv('EXTRACTION_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('EXTRACTION_CACHE_TTL', '86400'))
+)
+
+class ExtractionParseError(Exception):
+    """O Gemini respondeu algo que não é um JSON válido."""
+
+    def __init__(self, message, raw_text):
+        super().__init__(message)
+        self.raw_text = raw_text
 
 def log_ai_event(event: str, data: dict):
     logger.info(f"[AI Gemini] {event}: {json.dumps(data, ensure_ascii=False)}")
 
+def extraction_cache_key(user_message):
+    return f"v{PROMPT_VERSION}:{normalize_message(user_message)}"
+
+def build_extraction_prompt(dealership, user_message):
+    return f"""
+    Você é um assistente de vendas da concessionária '{dealership.name}'.
+    Analise a mensagem do cliente e extraia os seguintes parâmetros de busca de veículos, se mencionados:
+    - marca (string)
+    - modelo (string)
+    - ano_min (integer)
+    - ano_max (integer)
+    - preco_min (float)
+    - preco_max (float)
+    - cor (string)
+    - quilometragem_max (integer)
+    - opcionais (lista de strings, apenas se o cliente mencionar opcionais como ar condicionado, direção hidráulica, teto solar, etc)
+    - descricao (string, o que o cliente descreve e não cabe nos campos acima, como "econômico pra família" ou "SUV pra estrada de terra")
+    IMPORTANTE: Retorne APENAS um objeto JSON válido, sem explicações, sem comentários, sem texto extra.
+    Se nenhum parâmetro for identificado, retorne um JSON vazio {{}}.
+    Se a mensagem for uma saudação ou pergunta genérica, retorne {{"intent": "greeting"}}.
+    Se a mensagem não parecer relacionada a busca de carros, retorne {{"intent": "other"}}.
+    Mensagem do cliente: "{user_message}"
+    JSON:
+    """
+
+def extract_search_params(dealership, user_message):
+    """Extrai os parâmetros de busca da mensagem.
+
+    Ordem: extrator por regras (sem I/O), cache de extrações e, por fim, o Gemini.
+    """
+    if FAST_PATH_ENABLED:
+        fast_params = extract_fast_path(user_message, get_inventory_vocabulary(dealership.id), KNOWN_OPCIONAIS,
+                                        match_term=get_inventory_matcher(dealership.id))
+        if fast_params is not None:
+            log_ai_event("parametros_fast_path", {"user_message": user_message, "params": fast_params})
+            return fast_params
+
+    cache_key = extraction_cache_key(user_message)
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        metrics.increment('ai.extraction_cache.hits')
+        log_ai_event("parametros_do_cache", {"user_message": user_message, "params": cached})
+        return dict(cached)
+    metrics.increment('ai.extraction_cache.misses')
+
+    prompt = build_extraction_prompt(dealership, user_message)
+    log_ai_event("prompt_enviado", {"prompt": prompt, "user_message": user_message})
+    metrics.increment('ai.gemini.calls')
+    response = model.generate_content(prompt)
+    raw_text = response.text.strip().replace('`', '')
+    log_ai_event("resposta_bruta_gemini", {"raw_text": raw_text})
+    if raw_text.lower().startswith("json"):
+        raw_text = raw_text[4:].strip()
+    try:
+        start = raw_text.find('{')
+        end = raw_text.rfind('}') + 1
+        json_candidate = raw_text[start:end] if start != -1 and end != -1 else raw_text
+        extracted_params = json.loads(json_candidate)
+    except Exception as e:
+        log_ai_event("erro_json_parse", {"erro": str(e), "raw_text": raw_text, "trace": traceback.format_exc()})
+        raise ExtractionParseError(str(e), raw_text)
+    log_ai_event("parametros_extraidos", {"params": extracted_params})
+    extraction_cache.set(cache_key, extracted_params)
+    return dict(extracted_params)
+
 def format_vehicles_for_whatsapp(vehicles):
     if not vehicles:
         return [{
@@ -34,47 +128,34 @@ def format_vehicles_for_whatsapp(vehicles):
         }]
     results = []
     for v in vehicles:
-        fotos = [url.strip() for url in (v.link_fotos or '').split(';') if url.strip()]
-        image_url = fotos[0] if fotos else None
-        text = f"*{v.marca} {v.modelo} {v.ano_modelo}*\n" \
-               f"Preço: R$ {v.preco:,.2f}\n" \
-               f"Cor: {v.cor}\n" \
-               f"Quilometragem: {v.quilometragem:,} km\n" \
-               f"Câmbio: {v.cambio}\n" \
-               f"Combustível: {v.combustivel}\n" \
-               f"Itens: {v.itens_opcionais if v.itens_opcionais else 'Não informado'}"
+        card = get_vehicle_card(v)
         results.append({
-            'text': text,
-            'image': image_url
+            'text': card['list'],
+            'image': card['photos'][0] if card['photos'] else None,
+            'vehicle_id': v.id
         })
     return results
 
-def search_vehicles_in_db(dealership_id, query_params):
-    """Busca veículos no DB com base nos parâmetros extraídos pela IA."""
+def _word_match(column, term):
+    """Termo como palavra inteira na coluna *_busca (ex: Gol não casa com Golf)."""
+    return or_(
+        column == term,  # Busca exata
+        column.like(f"{term} %"),  # Termo seguido de espaço
+        column.like(f"% {term}"),  # Termo precedido de espaço
+        column.like(f"% {term} %")  # Termo entre espaços
+    )
+
+def build_vehicle_search_query(dealership_id, query_params):
+    """Query de busca no DB com base nos parâmetros extraídos pela IA."""
     base_query = Vehicle.query.filter_by(dealership_id=dealership_id, vendido=False)
 
-    # Aplicar filtros baseados em query_params (extraídos pela IA)
+    # Aplicar filtros baseados em query_params (extraídos pela IA), usando as
+    # colunas normalizadas (minúsculas, sem acento) que têm índice
     if query_params.get('modelo'):
         # Busca exata por modelo, evitando confusões (ex: Gol vs Golf)
-        modelo = query_params['modelo'].strip().lower()
-        base_query = base_query.filter(
-            or_(
-                Vehicle.modelo.ilike(f"{modelo}"),  # Busca exata
-                Vehicle.modelo.ilike(f"{modelo} %"),  # Modelo seguido de espaço
-                Vehicle.modelo.ilike(f"% {modelo}"),  # Modelo precedido de espaço
-                Vehicle.modelo.ilike(f"% {modelo} %")  # Modelo entre espaços
-            )
-        )
+        base_query = base_query.filter(_word_match(Vehicle.modelo_busca, normalize_search_text(query_params['modelo'])))
     if query_params.get('marca'):
-        marca = query_params['marca'].strip().lower()
-        base_query = base_query.filter(
-            or_(
-                Vehicle.marca.ilike(f"{marca}"),  # Busca exata
-                Vehicle.marca.ilike(f"{marca} %"),  # Marca seguida de espaço
-                Vehicle.marca.ilike(f"% {marca}"),  # Marca precedida de espaço
-                Vehicle.marca.ilike(f"% {marca} %")  # Marca entre espaços
-            )
-        )
+        base_query = base_query.filter(_word_match(Vehicle.marca_busca, normalize_search_text(query_params['marca'])))
     if query_params.get('preco_max'):
         base_query = base_query.filter(Vehicle.preco <= query_params['preco_max'])
     if query_params.get('preco_min'):
@@ -84,54 +165,98 @@ def search_vehicles_in_db(dealership_id, query_params):
     if query_params.get('ano_max'):
         base_query = base_query.filter(Vehicle.ano_modelo <= query_params['ano_max'])
     if query_params.get('cor'):
-        cor = query_params['cor'].strip().lower()
-        base_query = base_query.filter(Vehicle.cor.ilike(f"%{cor}%"))
+        base_query = base_query.filter(Vehicle.cor_busca.like(f"%{normalize_search_text(query_params['cor'])}%"))
     if query_params.get('quilometragem_max'):
         base_query = base_query.filter(Vehicle.quilometragem <= query_params['quilometragem_max'])
+    # opcionais não filtram: contam na pontuação do ranking (vehicle_ranking)
+
+    return base_query.order_by(Vehicle.id)
+
+def rank_vehicles_in_db(dealership_id, query_params, limit=5, after=None, semantic=None):
+    """Candidatos do DB ordenados pelo ranking: (chave, veículo).
+
+    Só as colunas do ranking vêm de todos os candidatos; os veículos completos
+    são carregados apenas para a página.
+    """
+    candidates = build_vehicle_search_query(dealership_id, query_params)
+    rows = candidates.with_entities(*(getattr(Vehicle, name) for name in RANKING_COLUMNS)).all()
+    option_keys = None
+    if query_params.get('opcionais'):
+        # opcionais canônicos (vehicle_options) dos candidatos, para a pontuação
+        option_keys = {}
+        for vehicle_id, option in db.session.query(VehicleOption.vehicle_id, VehicleOption.option).filter(
+                VehicleOption.vehicle_id.in_(candidates.with_entities(Vehicle.id).order_by(None))):
+            option_keys.setdefault(vehicle_id, set()).add(option)
+    ranked = rank(ranking_frame((tuple(row) for row in rows), option_keys), query_params, limit, after=after,
+                  semantic=semantic)
+    vehicles = {v.id: v for v in Vehicle.query.filter(Vehicle.id.in_([vehicle_id for vehicle_id, _ in ranked]))}
+    return [(key, vehicles[vehicle_id]) for vehicle_id, key in ranked if vehicle_id in vehicles]
+
+def search_vehicles_in_db(dealership_id, query_params, limit=5, after=None):
+    """Busca veículos no DB com base nos parâmetros extraídos pela IA.
+
+    `after` é o cursor (chave do ranking do último veículo da página
+    anterior): a próxima página vem por keyset, sem OFFSET.
+    """
+    return [vehicle for _, vehicle in rank_vehicles_in_db(dealership_id, query_params, limit=limit, after=after)]
 
-    vehicles = base_query.limit(5).all()  # Limitar resultados
-    return vehicles
+def search_vehicles_ranked(dealership_id, query_params, limit=5, after=None):
+    """Busca da conversa: índice em memória, ou o banco se desativado.
 
-def process_message_with_ai(dealership_id, user_message):
+    Com `descricao`, os filtros continuam decidindo os candidatos e a
+    semelhança semântica entra na pontuação do ranking (busca híbrida).
+    """
+    semantic = semantic_scores(dealership_id, query_params.get('descricao'))
+    if INVENTORY_INDEX_ENABLED:
+        return get_inventory_index(dealership_id).search_ranked(query_params, limit=limit, after=after,
+                                                                semantic=semantic)
+    return rank_vehicles_in_db(dealership_id, query_params, limit=limit, after=after, semantic=semantic)
+
+def search_vehicles(dealership_id, query_params, limit=5, after=None):
+    return [vehicle for _, vehicle in search_vehicles_ranked(dealership_id, query_params, limit=limit, after=after)]
+
+def search_page(dealership_id, query_params, after=None, sender=None):
+    """Uma página (SEARCH_PAGE_SIZE) de resultados; com `sender`, grava a
+    busca e o cursor da próxima página na sessão da conversa.
+
+    Marca/modelo sem nenhum veículo no estoque (ex.: "corola" vindo do Gemini)
+    são trocados pelo valor mais parecido antes da busca (só com o índice em
+    memória, que é quem tem os trigramas do estoque)."""
+    if INVENTORY_INDEX_ENABLED:
+        query_params = get_inventory_index(dealership_id).resolve_params(query_params)
+    ranked = search_vehicles_ranked(dealership_id, query_params, limit=SEARCH_PAGE_SIZE + 1, after=after)
+    page, has_more = ranked[:SEARCH_PAGE_SIZE], len(ranked) > SEARCH_PAGE_SIZE
+    if sender:
+        save_search(dealership_id, sender, [v.id for _, v in page], query_params,
+                    cursor=page[-1][0] if has_more else None)
+    return [vehicle for _, vehicle in page]
+
+def next_results_page(dealership_id, sender):
+    """Próxima página da última busca da conversa, pelo cursor da sessão
+    (sem nova extração da IA). None se não houver mais resultados ou a
+    sessão tiver expirado."""
+    session = get_session(dealership_id, sender)
+    if not session.get('cursor'):
+        return None
+    return format_vehicles_for_whatsapp(
+        search_page(dealership_id, session['filters'], after=session['cursor'], sender=sender))
+
+def process_message_with_ai(dealership_id, user_message, sender=None):
+    """Responde à mensagem; com `sender`, a busca fica na sessão da conversa."""
     dealership = Dealership.query.get(dealership_id)
     if not dealership:
         log_ai_event("erro_concessionaria", {"dealership_id": dealership_id})
         return [{"text": "Desculpe, não consegui identificar a concessionária.", "image": None}]
-    prompt = f"""
-    Você é um assistente de vendas da concessionária '{dealership.name}'.
-    Analise a mensagem do cliente e extraia os seguintes parâmetros de busca de veículos, se mencionados:
-    - marca (string)
-    - modelo (string)
-    - ano_min (integer)
-    - ano_max (integer)
-    - preco_min (float)
-    - preco_max (float)
-    - cor (string)
-    - quilometragem_max (integer)
-    - opcionais (lista de strings, apenas se o cliente mencionar opcionais como ar condicionado, direção hidráulica, teto solar, etc)
-    IMPORTANTE: Retorne APENAS um objeto JSON válido, sem explicações, sem comentários, sem texto extra.
-    Se nenhum parâmetro for identificado, retorne um JSON vazio {{}}.
-    Se a mensagem for uma saudação ou pergunta genérica, retorne {{"intent": "greeting"}}.
-    Se a mensagem não parecer relacionada a busca de carros, retorne {{"intent": "other"}}.
-    Mensagem do cliente: "{user_message}"
-    JSON:
-    """
     try:
-        log_ai_event("prompt_enviado", {"prompt": prompt, "user_message": user_message})
-        response = model.generate_content(prompt)
-        raw_text = response.text.strip().replace('`', '')
-        log_ai_event("resposta_bruta_gemini", {"raw_text": raw_text})
-        if raw_text.lower().startswith("json"):
-            raw_text = raw_text[4:].strip()
         try:
-            start = raw_text.find('{')
-            end = raw_text.rfind('}') + 1
-            json_candidate = raw_text[start:end] if start != -1 and end != -1 else raw_text
-            extracted_params = json.loads(json_candidate)
-            log_ai_event("parametros_extraidos", {"params": extracted_params})
-        except Exception as e:
-            log_ai_event("erro_json_parse", {"erro": str(e), "raw_text": raw_text, "trace": traceback.format_exc()})
-            return [{"text": f"[DEBUG] Erro ao decodificar JSON: {str(e)}\nResposta bruta: {raw_text}", "image": None}]
+            extracted_params = extract_search_params(dealership, user_message)
+        except ExtractionParseError as e:
+            return [{"text": f"[DEBUG] Erro ao decodificar JSON: {str(e)}\nResposta bruta: {e.raw_text}", "image": None}]
+        if not extracted_params and \
+                semantic_scores(dealership_id, user_message, min_similarity=SEMANTIC_MIN_SIMILARITY):
+            # Nada que caiba nos filtros, mas a mensagem descreve algum veículo:
+            # busca só pela semelhança com ela
+            extracted_params = {"descricao": user_message}
         if extracted_params.get("intent") == "greeting":
             return [{"text": f"Olá! 👋 Bem-vindo à {dealership.name}. Como posso ajudar você a encontrar seu próximo carro? Me diga o que procura!", "image": None}]
         elif extracted_params.get("intent") in ["other", "fallback"]:
@@ -142,7 +267,7 @@ def process_message_with_ai(dealership_id, user_message):
             # Normalizar opcionais para busca
             if "opcionais" in extracted_params and isinstance(extracted_params["opcionais"], list):
                 extracted_params["opcionais"] = [op.lower() for op in extracted_params["opcionais"] if op.lower() in KNOWN_OPCIONAIS]
-            vehicles_found = search_vehicles_in_db(dealership_id, extracted_params)
+            vehicles_found = search_page(dealership_id, extracted_params, sender=sender)
             return format_vehicles_for_whatsapp(vehicles_found)
     except Exception as e:
         log_ai_event("erro_geral", {"erro": str(e), "trace": traceback.format_exc()})
@@ -0,0 +1,95 @@
+"""Backends de cache usados pelo backend (extração da IA, sessões, respostas).
+
+- MemoryCache: LRU com TTL dentro do processo (cachetools), thread-safe.
+- RedisCache: compartilhado entre processos/máquinas. Requer o pacote
+  `redis` (não está no requirements.txt; instale quando usar) e REDIS_URL.
+
+O backend é escolhido por CACHE_BACKEND=memory|redis. Os valores guardados
+no Redis precisam ser serializáveis em JSON.
+"""
+import json
+import os
+import threading
+
+from cachetools import TTLCache
+
+try:
+    import redis
+except ImportError:  # dependência opcional
+    redis = None
+
+
+class MemoryCache:
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self._data = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def add(self, key, value):
+        """Grava só se a chave não existe (atômico). Retorna True se gravou."""
+        with self._lock:
+            if key in self._data:
+                return False
+            self._data[key] = value
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class RedisCache:
+
+    def __init__(self, url, namespace, ttl=3600):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis requires the "redis" package')
+        self._client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def get(self, key):
+        raw = self._client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self._client.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=self.ttl)
+
+    def add(self, key, value):
+        """Grava só se a chave não existe (SET NX, atômico entre processos). Retorna True se gravou."""
+        return bool(self._client.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=self.ttl, nx=True))
+
+    def delete(self, key):
+        self._client.delete(self._key(key))
+
+    def clear(self):
+        for key in self._client.scan_iter(match=f'{self.namespace}:*', count=500):
+            self._client.delete(key)
+
+
+def create_cache(namespace, maxsize=10000, ttl=3600, backend=None):
+    """Cria o cache `namespace` no backend configurado (CACHE_BACKEND)."""
+    backend = backend or os.getenv('CACHE_BACKEND', 'memory')
+    if backend == 'redis':
+        return RedisCache(os.getenv('REDIS_URL', 'redis://localhost:6379/0'), namespace, ttl=ttl)
+    if backend == 'memory':
+        return MemoryCache(maxsize=maxsize, ttl=ttl)
+    raise ValueError(f'Invalid CACHE_BACKEND: {backend}')
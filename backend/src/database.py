@@ -1,3 +1,118 @@
+"""Instância do SQLAlchemy e configuração do engine do banco.
+
+O banco de produção é o PostgreSQL do Supabase. Sem configuração o engine
+usava o pool padrão (5 + 10 conexões, sem pre-ping nem reciclagem): com os
+webhooks concorrentes faltavam conexões, e depois de um período ocioso as
+conexões derrubadas pelo servidor davam erro na primeira consulta.
+
+engine_options() monta SQLALCHEMY_ENGINE_OPTIONS a partir do ambiente:
+
+- Pool por processo (DB_POOL_SIZE + DB_MAX_OVERFLOW). O padrão de
+  DB_POOL_SIZE é o número de threads do processo que usam o banco: as de
+  requisição (DB_WEB_THREADS) mais os workers do webhook (WEBHOOK_WORKERS e
+  WEBHOOK_DISPATCH_WORKERS) e da importação (IMPORT_WORKERS). Com vários processos (gunicorn -w N), o
+  total de conexões é N x (DB_POOL_SIZE + DB_MAX_OVERFLOW) e precisa caber
+  no limite do banco.
+- pre_ping (testa a conexão antes de usar), recycle (DB_POOL_RECYCLE) e
+  DB_POOL_TIMEOUT de espera por uma conexão livre.
+- statement_timeout e idle_in_transaction_session_timeout no servidor.
+- DB_POOLER=transaction para PgBouncer/Supavisor em modo transação (porta
+  6543 do Supabase): quem mantém o pool é o pooler, então o engine usa
+  NullPool, e os timeouts vão por SET LOCAL a cada transação, porque o
+  pooler não aceita parâmetros de sessão na conexão.
+
+A ocupação do pool aparece em /debug/metrics (pool_status).
+"""
+import os
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+from src import metrics
+
+db = SQLAlchemy()
+
+
+def _int_env(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def database_url(url=None):
+    """URL do banco; o Supabase entrega `postgres://`, que o SQLAlchemy 2 não aceita."""
+    url = url if url is not None else os.getenv('DATABASE_URL')
+    if url and url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def default_pool_size():
+    """Threads do processo que usam o banco (requisições + workers em segundo plano)."""
+    return (_int_env('DB_WEB_THREADS', 4) + _int_env('WEBHOOK_WORKERS', 4)
+            + _int_env('WEBHOOK_DISPATCH_WORKERS', 8) + _int_env('IMPORT_WORKERS', 2))
+
+
+def _timeout_settings():
+    return {
+        'statement_timeout': _int_env('DB_STATEMENT_TIMEOUT_MS', 30000),
+        'idle_in_transaction_session_timeout': _int_env('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 60000),
+    }
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS para `url` (só o PostgreSQL recebe pool e timeouts)."""
+    if not url or not url.startswith('postgresql'):
+        return {}
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'connect_args': {'connect_timeout': _int_env('DB_CONNECT_TIMEOUT', 5)},
+    }
+    if os.getenv('DB_POOLER', 'none') == 'transaction':
+        options['poolclass'] = NullPool
+        return options
+    options.update({
+        'pool_size': _int_env('DB_POOL_SIZE', default_pool_size()),
+        'max_overflow': _int_env('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': _int_env('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': _int_env('DB_POOL_RECYCLE', 1800),
+        'pool_use_lifo': True,  # conexões ociosas demais ficam no fundo e vencem pelo recycle
+    })
+    options['connect_args']['options'] = ' '.join(f'-c {name}={value}'
+                                                  for name, value in _timeout_settings().items() if value)
+    return options
+
+
+def _set_local_timeouts(connection):
+    for name, value in _timeout_settings().items():
+        if value:
+            connection.exec_driver_sql(f'SET LOCAL {name} = {int(value)}')
+
+
+def init_engine(app):
+    """Eventos do engine: contadores do pool e, com DB_POOLER=transaction, timeouts por transação."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == 'postgresql' and os.getenv('DB_POOLER', 'none') == 'transaction':
+        event.listen(engine, 'begin', _set_local_timeouts)
+    # eventos do pool registrados no engine: continuam valendo se o pool for recriado (dispose)
+    event.listen(engine, 'connect', lambda *args: metrics.increment('db.pool.connects'))
+    event.listen(engine, 'checkout', lambda *args: metrics.increment('db.pool.checkouts'))
+    event.listen(engine, 'invalidate', lambda *args: metrics.increment('db.pool.invalidated'))
+
 
-db = SQLAlchemy() 
\ No newline at end of file
+def pool_status(engine, max_overflow=None):
+    """Ocupação atual do pool do engine; `max_overflow` é o configurado (o QueuePool não o expõe)."""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        max_overflow = max_overflow or 0
+        capacity = pool.size() + max_overflow
+        status.update({
+            'size': pool.size(),
+            'max_overflow': max_overflow,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'utilization': round(pool.checkedout() / capacity, 4) if capacity else None,
+        })
+    return status
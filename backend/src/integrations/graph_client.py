@@ -0,0 +1,256 @@
+"""Cliente HTTP de longa duração para a Graph API (WhatsApp Cloud API).
+
+Uma única requests.Session com pool de conexões keep-alive é compartilhada
+por todas as threads do processo, então cada envio reaproveita a conexão
+TLS aberta com graph.facebook.com em vez de refazer o handshake.
+
+Retentativas, backoff e a pausa por cota esgotada ficam em GraphRetryPolicy,
+uma instância por processo (get_retry_policy) usada também pelo sender
+assíncrono (whatsapp_async): um 429 visto por um cliente segura o outro.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("graph_client")
+
+# Códigos de erro da Graph API que indicam limite de taxa
+# https://developers.facebook.com/docs/graph-api/overview/rate-limiting
+# https://developers.facebook.com/docs/whatsapp/cloud-api/support/error-codes
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80007, 130429, 131056}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class GraphAPIRateLimited(Exception):
+    """A Graph API pediu para esperar mais do que o cliente aceita bloquear."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Graph API rate limit: retry after {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def compute_backoff(attempt, base=0.5, maximum=8.0):
+    """Backoff exponencial com full jitter para a tentativa `attempt` (0-based)."""
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+def parse_retry_after(headers):
+    """Lê o header Retry-After (em segundos). Retorna None se ausente/inválido."""
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def parse_usage_headers(headers):
+    """Extrai o uso da cota dos headers X-App-Usage / X-Business-Use-Case-Usage.
+
+    Retorna (maior percentual de uso, segundos até recuperar o acesso).
+    """
+    max_usage = 0
+    regain_seconds = 0
+    app_usage = headers.get('X-App-Usage')
+    if app_usage:
+        try:
+            usage = json.loads(app_usage)
+            max_usage = max([max_usage] + [v for v in usage.values() if isinstance(v, (int, float))])
+        except (ValueError, AttributeError):
+            pass
+    business_usage = headers.get('X-Business-Use-Case-Usage')
+    if business_usage:
+        try:
+            for entries in json.loads(business_usage).values():
+                for entry in entries:
+                    max_usage = max(max_usage, entry.get('call_count', 0),
+                                    entry.get('total_cputime', 0), entry.get('total_time', 0))
+                    # estimated_time_to_regain_access vem em minutos
+                    regain_seconds = max(regain_seconds, entry.get('estimated_time_to_regain_access', 0) * 60)
+        except (ValueError, AttributeError, TypeError):
+            pass
+    return max_usage, regain_seconds
+
+
+def _graph_error_code(response):
+    try:
+        return response.json().get('error', {}).get('code')
+    except ValueError:
+        return None
+
+
+class GraphRetryPolicy:
+    """Quando repetir uma chamada à Graph API, quanto esperar, e a pausa global
+    pedida pela Meta quando a cota acaba. Thread-safe; o relógio é o
+    time.monotonic, o mesmo do event loop do asyncio."""
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=8.0, max_rate_limit_wait=30.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.usage = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def is_retryable(self, status, error_code=None):
+        if status in RETRYABLE_STATUS_CODES:
+            return True
+        return status >= 400 and error_code in RATE_LIMIT_ERROR_CODES
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Espera antes de repetir a tentativa `attempt` (0-based), ou None se acabaram.
+
+        Levanta GraphAPIRateLimited se a Meta pediu mais que max_rate_limit_wait.
+        """
+        if attempt >= self.max_retries:
+            return None
+        delay = retry_after if retry_after is not None else \
+            compute_backoff(attempt, self.backoff_base, self.backoff_max)
+        if delay > self.max_rate_limit_wait:
+            raise GraphAPIRateLimited(delay)
+        return delay
+
+    def record_usage(self, headers):
+        """Atualiza o uso da cota e a pausa global. Retorna o atraso pedido pela
+        Meta para esta resposta (Retry-After / tempo de recuperação), se houver."""
+        usage, regain_seconds = parse_usage_headers(headers)
+        retry_after = parse_retry_after(headers)
+        with self._lock:
+            self.usage = usage
+            if regain_seconds:
+                self._paused_until = max(self._paused_until, time.monotonic() + regain_seconds)
+        if regain_seconds:
+            logger.warning(f"Cota da Graph API esgotada ({usage}%); pausando envios por {regain_seconds}s")
+            return max(retry_after or 0, regain_seconds)
+        return retry_after
+
+    def pause_remaining(self):
+        """Segundos até o fim da pausa global (0 sem pausa); GraphAPIRateLimited se longa demais."""
+        with self._lock:
+            remaining = self._paused_until - time.monotonic()
+        if remaining <= 0:
+            return 0
+        if remaining > self.max_rate_limit_wait:
+            raise GraphAPIRateLimited(remaining)
+        return remaining
+
+
+class GraphAPIClient:
+    """Cliente thread-safe da Graph API com timeouts, retentativas e respeito
+    aos limites de taxa informados pela Meta."""
+
+    def __init__(self, base_url='https://graph.facebook.com', api_version='v17.0', token=None,
+                 connect_timeout=3.05, read_timeout=10.0, max_retries=3, backoff_base=0.5,
+                 backoff_max=8.0, max_rate_limit_wait=30.0, pool_maxsize=20, retry_policy=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_version = api_version
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry = retry_policy or GraphRetryPolicy(max_retries, backoff_base, backoff_max, max_rate_limit_wait)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def messages_url(self, phone_number_id):
+        return f"{self.base_url}/{self.api_version}/{phone_number_id}/messages"
+
+    def send_message(self, phone_number_id, payload):
+        """Envia um payload para /<phone_number_id>/messages e retorna o JSON."""
+        return self.post(self.messages_url(phone_number_id), payload)
+
+    @property
+    def usage(self):
+        return self.retry.usage
+
+    def post(self, url, payload):
+        attempt = 0
+        while True:
+            remaining = self.retry.pause_remaining()
+            if remaining:
+                time.sleep(remaining)
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.ConnectionError as e:
+                # Falha antes de a requisição chegar na Meta: seguro repetir.
+                # ReadTimeout não é repetido, pois a mensagem pode ter sido entregue.
+                delay = None if isinstance(e, requests.ReadTimeout) else self.retry.retry_delay(attempt)
+                if delay is None:
+                    raise
+                logger.warning(f"Erro de conexão com a Graph API ({e}); nova tentativa em {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            retry_after = self.retry.record_usage(response.headers)
+            error_code = _graph_error_code(response) if response.status_code >= 400 else None
+            if self.retry.is_retryable(response.status_code, error_code):
+                delay = self.retry.retry_delay(attempt, retry_after)
+                if delay is not None:
+                    logger.warning(f"Graph API respondeu {response.status_code}; nova tentativa em {delay:.2f}s")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+            response.raise_for_status()
+            return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+_retry_policy = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_policy():
+    """Política de retentativas e pausa por cota compartilhada pelos clientes do processo."""
+    global _retry_policy
+    if _retry_policy is None:
+        with _retry_policy_lock:
+            if _retry_policy is None:
+                _retry_policy = GraphRetryPolicy(
+                    max_retries=int(os.getenv('WHATSAPP_MAX_RETRIES', '3')),
+                    max_rate_limit_wait=float(os.getenv('WHATSAPP_MAX_RATE_LIMIT_WAIT', '30'))
+                )
+    return _retry_policy
+
+
+def get_graph_client():
+    """Retorna o cliente compartilhado do processo, criando-o na primeira chamada."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphAPIClient(
+                    base_url=os.getenv('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com'),
+                    api_version=os.getenv('WHATSAPP_API_VERSION', 'v17.0'),
+                    token=os.getenv('WHATSAPP_TOKEN'),
+                    connect_timeout=float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '3.05')),
+                    read_timeout=float(os.getenv('WHATSAPP_READ_TIMEOUT', '10')),
+                    pool_maxsize=int(os.getenv('WHATSAPP_POOL_SIZE', '20')),
+                    retry_policy=get_retry_policy()
+                )
+    return _client
+
+
+def reset_graph_client():
+    """Descarta o cliente compartilhado (ex.: após trocar variáveis de ambiente)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -1,72 +1,99 @@
 import os
-import requests
 from flask import current_app
 import json
+from src.integrations.graph_client import get_graph_client
+from src.integrations.whatsapp_async import get_async_sender
 
-def send_whatsapp_message(to_number, message, image_url=None, buttons=None):
+def build_message_payload(to_number, message, image_url=None, buttons=None):
+    """Monta o payload da Cloud API para texto, imagem ou botões."""
+    # Remove prefixos e caracteres não numéricos
+    to_number = to_number.replace('whatsapp:', '').replace('+', '').strip()
+
+    # Prepara o payload base
+    payload = {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": to_number
+    }
+
+    # Se tiver botões, cria mensagem interativa
+    if buttons:
+        payload["type"] = "interactive"
+        payload["interactive"] = {
+            "type": "button",
+            "body": {
+                "text": message
+            },
+            "action": {
+                "buttons": buttons
+            }
+        }
+    # Se tiver imagem, envia como mensagem com mídia
+    elif image_url:
+        payload["type"] = "image"
+        payload["image"] = {
+            "link": image_url,
+            "caption": message
+        }
+    # Caso contrário, envia mensagem de texto simples
+    else:
+        payload["type"] = "text"
+        payload["text"] = {
+            "body": message
+        }
+    return payload
+
+def send_whatsapp_message(to_number, message, image_url=None, buttons=None, phone_number_id=None):
     """
     Envia uma mensagem usando a API do WhatsApp Business.
+
+    A requisição passa pelo cliente compartilhado da Graph API (conexões
+    keep-alive, timeouts e retentativas); ver graph_client.py.
     
     Args:
         to_number (str): Número do destinatário no formato internacional (ex: 5511999999999)
         message (str): Texto da mensagem
         image_url (str, optional): URL da imagem a ser enviada
         buttons (list, optional): Lista de botões para mensagem interativa
+        phone_number_id (str, optional): Número da loja que envia (padrão: WHATSAPP_PHONE_NUMBER_ID)
     """
     try:
-        # Remove prefixos e caracteres não numéricos
-        to_number = to_number.replace('whatsapp:', '').replace('+', '').strip()
-        
-        # Configuração da API
-        api_url = f"https://graph.facebook.com/v17.0/{os.getenv('WHATSAPP_PHONE_NUMBER_ID')}/messages"
-        headers = {
-            "Authorization": f"Bearer {os.getenv('WHATSAPP_TOKEN')}",
-            "Content-Type": "application/json"
-        }
-        
-        # Prepara o payload base
-        payload = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": to_number
-        }
-        
-        # Se tiver botões, cria mensagem interativa
-        if buttons:
-            payload["type"] = "interactive"
-            payload["interactive"] = {
-                "type": "button",
-                "body": {
-                    "text": message
-                },
-                "action": {
-                    "buttons": buttons
-                }
-            }
-        # Se tiver imagem, envia como mensagem com mídia
-        elif image_url:
-            payload["type"] = "image"
-            payload["image"] = {
-                "link": image_url,
-                "caption": message
-            }
-        # Caso contrário, envia mensagem de texto simples
-        else:
-            payload["type"] = "text"
-            payload["text"] = {
-                "body": message
-            }
+        payload = build_message_payload(to_number, message, image_url=image_url, buttons=buttons)
         
         # Log detalhado do payload
         current_app.logger.info(f"Payload WhatsApp: {json.dumps(payload, ensure_ascii=False)}")
         
         # Faz a requisição
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
+        result = get_graph_client().send_message(phone_number_id or os.getenv('WHATSAPP_PHONE_NUMBER_ID'), payload)
         
-        current_app.logger.info(f"Mensagem enviada com sucesso para {to_number}")
-        return response.json()
+        current_app.logger.info(f"Mensagem enviada com sucesso para {payload['to']}")
+        return result
         
     except Exception as e:
         current_app.logger.error(f"Erro ao enviar mensagem WhatsApp: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def send_whatsapp_batch(to_number, steps, phone_number_id=None):
+    """
+    Envia várias mensagens para um destinatário pelo sender assíncrono.
+
+    Args:
+        to_number (str): Número do destinatário no formato internacional
+        steps (list): Passos executados em ordem. Cada passo é um dict com os
+            argumentos de send_whatsapp_message (message, image_url, buttons)
+            ou uma lista desses dicts, enviados em paralelo entre si.
+        phone_number_id (str, optional): Número da loja que envia (padrão: WHATSAPP_PHONE_NUMBER_ID)
+    """
+    payload_steps = []
+    for step in steps:
+        if isinstance(step, list):
+            payload_steps.append([build_message_payload(to_number, **item) for item in step])
+        else:
+            payload_steps.append(build_message_payload(to_number, **step))
+    try:
+        results = get_async_sender().send(phone_number_id or os.getenv('WHATSAPP_PHONE_NUMBER_ID'), to_number, payload_steps)
+        current_app.logger.info(f"{sum(len(s) if isinstance(s, list) else 1 for s in payload_steps)} mensagens enviadas para {to_number}")
+        return results
+    except Exception as e:
+        current_app.logger.error(f"Erro ao enviar lote de mensagens WhatsApp: {str(e)}")
+        raise
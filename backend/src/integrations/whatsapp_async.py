@@ -0,0 +1,179 @@
+"""Envio assíncrono (asyncio + aiohttp) de várias mensagens do WhatsApp.
+
+Um event loop dedicado roda em uma thread de fundo com uma única
+aiohttp.ClientSession. Mensagens independentes (ex.: as fotos de um anúncio)
+são enviadas em paralelo, com limite de requisições simultâneas global e por
+destinatário. Lotes para o mesmo destinatário são executados na ordem em
+que foram submetidos. Retentativas, backoff e a pausa por cota esgotada vêm
+da mesma GraphRetryPolicy do cliente síncrono (graph_client).
+"""
+import asyncio
+import logging
+import os
+import threading
+
+import aiohttp
+from src.integrations.graph_client import GraphRetryPolicy, get_retry_policy
+
+logger = logging.getLogger("whatsapp_async")
+
+
+class AsyncWhatsAppSender:
+
+    def __init__(self, base_url='https://graph.facebook.com', api_version='v17.0', token=None,
+                 max_in_flight=32, max_in_flight_per_recipient=5, connect_timeout=3.05,
+                 read_timeout=10.0, max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 max_rate_limit_wait=30.0, retry_policy=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_version = api_version
+        self.token = token
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_recipient = max_in_flight_per_recipient
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry_policy or GraphRetryPolicy(max_retries, backoff_base, backoff_max, max_rate_limit_wait)
+
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._global_limit = None
+        # destinatário -> [lock de ordem, semáforo, referências]
+        self._recipients = {}
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(self._open())
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name='whatsapp-async-sender', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+        self._global_limit = asyncio.Semaphore(self.max_in_flight)
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def send(self, phone_number_id, to_number, steps, timeout=None):
+        """Envia um lote para um destinatário e bloqueia até terminar.
+
+        `steps` é uma lista executada em ordem; cada item é um payload (enviado
+        sozinho) ou uma lista de payloads (enviados em paralelo entre si).
+        Retorna a lista de respostas na mesma estrutura. Levanta a primeira
+        exceção encontrada, depois que o lote termina.
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(
+            self._send_steps(phone_number_id, to_number, steps), self._loop)
+        return future.result(timeout)
+
+    async def _send_steps(self, phone_number_id, to_number, steps):
+        state = self._recipients.setdefault(
+            to_number, [asyncio.Lock(), asyncio.Semaphore(self.max_in_flight_per_recipient), 0])
+        state[2] += 1
+        url = f"{self.base_url}/{self.api_version}/{phone_number_id}/messages"
+        try:
+            async with state[0]:
+                results = []
+                for step in steps:
+                    if isinstance(step, list):
+                        group = await asyncio.gather(
+                            *[self._post(url, payload, state[1]) for payload in step],
+                            return_exceptions=True)
+                        for result in group:
+                            if isinstance(result, BaseException):
+                                raise result
+                        results.append(group)
+                    else:
+                        results.append(await self._post(url, step, state[1]))
+                return results
+        finally:
+            state[2] -= 1
+            if state[2] == 0:
+                self._recipients.pop(to_number, None)
+
+    async def _post(self, url, payload, recipient_limit):
+        attempt = 0
+        while True:
+            remaining = self.retry.pause_remaining()
+            if remaining:
+                await asyncio.sleep(remaining)
+            request_error = None
+            async with recipient_limit, self._global_limit:
+                try:
+                    async with self._session.post(url, json=payload) as response:
+                        status = response.status
+                        headers = response.headers
+                        body = await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    request_error = e
+            if request_error is not None:
+                delay = self.retry.retry_delay(attempt)
+                if delay is None:
+                    raise request_error
+                logger.warning(f"Erro na chamada à Graph API ({request_error!r}); nova tentativa em {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            retry_after = self.retry.record_usage(headers)
+            error_code = (body or {}).get('error', {}).get('code') if isinstance(body, dict) else None
+            if self.retry.is_retryable(status, error_code):
+                delay = self.retry.retry_delay(attempt, retry_after)
+                if delay is not None:
+                    logger.warning(f"Graph API respondeu {status}; nova tentativa em {delay:.2f}s")
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+            if status >= 400:
+                raise aiohttp.ClientResponseError(
+                    None, (), status=status, message=str((body or {}).get('error', body)))
+            return body
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_async_sender():
+    """Retorna o sender assíncrono compartilhado do processo."""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = AsyncWhatsAppSender(
+                    base_url=os.getenv('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com'),
+                    api_version=os.getenv('WHATSAPP_API_VERSION', 'v17.0'),
+                    token=os.getenv('WHATSAPP_TOKEN'),
+                    max_in_flight=int(os.getenv('WHATSAPP_MAX_IN_FLIGHT', '32')),
+                    max_in_flight_per_recipient=int(os.getenv('WHATSAPP_MAX_IN_FLIGHT_PER_RECIPIENT', '5')),
+                    connect_timeout=float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '3.05')),
+                    read_timeout=float(os.getenv('WHATSAPP_READ_TIMEOUT', '10')),
+                    retry_policy=get_retry_policy()
+                )
+    return _sender
@@ -8,8 +8,12 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 from werkzeug.exceptions import HTTPException
 from sqlalchemy import text
-from src.database import db
+from src.database import database_url, db, engine_options, init_engine
 from src.routes import main_bp, init_jwt, whatsapp_bp
+from src.services.webhook_queue import init_webhook_queue
+from src.services.import_jobs import init_import_jobs
+from src.services.vector_index import init_vector_index
+from src.services.whatsapp_service import process_webhook_payload
 from flask_migrate import Migrate
 
 # Adiciona o diretório pai ao sys.path - NÃO ALTERE!
@@ -19,15 +23,18 @@ load_dotenv() # Carrega variáveis do .env
 
 # Configuração do logging
 def setup_logging(app):
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/backend.log', maxBytes=10240, backupCount=10)
+    log_file = os.getenv('LOG_FILE', 'logs/backend.log')
+    app.logger.setLevel(logging.INFO)
+    if not log_file:  # vazio = sem arquivo (testes)
+        return
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    file_handler = RotatingFileHandler(log_file, maxBytes=10240, backupCount=10)
     file_handler.setFormatter(logging.Formatter(
         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
     ))
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
     app.logger.info('Backend startup')
 
 app = Flask(__name__)
@@ -46,21 +53,33 @@ CORS(app,
      supports_credentials=True)
 
 # Configuração do Banco de Dados
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+# Pool, pre-ping e timeouts do PostgreSQL (ver src/database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'default_secret_key')
 app.config['JSON_SORT_KEYS'] = False  # Mantém a ordem das chaves no JSON
 
 # Inicializa o SQLAlchemy com a app
 db.init_app(app)
+init_engine(app)
 
 # Importar modelos e rotas
-from src.models import Dealership, Vehicle, User, Plan
+from src.models import Dealership, Vehicle, User, Plan, WebhookJob, ImportJob
 
 # Registrar Blueprints
 app.register_blueprint(whatsapp_bp, url_prefix='/whatsapp')
 app.register_blueprint(main_bp)
 
+# Fila do webhook do WhatsApp (workers sobem sob demanda)
+init_webhook_queue(app, process_webhook_payload)
+
+# Importações de planilhas em segundo plano (pool próprio, separado do webhook)
+init_import_jobs(app)
+
+# Índice vetorial da busca semântica (comando `flask embeddings-build`)
+init_vector_index(app)
+
 # Error handlers
 @app.errorhandler(HTTPException)
 def handle_exception(e):
@@ -106,22 +125,6 @@ def hello():
         "status": "operational"
     })
 
-@app.route('/debug/vehicles')
-def debug_vehicles():
-    try:
-        vehicles = Vehicle.query.all()
-        return jsonify({
-            "status": "success",
-            "count": len(vehicles),
-            "vehicles": [vehicle.to_dict() for vehicle in vehicles]
-        })
-    except Exception as e:
-        app.logger.error(f"Error fetching vehicles: {str(e)}")
-        return jsonify({
-            "status": "error",
-            "message": str(e)
-        }), 500
-
 def init_db():
     with app.app_context():
         db.create_all()
@@ -0,0 +1,33 @@
+"""Contadores simples em memória, expostos em /debug/metrics."""
+import threading
+from collections import Counter
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name):
+    with _lock:
+        return _counters[name]
+
+
+def hit_rate(hits_name, misses_name):
+    with _lock:
+        hits, misses = _counters[hits_name], _counters[misses_name]
+    total = hits + misses
+    return round(hits / total, 4) if total else None
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
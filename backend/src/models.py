@@ -1,9 +1,14 @@
 # src/models.py
 from src.database import db # Importa a instância db de database.py
 from datetime import datetime
+import json
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import validates
 import re
 from werkzeug.security import generate_password_hash, check_password_hash
+from src.text_utils import normalize_search_text
+from src.serializers import compile_serializer
+from src.vehicle_attributes import option_labels, split_options, split_photos
 
 class Dealership(db.Model):
     __tablename__ = 'dealerships'
@@ -11,6 +16,7 @@ class Dealership(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     whatsapp_number = db.Column(db.String(20), unique=True, nullable=False)
+    whatsapp_phone_number_id = db.Column(db.String(32), unique=True)  # id do número na Cloud API (metadata.phone_number_id)
     email = db.Column(db.String(120), unique=True, nullable=False)
     cnpj = db.Column(db.String(18), unique=True, nullable=False)
     address = db.Column(db.String(200))
@@ -21,6 +27,7 @@ class Dealership(db.Model):
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    inventory_updated_at = db.Column(db.DateTime)  # última escrita no estoque (services/inventory_version.py)
     
     # Relationships
     vehicles = db.relationship('Vehicle', backref='dealership', lazy=True, cascade='all, delete-orphan')
@@ -66,9 +73,26 @@ class Dealership(db.Model):
 
 class Vehicle(db.Model):
     __tablename__ = 'vehicles'
+    # Índices dos filtros da busca (VehicleList.get / search_vehicles_in_db).
+    # Os trigram (pg_trgm) atendem os LIKE '%...%' e só existem no PostgreSQL.
+    __table_args__ = (
+        db.Index('ix_vehicles_dealership_vendido_preco', 'dealership_id', 'vendido', 'preco'),
+        db.Index('ix_vehicles_dealership_vendido_ano_modelo', 'dealership_id', 'vendido', 'ano_modelo'),
+        db.Index('ix_vehicles_dealership_vendido_quilometragem', 'dealership_id', 'vendido', 'quilometragem'),
+        db.Index('ix_vehicles_dealership_vendido_marca_busca', 'dealership_id', 'vendido', 'marca_busca'),
+        db.Index('ix_vehicles_dealership_vendido_modelo_busca', 'dealership_id', 'vendido', 'modelo_busca'),
+        db.Index('ix_vehicles_dealership_sku', 'dealership_id', 'sku'),
+        db.Index('ix_vehicles_marca_busca_trgm', 'marca_busca', postgresql_using='gin',
+                 postgresql_ops={'marca_busca': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_vehicles_modelo_busca_trgm', 'modelo_busca', postgresql_using='gin',
+                 postgresql_ops={'modelo_busca': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_vehicles_cor_busca_trgm', 'cor_busca', postgresql_using='gin',
+                 postgresql_ops={'cor_busca': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     dealership_id = db.Column(db.Integer, db.ForeignKey('dealerships.id'), nullable=False)
+    sku = db.Column(db.String(64))  # Código do veículo no sistema da loja (sincronização de estoque)
     
     # Basic Information
     marca = db.Column(db.String(50), nullable=False)
@@ -95,9 +119,18 @@ class Vehicle(db.Model):
     vendido = db.Column(db.Boolean, default=False, nullable=False)
     
     # Additional Information
-    itens_opcionais = db.Column(db.Text)  # Lista separada por ;
-    link_fotos = db.Column(db.Text)  # URLs separadas por ;
+    itens_opcionais = db.Column(db.Text)  # Lista separada por ; (também em vehicle_options)
+    link_fotos = db.Column(db.Text)  # URLs separadas por ; (também em vehicle_photos)
     observacoes = db.Column(db.Text)
+    options = db.relationship('VehicleOption', lazy=True, cascade='all, delete-orphan', passive_deletes=True,
+                              order_by='VehicleOption.id')
+    photos = db.relationship('VehiclePhoto', lazy=True, cascade='all, delete-orphan', passive_deletes=True,
+                             order_by='VehiclePhoto.position')
+    
+    # Search (minúsculas e sem acento, mantidas pelos validators abaixo)
+    marca_busca = db.Column(db.String(50))
+    modelo_busca = db.Column(db.String(50))
+    cor_busca = db.Column(db.String(30))
     
     # Metadata
     data_cadastro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -113,6 +146,11 @@ class Vehicle(db.Model):
             raise ValueError(f'Invalid {key}: must be between 1900 and {current_year + 1}')
         return year
     
+    @validates('marca', 'modelo', 'cor')
+    def validate_search_fields(self, key, value):
+        setattr(self, f'{key}_busca', normalize_search_text(value))
+        return value
+    
     @validates('quilometragem')
     def validate_quilometragem(self, key, value):
         if value is None:
@@ -127,6 +165,25 @@ class Vehicle(db.Model):
             raise ValueError(f'{key} cannot be negative')
         return value
     
+    @validates('itens_opcionais')
+    def validate_itens_opcionais(self, key, value):
+        # Só as diferenças: manter as linhas existentes evita violar
+        # (vehicle_id, option) único quando o mesmo opcional continua na lista
+        wanted = dict(split_options(value))
+        for option in list(self.options):
+            if option.option not in wanted:
+                self.options.remove(option)
+            else:
+                option.label = wanted.pop(option.option)
+        for option, label in wanted.items():
+            self.options.append(VehicleOption(option=option, label=label))
+        return value
+
+    @validates('link_fotos')
+    def validate_link_fotos(self, key, value):
+        self.photos = [VehiclePhoto(position=position, url=url) for position, url in enumerate(split_photos(value))]
+        return value
+
     @validates('estado')
     def validate_estado(self, key, value):
         if value not in ['Novo', 'Usado', None]:
@@ -149,38 +206,49 @@ class Vehicle(db.Model):
     
     def to_dict(self):
         """Convert vehicle instance to dictionary"""
-        return {
-            'id': self.id,
-            'dealership_id': self.dealership_id,
-            'marca': self.marca,
-            'modelo': self.modelo,
-            'versao': self.versao,
-            'ano_fabricacao': self.ano_fabricacao,
-            'ano_modelo': self.ano_modelo,
-            'quilometragem': self.quilometragem,
-            'estado': self.estado,
-            'cambio': self.cambio,
-            'combustivel': self.combustivel,
-            'motor': self.motor,
-            'potencia': self.potencia,
-            'final_placa': self.final_placa,
-            'cor': self.cor,
-            'preco': self.preco,
-            'preco_promocional': self.preco_promocional,
-            'destaque': self.destaque,
-            'destaque_ate': self.destaque_ate.isoformat() if self.destaque_ate else None,
-            'vendido': self.vendido,
-            'itens_opcionais': self.itens_opcionais.split(';') if self.itens_opcionais else [],
-            'link_fotos': self.link_fotos.split(';') if self.link_fotos else [],
-            'observacoes': self.observacoes,
-            'data_cadastro': self.data_cadastro.isoformat(),
-            'data_atualizacao': self.data_atualizacao.isoformat(),
-            'data_venda': self.data_venda.isoformat() if self.data_venda else None
-        }
+        return _vehicle_dict(self)
     
     def __repr__(self):
         return f'<Vehicle {self.marca} {self.modelo} {self.ano_modelo}>'
 
+# Campos de Vehicle.to_dict, compilados uma vez (ver src/serializers.py)
+VEHICLE_DICT_FIELDS = ('id', 'dealership_id', 'sku', 'marca', 'modelo', 'versao', 'ano_fabricacao', 'ano_modelo',
+                       'quilometragem', 'estado', 'cambio', 'combustivel', 'motor', 'potencia', 'final_placa',
+                       'cor', 'preco', 'preco_promocional', 'destaque', 'destaque_ate', 'vendido',
+                       'itens_opcionais', 'link_fotos', 'observacoes', 'data_cadastro', 'data_atualizacao',
+                       'data_venda')
+_vehicle_dict = compile_serializer(Vehicle, VEHICLE_DICT_FIELDS,
+                                   {'itens_opcionais': option_labels, 'link_fotos': split_photos})
+
+# Os índices trigram precisam da extensão pg_trgm (db.create_all no PostgreSQL)
+event.listen(Vehicle.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+class VehicleOption(db.Model):
+    """Opcional do veículo na forma canônica (vehicle_attributes.canonical_option)."""
+    __tablename__ = 'vehicle_options'
+    __table_args__ = (
+        db.UniqueConstraint('vehicle_id', 'option', name='uq_vehicle_options_vehicle_option'),
+        # Filtro por opcional: option = ... -> vehicle_id sem ler a tabela
+        db.Index('ix_vehicle_options_option_vehicle', 'option', 'vehicle_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'), nullable=False)
+    option = db.Column(db.String(255), nullable=False)  # normalizada (minúscula, sem acento)
+    label = db.Column(db.String(255), nullable=False)  # como exibida
+
+class VehiclePhoto(db.Model):
+    __tablename__ = 'vehicle_photos'
+    __table_args__ = (
+        db.Index('ix_vehicle_photos_vehicle_position', 'vehicle_id', 'position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    url = db.Column(db.Text, nullable=False)
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -215,6 +283,71 @@ class Plan(db.Model):
     def __repr__(self):
         return f'<Plan {self.plan_type} for User {self.user_id}>'
 
+class WebhookJob(db.Model):
+    __tablename__ = 'webhook_jobs'
+    __table_args__ = (
+        db.Index('ix_webhook_jobs_status_available_at', 'status', 'available_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON bruto recebido do WhatsApp
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, processing, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<WebhookJob {self.id} {self.status}>'
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    __table_args__ = (
+        db.Index('ix_import_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    dealership_id = db.Column(db.Integer, db.ForeignKey('dealerships.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)  # cópia do upload até o fim do processamento
+    mode = db.Column(db.String(10), default='append', nullable=False)  # append, sync
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    locked_at = db.Column(db.DateTime)  # renovado a cada bloco; parado há muito tempo = worker morreu
+    rows = db.Column(db.Integer, default=0, nullable=False)
+    error_rows = db.Column(db.Integer, default=0, nullable=False)
+    rows_per_second = db.Column(db.Float, default=0.0, nullable=False)
+    result = db.Column(db.Text)  # JSON com o resumo final da importação
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        """Convert import job instance to dictionary"""
+        data = {
+            'id': self.id,
+            'dealership_id': self.dealership_id,
+            'filename': self.filename,
+            'mode': self.mode,
+            'status': self.status,
+            'rows': self.rows,
+            'error_rows': self.error_rows,
+            'rows_per_second': self.rows_per_second,
+            'error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if self.result:
+            data.update(json.loads(self.result))
+        return data
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.status}>'
+
 # Não se esqueça de criar as tabelas no banco de dados!
 # Dentro do shell Python (após ativar venv):
 # from src.main import app, db
@@ -1,15 +1,31 @@
 from flask import Blueprint, jsonify, request, current_app
-from src.database import db
-from src.models import Vehicle, Dealership, User, Plan
+from src.database import db, pool_status
+from src.models import Vehicle, Dealership, User, Plan, ImportJob
 from sqlalchemy import or_, and_
 from datetime import datetime, timedelta
-import pandas as pd
-import io
 import logging
 import os
 from src.ai_processor import process_message_with_ai
+from src.services.webhook_dispatcher import dispatch_webhook_messages, iter_webhook_messages
+from src.integrations.graph_client import get_graph_client
+from src.services.inventory_index import invalidate_inventory_index, update_inventory_index
+from src.services.vector_index import invalidate_vector_index
+from src.services.vehicle_cards import invalidate_vehicle_card
+from src.services.inventory_version import (
+    bump_dealerships_version, bump_inventory_version, conditional_get, dealerships_version, listing_version
+)
+from src.services.vehicle_options import filter_by_options
+from src.services.vehicle_list_cache import cached_list_response, list_cache_key
+from src.services.vehicle_listing import (
+    LIST_MAX_PAGE_SIZE, LIST_PAGE_SIZE, ListingError, decode_cursor, fetch_page, next_page_headers,
+    parse_fields, parse_format, parse_limit, stream_response
+)
+from src.vehicle_attributes import canonical_option, split_photos
+from src.services.dealership_router import get_dealership_router
+from src import metrics
+from src.serializers import columns_serializer, json_response
+from src.text_utils import normalize_search_text
 import traceback
-import requests
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_restx import Api, Resource, fields, Namespace
@@ -57,6 +73,7 @@ dealership_model = api.model('Dealership', {
     'id': fields.Integer(readonly=True),
     'name': fields.String(required=True, description='Nome da concessionária'),
     'whatsapp_number': fields.String(required=True, description='Número do WhatsApp'),
+    'whatsapp_phone_number_id': fields.String(description='ID do número na WhatsApp Cloud API'),
     'email': fields.String(required=True, description='Email da concessionária'),
     'cnpj': fields.String(required=True, description='CNPJ da concessionária'),
     'address': fields.String(description='Endereço'),
@@ -70,6 +87,7 @@ dealership_model = api.model('Dealership', {
 vehicle_model = api.model('Vehicle', {
     'id': fields.Integer(readonly=True),
     'dealership_id': fields.Integer(required=True, description='ID da concessionária'),
+    'sku': fields.String(description='Código do veículo no sistema da loja'),
     'marca': fields.String(required=True, description='Marca do veículo'),
     'modelo': fields.String(required=True, description='Modelo do veículo'),
     'versao': fields.String(description='Versão do veículo'),
@@ -89,6 +107,11 @@ vehicle_model = api.model('Vehicle', {
     'vendido': fields.Boolean(description='Status de venda')
 })
 
+# Campos das respostas (serializadores compilados em src/serializers.py, no
+# lugar do marshal_with do flask-restx); em GET /vehicles/ também os aceitos em `fields`
+DEALERSHIP_FIELDS = tuple(dealership_model.keys())
+VEHICLE_LIST_FIELDS = tuple(vehicle_model.keys())
+
 # JWT Setup
 jwt = JWTManager()
 
@@ -140,6 +163,8 @@ class UserRegistration(Resource):
             user.set_password(password)
             db.session.add(user)
             db.session.commit()
+            if dealership:
+                bump_dealerships_version()
 
             current_app.logger.info(f"User {email} registered successfully")
             return {'message': 'User registered successfully'}, 201
@@ -199,18 +224,21 @@ class UserLogin(Resource):
 # Dealership Routes
 @dealership_ns.route('/')
 class DealershipList(Resource):
-    @dealership_ns.marshal_list_with(dealership_model)
+    @dealership_ns.response(200, 'Success', [dealership_model])
     def get(self):
         """List all active dealerships"""
         try:
-            dealerships = Dealership.query.filter_by(active=True).all()
-            return dealerships
+            def build():
+                dealerships = Dealership.query.filter_by(active=True) \
+                    .with_entities(*[getattr(Dealership, field) for field in DEALERSHIP_FIELDS]).all()
+                return json_response(columns_serializer(Dealership, DEALERSHIP_FIELDS, positional=True).many(dealerships))
+            return conditional_get(dealerships_version(), build)
         except Exception as e:
             current_app.logger.error(f"Error fetching dealerships: {str(e)}")
             return {'error': 'Internal server error'}, 500
 
     @dealership_ns.expect(dealership_model)
-    @dealership_ns.marshal_with(dealership_model, code=201)
+    @dealership_ns.response(201, 'Created', dealership_model)
     def post(self):
         """Create a new dealership"""
         try:
@@ -227,8 +255,9 @@ class DealershipList(Resource):
             dealership = Dealership(**data)
             db.session.add(dealership)
             db.session.commit()
+            bump_dealerships_version()
             
-            return dealership, 201
+            return json_response(columns_serializer(Dealership, DEALERSHIP_FIELDS)(dealership), 201)
             
         except Exception as e:
             db.session.rollback()
@@ -238,62 +267,54 @@ class DealershipList(Resource):
 # Vehicle Routes
 @vehicle_ns.route('/')
 class VehicleList(Resource):
-    @vehicle_ns.marshal_list_with(vehicle_model)
+    @vehicle_ns.doc(params={
+        'dealership_id': 'ID da concessionária (obrigatório)',
+        'limit': f'Veículos por página (padrão {LIST_PAGE_SIZE}, máximo {LIST_MAX_PAGE_SIZE})',
+        'cursor': 'Cursor da próxima página (cabeçalho X-Next-Cursor da resposta anterior)',
+        'fields': 'Campos separados por vírgula (ex.: id,marca,modelo,preco)',
+        'format': 'ndjson ou json: exporta todos os veículos do filtro em streaming, sem paginar'
+    })
+    @vehicle_ns.response(200, 'Success', [vehicle_model])
     def get(self):
-        """List all vehicles with optional filters"""
+        """List vehicles with optional filters, paginated by cursor"""
         try:
             dealership_id = request.args.get('dealership_id', type=int)
             if not dealership_id:
                 return {'error': 'dealership_id is required'}, 400
 
-            marca = request.args.get('marca')
-            modelo = request.args.get('modelo')
-            min_price = request.args.get('min_price', type=float)
-            max_price = request.args.get('max_price', type=float)
-            estado = request.args.get('estado')
-            cambio = request.args.get('cambio')
-            combustivel = request.args.get('combustivel')
-            final_placa = request.args.get('final_placa')
-            destaque = request.args.get('destaque', type=bool)
-            
-            query = Vehicle.query.filter_by(dealership_id=dealership_id, vendido=False)
-            
-            if marca:
-                query = query.filter(Vehicle.marca.ilike(f'%{marca}%'))
-            if modelo:
-                query = query.filter(Vehicle.modelo.ilike(f'%{modelo}%'))
-            if min_price is not None:
-                query = query.filter(Vehicle.preco >= min_price)
-            if max_price is not None:
-                query = query.filter(Vehicle.preco <= max_price)
-            if estado:
-                query = query.filter(Vehicle.estado == estado)
-            if cambio:
-                query = query.filter(Vehicle.cambio == cambio)
-            if combustivel:
-                query = query.filter(Vehicle.combustivel == combustivel)
-            if final_placa:
-                query = query.filter(Vehicle.final_placa == final_placa)
-            if destaque:
-                query = query.filter(
-                    and_(
-                        Vehicle.destaque == True,
-                        or_(
-                            Vehicle.destaque_ate == None,
-                            Vehicle.destaque_ate > datetime.utcnow()
-                        )
-                    )
-                )
-            
-            vehicles = query.all()
-            return vehicles
+            try:
+                fields = parse_fields(request.args.get('fields'), VEHICLE_LIST_FIELDS)
+                limit = parse_limit(request.args.get('limit'))
+                after = decode_cursor(request.args.get('cursor'))
+                export_format = parse_format(request.args.get('format'))
+            except ListingError as e:
+                return {'error': str(e)}, 400
+
+            filters = _vehicle_list_filters(request.args)
+            stamp = listing_version(dealership_id, destaque=bool(filters['destaque']))
+
+            def build():
+                query = _vehicle_list_query(dealership_id, filters)
+                if export_format:
+                    return stream_response(query, fields, export_format, after)
+                vehicles, next_cursor = fetch_page(query, fields, limit, after)
+                return json_response(vehicles, headers=next_page_headers(next_cursor, request.path, request.args))
+
+            def build_cached():
+                if export_format:
+                    return build()
+                key_filters = dict(filters, fields=fields, limit=limit, after=after)
+                # a versão de listing_version já muda quando um destaque vence
+                return cached_list_response(list_cache_key(dealership_id, stamp['version'], key_filters), build)
+
+            return conditional_get(stamp, build_cached)
             
         except Exception as e:
             current_app.logger.error(f"Error fetching vehicles: {str(e)}")
             return {'error': 'Internal server error'}, 500
 
     @vehicle_ns.expect(vehicle_model)
-    @vehicle_ns.marshal_with(vehicle_model, code=201)
+    @vehicle_ns.response(201, 'Created', vehicle_model)
     def post(self):
         """Create a new vehicle"""
         try:
@@ -311,28 +332,98 @@ class VehicleList(Resource):
             vehicle = Vehicle(**data)
             db.session.add(vehicle)
             db.session.commit()
+            _inventory_changed(vehicle.dealership_id, vehicle)
             
-            return vehicle, 201
+            return json_response(columns_serializer(Vehicle, VEHICLE_LIST_FIELDS)(vehicle), 201)
             
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Error creating vehicle: {str(e)}")
             return {'error': 'Internal server error'}, 500
 
+def _vehicle_list_filters(args):
+    """GET /vehicles/ filters, normalized (also part of the response cache key)"""
+    opcionais = {canonical_option(option)[0] for option in (args.get('opcionais') or '').split(',') if option.strip()}
+    return {
+        'marca': normalize_search_text(args.get('marca')) or None,
+        'modelo': normalize_search_text(args.get('modelo')) or None,
+        'min_price': args.get('min_price', type=float),
+        'max_price': args.get('max_price', type=float),
+        'estado': args.get('estado') or None,
+        'cambio': args.get('cambio') or None,
+        'combustivel': args.get('combustivel') or None,
+        'final_placa': args.get('final_placa') or None,
+        'destaque': args.get('destaque', type=bool) or None,
+        'opcionais': sorted(opcionais) or None,
+    }
+
+def _vehicle_list_query(dealership_id, filters):
+    """Unsold vehicles of the dealership matching the GET /vehicles/ filters"""
+    query = Vehicle.query.filter_by(dealership_id=dealership_id, vendido=False)
+    
+    if filters['marca']:
+        query = query.filter(Vehicle.marca_busca.like(f"%{filters['marca']}%"))
+    if filters['modelo']:
+        query = query.filter(Vehicle.modelo_busca.like(f"%{filters['modelo']}%"))
+    if filters['min_price'] is not None:
+        query = query.filter(Vehicle.preco >= filters['min_price'])
+    if filters['max_price'] is not None:
+        query = query.filter(Vehicle.preco <= filters['max_price'])
+    if filters['estado']:
+        query = query.filter(Vehicle.estado == filters['estado'])
+    if filters['cambio']:
+        query = query.filter(Vehicle.cambio == filters['cambio'])
+    if filters['combustivel']:
+        query = query.filter(Vehicle.combustivel == filters['combustivel'])
+    if filters['final_placa']:
+        query = query.filter(Vehicle.final_placa == filters['final_placa'])
+    if filters['opcionais']:
+        query = filter_by_options(query, filters['opcionais'])
+    if filters['destaque']:
+        query = query.filter(
+            and_(
+                Vehicle.destaque == True,
+                or_(
+                    Vehicle.destaque_ate == None,
+                    Vehicle.destaque_ate > datetime.utcnow()
+                )
+            )
+        )
+    return query
+
+def _inventory_changed(dealership_id, vehicle=None):
+    """Keep the in-memory and vector indexes, inventory versions and cached WhatsApp cards in sync after a committed write."""
+    bump_inventory_version(dealership_id)
+    invalidate_vector_index(dealership_id)
+    if vehicle is not None:
+        invalidate_vehicle_card(vehicle.id)
+        if vehicle.dealership_id != dealership_id:
+            bump_inventory_version(vehicle.dealership_id)
+            invalidate_vector_index(vehicle.dealership_id)
+    if vehicle is not None and vehicle.dealership_id == dealership_id:
+        update_inventory_index(vehicle)
+    else:
+        invalidate_inventory_index(dealership_id)
+        if vehicle is not None:
+            invalidate_inventory_index(vehicle.dealership_id)
+
 @main_bp.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
 def update_vehicle(vehicle_id):
     try:
         vehicle = Vehicle.query.get_or_404(vehicle_id)
+        previous_dealership_id = vehicle.dealership_id
         data = request.get_json()
         
         # Update fields
         for field, value in data.items():
-            if hasattr(vehicle, field):
+            # *_busca, options e photos são derivados das colunas de texto
+            if hasattr(vehicle, field) and not field.endswith('_busca') and field not in ('options', 'photos'):
                 if field == 'destaque_ate' and value:
                     value = datetime.fromisoformat(value)
                 setattr(vehicle, field, value)
         
         db.session.commit()
+        _inventory_changed(previous_dealership_id, vehicle)
         return jsonify({
             'message': 'Vehicle updated successfully',
             'vehicle': vehicle.to_dict()
@@ -350,6 +441,7 @@ def mark_vehicle_sold(vehicle_id):
         vehicle.vendido = True
         vehicle.data_venda = datetime.utcnow()
         db.session.commit()
+        _inventory_changed(vehicle.dealership_id, vehicle)
         return jsonify({'message': 'Vehicle marked as sold successfully'})
     except Exception as e:
         db.session.rollback()
@@ -379,84 +471,32 @@ def upload_vehicles():
         if not dealership:
             return jsonify({'error': 'Dealership not found'}), 404
         
-        # Read file
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(file.read()))
-        else:  # .xlsx
-            df = pd.read_excel(io.BytesIO(file.read()))
-        
-        # Process vehicles
-        vehicles_created = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Map column names (case-insensitive)
-                column_mapping = {
-                    'marca': ['Marca', 'MARCA', 'marca'],
-                    'modelo': ['Modelo', 'MODELO', 'modelo'],
-                    'versao': ['Versão', 'Versao', 'VERSÃO', 'VERSAO'],
-                    'ano_fabricacao': ['Ano Fabricação', 'Ano Fabricacao', 'ANO FABRICAÇÃO', 'ANO FABRICACAO'],
-                    'ano_modelo': ['Ano Modelo', 'ANO MODELO'],
-                    'quilometragem': ['Quilometragem', 'QUILOMETRAGEM'],
-                    "estado": ['Estado', 'ESTADO'],
-                    'cambio': ['Câmbio', 'Cambio', 'CÂMBIO', 'CAMBIO'],
-                    'combustivel': ['Combustível', 'Combustivel', 'COMBUSTÍVEL', 'COMBUSTIVEL'],
-                    'motor': ['Motor', 'MOTOR'],
-                    'potencia': ['Potência', 'Potencia', 'POTÊNCIA', 'POTENCIA'],
-                    'final_placa': ['Final Placa', 'FINAL PLACA'],
-                    'cor': ['Cor', 'COR'],
-                    'preco': ['Preço', 'Preco', 'PREÇO', 'PRECO'],
-                    'preco_promocional': ['Preço Promocional', 'Preco Promocional', 'PREÇO PROMOCIONAL', 'PRECO PROMOCIONAL'],
-                    'itens_opcionais': ['Itens Opcionais', 'ITENS OPCIONAIS'],
-                    'link_fotos': ['Link Fotos', 'LINK FOTOS'],
-                    'observacoes': ['Observações', 'Observacoes', 'OBSERVAÇÕES', 'OBSERVACOES']
-                }
-                
-                # Create vehicle data dictionary
-                vehicle_data = {'dealership_id': dealership_id}
-                
-                for field, possible_names in column_mapping.items():
-                    for name in possible_names:
-                        if name in df.columns and pd.notna(row[name]):
-                            vehicle_data[field] = row[name]
-                            break
-                
-                # Create vehicle
-                vehicle = Vehicle(**vehicle_data)
-                db.session.add(vehicle)
-                vehicles_created += 1
-                
-            except Exception as e:
-                errors.append(f"Error in row {index + 2}: {str(e)}")
-                continue
+        # append: só insere; sync: a planilha é o estoque completo (insere, atualiza e marca vendidos)
+        mode = request.form.get('mode', 'append')
+        if mode not in ('append', 'sync'):
+            return jsonify({'error': 'Invalid mode. Use append or sync.'}), 400
         
-        if vehicles_created > 0:
-            db.session.commit()
-            return jsonify({
-                'message': f'{vehicles_created} vehicles processed successfully',
-                'errors': errors if errors else None
-            }), 201
-        else:
-            return jsonify({
-                'error': 'No vehicles were processed',
-                'errors': errors
-            }), 400
+        # O arquivo é gravado e processado em segundo plano; o status é consultado pelo id
+        job = current_app.extensions['import_jobs'].submit(file, dealership.id, mode)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/upload/vehicles/{job.id}'
+        }), 202
             
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error processing file: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-def send_whatsapp_message(phone_number, message, image_url=None):
+@main_bp.route('/api/upload/vehicles/<int:job_id>', methods=['GET'])
+def upload_status(job_id):
+    """Get progress and result of a vehicle import job"""
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+def send_whatsapp_message(phone_number, message, image_url=None, phone_number_id=None):
     """Envia mensagem usando a API do WhatsApp Business."""
-    url = f"https://graph.facebook.com/v17.0/{os.getenv('WHATSAPP_PHONE_NUMBER_ID')}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {os.getenv('WHATSAPP_TOKEN')}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "messaging_product": "whatsapp",
         "to": phone_number,
@@ -475,9 +515,7 @@ def send_whatsapp_message(phone_number, message, image_url=None):
         }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()
+        return get_graph_client().send_message(phone_number_id or os.getenv('WHATSAPP_PHONE_NUMBER_ID'), payload)
     except Exception as e:
         current_app.logger.error(f"Error sending WhatsApp message: {str(e)}")
         return None
@@ -488,154 +526,170 @@ def whatsapp_webhook():
         data = request.get_json()
         if not data or 'entry' not in data:
             return jsonify({'error': 'Invalid webhook payload'}), 400
-            
-        # Extrai a mensagem do payload do WhatsApp Business API
-        entry = data['entry'][0]
-        changes = entry.get('changes', [])
-        if not changes:
-            return jsonify({'error': 'No changes in webhook payload'}), 400
-            
-        value = changes[0].get('value', {})
-        messages = value.get('messages', [])
-        if not messages:
+
+        # A Meta pode agrupar várias mensagens no mesmo POST
+        if next(iter_webhook_messages(data), None) is None:
             return jsonify({'error': 'No messages in webhook payload'}), 400
-            
-        message = messages[0]
-        incoming_msg = message.get('text', {}).get('body', '').strip().lower()
-        sender_phone_number = message.get('from', '')
 
-        current_app.logger.info(f"Mensagem recebida de {sender_phone_number}: {incoming_msg}")
-        dealership = Dealership.query.filter_by(active=True).first()
-        if not dealership:
+        # Cada mensagem vai para a concessionária dona do número que a recebeu
+        router = get_dealership_router()
+        if not router.dealership_ids:
             return jsonify({'error': 'No active dealership found'}), 404
 
-        # Detecta resposta de botão
-        if incoming_msg.startswith("quero saber mais"):
-            # Tenta extrair o modelo do texto
+        def handle(message, metadata):
+            metadata = metadata or {}
+            dealership_id = router.resolve(metadata)
+            if dealership_id is None:
+                current_app.logger.warning(
+                    f"Mensagem de {message.get('from')} descartada: nenhuma concessionária para o "
+                    f"phone_number_id {metadata.get('phone_number_id')} "
+                    f"(número {metadata.get('display_phone_number')})")
+                return
+            _handle_legacy_whatsapp_message(dealership_id, message, metadata.get('phone_number_id'))
+
+        dispatch_webhook_messages(data, handle)
+        return ('', 204)
+    except Exception as e:
+        current_app.logger.error(f"Error in WhatsApp webhook: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def _handle_legacy_whatsapp_message(dealership_id, message, phone_number_id=None):
+    """Responde a uma mensagem do lote recebido pelo webhook legado."""
+    incoming_msg = message.get('text', {}).get('body', '').strip().lower()
+    sender_phone_number = message.get('from', '')
+
+    current_app.logger.info(f"Mensagem recebida de {sender_phone_number}: {incoming_msg}")
+    # Detecta resposta de botão
+    if incoming_msg.startswith("quero saber mais"):
+        # Tenta extrair o modelo do texto
+        modelo = None
+        palavras = incoming_msg.split()
+        if len(palavras) > 3:
+            modelo = ' '.join(palavras[3:]).strip()
+        if not modelo:
             modelo = None
-            palavras = incoming_msg.split()
-            if len(palavras) > 3:
-                modelo = ' '.join(palavras[3:]).strip()
-            if not modelo:
-                modelo = None
-            # Busca veículo pelo modelo
-            veiculo = None
-            if modelo:
-                veiculo = Vehicle.query.filter(
-                    Vehicle.dealership_id == dealership.id,
-                    Vehicle.modelo.ilike(f"%{modelo}%"),
-                    Vehicle.vendido == False
-                ).first()
-            if veiculo:
-                fotos = [url.strip() for url in (veiculo.link_fotos or '').split(';') if url.strip()]
-                image_url = fotos[0] if fotos else None
-                mensagem = f"*{veiculo.marca} {veiculo.modelo} {veiculo.ano_modelo}*\n" \
-                           f"Preço: R$ {veiculo.preco:,.2f}\n" \
-                           f"Cor: {veiculo.cor}\n" \
-                           f"Quilometragem: {veiculo.quilometragem:,} km\n" \
-                           f"Câmbio: {veiculo.cambio}\n" \
-                           f"Combustível: {veiculo.combustivel}\n" \
-                           f"Itens: {veiculo.itens_opcionais if veiculo.itens_opcionais else 'Não informado'}"
-                if image_url:
-                    send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url)
-                else:
-                    send_whatsapp_message(sender_phone_number, mensagem)
-                current_app.logger.info("--- MENSAGEM WHATSAPP (DETALHE VEÍCULO) ---")
-                current_app.logger.info(f"Para: {sender_phone_number}")
-                current_app.logger.info(f"Texto: {mensagem}")
-                if image_url:
-                    current_app.logger.info(f"Imagem: {image_url}")
-                current_app.logger.info("-------------------------------")
-                return ('', 204)
-            else:
-                mensagem = f"Desculpe, não encontrei informações detalhadas sobre esse veículo. Posso te ajudar com outro modelo?"
-                send_whatsapp_message(sender_phone_number, mensagem)
-                return ('', 204)
-        elif incoming_msg in ["não, obrigado", "nao, obrigado", "não obrigado", "nao obrigado"]:
-            prompt = "Responda de forma simpática e cordial, agradecendo o interesse e se colocando à disposição para futuras dúvidas."
-            resposta_ia = process_message_with_ai(dealership.id, prompt)
-            mensagem = resposta_ia['text'] if isinstance(resposta_ia, dict) else resposta_ia
-            send_whatsapp_message(sender_phone_number, mensagem)
-            current_app.logger.info("--- MENSAGEM WHATSAPP (DESPEDIDA) ---")
-            current_app.logger.info(f"Para: {sender_phone_number}")
-            current_app.logger.info(f"Texto: {mensagem}")
-            current_app.logger.info("-------------------------------")
-            return ('', 204)
-
-        # Caso padrão: busca veículos e envia template com botões
-        resposta = process_message_with_ai(dealership.id, incoming_msg)
-        if isinstance(resposta, list) and resposta:
-            primeiro_veiculo = resposta[0]
-            mensagem = primeiro_veiculo['text']
-            image_url = primeiro_veiculo.get('image')
+        # Busca veículo pelo modelo
+        veiculo = None
+        if modelo:
+            veiculo = Vehicle.query.filter(
+                Vehicle.dealership_id == dealership_id,
+                Vehicle.modelo_busca.like(f"%{normalize_search_text(modelo)}%"),
+                Vehicle.vendido == False
+            ).first()
+        if veiculo:
+            fotos = split_photos(veiculo.link_fotos)
+            image_url = fotos[0] if fotos else None
+            mensagem = f"*{veiculo.marca} {veiculo.modelo} {veiculo.ano_modelo}*\n" \
+                       f"Preço: R$ {veiculo.preco:,.2f}\n" \
+                       f"Cor: {veiculo.cor}\n" \
+                       f"Quilometragem: {veiculo.quilometragem:,} km\n" \
+                       f"Câmbio: {veiculo.cambio}\n" \
+                       f"Combustível: {veiculo.combustivel}\n" \
+                       f"Itens: {veiculo.itens_opcionais if veiculo.itens_opcionais else 'Não informado'}"
             if image_url:
-                send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url)
+                send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url, phone_number_id=phone_number_id)
             else:
-                send_whatsapp_message(sender_phone_number, mensagem)
-            current_app.logger.info("--- MENSAGEM WHATSAPP (VEÍCULO) ---")
+                send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+            current_app.logger.info("--- MENSAGEM WHATSAPP (DETALHE VEÍCULO) ---")
             current_app.logger.info(f"Para: {sender_phone_number}")
             current_app.logger.info(f"Texto: {mensagem}")
             if image_url:
                 current_app.logger.info(f"Imagem: {image_url}")
             current_app.logger.info("-------------------------------")
-            return ('', 204)
-        elif isinstance(resposta, dict):
-            mensagem = resposta['text']
-            image_url = resposta.get('image')
-            if image_url:
-                send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url)
-            else:
-                send_whatsapp_message(sender_phone_number, mensagem)
-            current_app.logger.info("--- MENSAGEM WHATSAPP ---")
-            current_app.logger.info(f"Para: {sender_phone_number}")
-            current_app.logger.info(f"Texto: {mensagem}")
-            if image_url:
-                current_app.logger.info(f"Imagem: {image_url}")
-            current_app.logger.info("-------------------------------")
-            return ('', 204)
+            return
         else:
-            send_whatsapp_message(sender_phone_number, str(resposta))
-            return ('', 204)
-    except Exception as e:
-        current_app.logger.error(f"Error in WhatsApp webhook: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+            mensagem = f"Desculpe, não encontrei informações detalhadas sobre esse veículo. Posso te ajudar com outro modelo?"
+            send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+            return
+    elif incoming_msg in ["não, obrigado", "nao, obrigado", "não obrigado", "nao obrigado"]:
+        prompt = "Responda de forma simpática e cordial, agradecendo o interesse e se colocando à disposição para futuras dúvidas."
+        resposta_ia = process_message_with_ai(dealership_id, prompt)
+        mensagem = resposta_ia['text'] if isinstance(resposta_ia, dict) else resposta_ia
+        send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+        current_app.logger.info("--- MENSAGEM WHATSAPP (DESPEDIDA) ---")
+        current_app.logger.info(f"Para: {sender_phone_number}")
+        current_app.logger.info(f"Texto: {mensagem}")
+        current_app.logger.info("-------------------------------")
+        return
+
+    # Caso padrão: busca veículos e envia template com botões
+    resposta = process_message_with_ai(dealership_id, incoming_msg)
+    if isinstance(resposta, list) and resposta:
+        primeiro_veiculo = resposta[0]
+        mensagem = primeiro_veiculo['text']
+        image_url = primeiro_veiculo.get('image')
+        if image_url:
+            send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url, phone_number_id=phone_number_id)
+        else:
+            send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+        current_app.logger.info("--- MENSAGEM WHATSAPP (VEÍCULO) ---")
+        current_app.logger.info(f"Para: {sender_phone_number}")
+        current_app.logger.info(f"Texto: {mensagem}")
+        if image_url:
+            current_app.logger.info(f"Imagem: {image_url}")
+        current_app.logger.info("-------------------------------")
+        return
+    elif isinstance(resposta, dict):
+        mensagem = resposta['text']
+        image_url = resposta.get('image')
+        if image_url:
+            send_whatsapp_message(sender_phone_number, mensagem, image_url=image_url, phone_number_id=phone_number_id)
+        else:
+            send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+        current_app.logger.info("--- MENSAGEM WHATSAPP ---")
+        current_app.logger.info(f"Para: {sender_phone_number}")
+        current_app.logger.info(f"Texto: {mensagem}")
+        if image_url:
+            current_app.logger.info(f"Imagem: {image_url}")
+        current_app.logger.info("-------------------------------")
+        return
+    else:
+        send_whatsapp_message(sender_phone_number, str(resposta), phone_number_id=phone_number_id)
+        return
 
 @main_bp.route('/debug/env')
 def debug_env():
     return {"GEMINI_API_KEY": os.getenv("GEMINI_API_KEY")}
 
+@main_bp.route('/debug/metrics')
+def debug_metrics():
+    """Contadores de cache/IA e ocupação do pool do banco do processo atual."""
+    return jsonify({
+        'counters': metrics.snapshot(),
+        'extraction_cache_hit_rate': metrics.hit_rate('ai.extraction_cache.hits', 'ai.extraction_cache.misses'),
+        'fast_path_hit_rate': metrics.hit_rate('ai.fast_path.hits', 'ai.fast_path.misses'),
+        'db_pool': pool_status(db.engine, current_app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow'))
+    })
+
+DEBUG_VEHICLE_FIELDS = ['id', 'dealership_id', 'marca', 'modelo', 'ano_fabricacao', 'ano_modelo', 'quilometragem',
+                        'estado', 'preco', 'itens_opcionais', 'cambio', 'combustivel', 'final_placa', 'cor',
+                        'link_fotos', 'vendido', 'data_cadastro']
+
 @main_bp.route('/debug/vehicles', methods=['GET'])
 def debug_vehicles():
-    """Rota de debug para listar todos os veículos, incluindo vendidos."""
+    """Rota de debug para listar todos os veículos, incluindo vendidos.
+
+    Aceita os mesmos `limit`, `cursor`, `fields` e `format` de GET /vehicles/.
+    """
     try:
-        vehicles = Vehicle.query.all()
-        output = []
-        for vehicle in vehicles:
-            vehicle_data = {
-                'id': vehicle.id,
-                'dealership_id': vehicle.dealership_id,
-                'marca': vehicle.marca,
-                'modelo': vehicle.modelo,
-                'ano_fabricacao': vehicle.ano_fabricacao,
-                'ano_modelo': vehicle.ano_modelo,
-                'quilometragem': vehicle.quilometragem,
-                'estado': vehicle.estado,
-                'preco': vehicle.preco,
-                'itens_opcionais': vehicle.itens_opcionais,
-                'cambio': vehicle.cambio,
-                'combustivel': vehicle.combustivel,
-                'final_placa': vehicle.final_placa,
-                'cor': vehicle.cor,
-                'link_fotos': vehicle.link_fotos,
-                'vendido': vehicle.vendido,
-                'data_cadastro': vehicle.data_cadastro.isoformat() if vehicle.data_cadastro else None
-            }
-            output.append(vehicle_data)
-        return jsonify({
+        try:
+            fields = parse_fields(request.args.get('fields'), DEBUG_VEHICLE_FIELDS)
+            limit = parse_limit(request.args.get('limit'))
+            after = decode_cursor(request.args.get('cursor'))
+            export_format = parse_format(request.args.get('format'))
+        except ListingError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        query = Vehicle.query
+        if export_format:
+            return stream_response(query, fields, export_format, after)
+        output, next_cursor = fetch_page(query, fields, limit, after)
+        return json_response({
             'status': 'success',
             'count': len(output),
-            'vehicles': output
-        })
+            'vehicles': output,
+            'next_cursor': next_cursor
+        }, headers=next_page_headers(next_cursor, request.path, request.args))
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -0,0 +1,119 @@
+"""Serialização das respostas da API: acessores resolvidos por modelo e encoder JSON rápido.
+
+compile_serializer(Vehicle, campos) resolve uma vez, a partir das colunas do
+modelo, como ler e converter cada campo (conversão só onde precisa:
+DateTime -> isoformat, Numeric -> float, ou uma função própria do campo). O resultado serve tanto para objetos do ORM quanto
+para linhas do Core (`query.with_entities(...)`), que são bem mais baratas de
+carregar nas listagens.
+
+dumps usa o orjson quando instalado (não está no requirements.txt; instale
+em produção) e o json da biblioteca padrão caso contrário.
+"""
+import json
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+
+from flask import Response
+from sqlalchemy import Date, DateTime, Numeric
+
+try:
+    import orjson
+except ImportError:  # dependência opcional
+    orjson = None
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+class Serializer:
+    """Dict com `fields` de um objeto ou linha, com as conversões já resolvidas.
+
+    Um único `operator.attrgetter` lê todos os campos de uma vez (em C); com
+    `positional=True` é um `itemgetter` das posições, para as linhas do Core
+    selecionadas na ordem de `fields` (o acesso por atributo em Row é bem mais
+    lento que por índice). Depois só os campos com conversão passam pela sua
+    função, que recebe também None (ex.: itens_opcionais vazio vira [])."""
+
+    def __init__(self, fields, converters=None, positional=False):
+        self.fields = tuple(fields)
+        converters = converters or {}
+        for field in self.fields:
+            if not field.isidentifier():
+                raise ValueError(f'invalid field name: {field!r}')
+        if not self.fields:
+            get = lambda obj: ()  # noqa: E731
+        elif positional:
+            get = itemgetter(*range(len(self.fields)))
+        else:
+            get = attrgetter(*self.fields)
+        if len(self.fields) == 1:
+            get_one = get
+            get = lambda obj: (get_one(obj),)  # noqa: E731
+        conversions = tuple((position, converters[field])
+                            for position, field in enumerate(self.fields) if field in converters)
+        fields = self.fields
+
+        if not conversions:
+            def serialize(obj):
+                return dict(zip(fields, get(obj)))
+        else:
+            def serialize(obj):
+                values = list(get(obj))
+                for position, convert in conversions:
+                    values[position] = convert(values[position])
+                return dict(zip(fields, values))
+        self._serialize = serialize
+
+    def __call__(self, obj):
+        return self._serialize(obj)
+
+    def many(self, objs):
+        serialize = self._serialize
+        return [serialize(obj) for obj in objs]
+
+
+def column_converters(model, fields):
+    """Conversões implícitas pelo tipo da coluna de cada campo de `fields`."""
+    columns = model.__table__.columns
+    converters = {}
+    for field in fields:
+        column = columns.get(field)
+        if column is None:
+            continue
+        if isinstance(column.type, (DateTime, Date)):
+            converters[field] = _isoformat
+        elif isinstance(column.type, Numeric) and column.type.asdecimal:
+            converters[field] = _float
+    return converters
+
+
+def compile_serializer(model, fields, converters=None, positional=False):
+    """Serializer de `model` para `fields`; `converters` sobrepõe as conversões por tipo."""
+    resolved = column_converters(model, fields)
+    resolved.update(converters or {})
+    return Serializer(fields, resolved, positional)
+
+
+@lru_cache(maxsize=256)
+def columns_serializer(model, fields, positional=False):
+    """Serializer só com conversões por tipo, guardado por (modelo, campos).
+
+    Usado nas listagens com `fields=`: cada combinação de campos é montada
+    uma vez por processo."""
+    return compile_serializer(model, fields, positional=positional)
+
+
+def dumps(data):
+    """JSON em bytes (UTF-8)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200, headers=None):
+    return Response(dumps(data), status=status, headers=headers, mimetype='application/json')
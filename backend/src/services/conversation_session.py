@@ -0,0 +1,43 @@
+"""Sessão de conversa do WhatsApp (por concessionária + telefone do cliente).
+
+Guarda o resultado da última busca: ids dos veículos mostrados, filtros
+usados e o cursor da próxima página. Os botões das respostas ("Quero saber
+mais", "Ver mais fotos") carregam o id do veículo, então o clique vira uma
+leitura por chave primária em vez de uma nova busca pelo nome do modelo.
+
+Usa o cache configurado em CACHE_BACKEND (memória com LRU + TTL, ou Redis
+para compartilhar as sessões entre processos).
+"""
+import os
+
+from src.cache import create_cache
+
+SESSION_TTL = int(os.getenv('SESSION_TTL', '1800'))
+
+session_store = create_cache(
+    'conversation_session',
+    maxsize=int(os.getenv('SESSION_CACHE_SIZE', '50000')),
+    ttl=SESSION_TTL
+)
+
+
+def session_key(dealership_id, phone):
+    return f'{dealership_id}:{phone}'
+
+
+def get_session(dealership_id, phone):
+    """Sessão da conversa ou um dict vazio (expirada ou inexistente)."""
+    return session_store.get(session_key(dealership_id, phone)) or {}
+
+
+def save_search(dealership_id, phone, vehicle_ids, filters, cursor=None):
+    """Grava a última busca da conversa (substitui a anterior)."""
+    session_store.set(session_key(dealership_id, phone), {
+        'vehicle_ids': [int(vehicle_id) for vehicle_id in vehicle_ids],
+        'filters': dict(filters),
+        'cursor': cursor,
+    })
+
+
+def clear_session(dealership_id, phone):
+    session_store.delete(session_key(dealership_id, phone))
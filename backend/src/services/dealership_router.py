@@ -0,0 +1,102 @@
+"""Roteamento das mensagens do WhatsApp para a concessionária certa.
+
+Cada payload do webhook traz em `value.metadata` o número que recebeu a
+mensagem (phone_number_id e display_phone_number). O mapa número ->
+concessionária fica em memória: é carregado uma vez do banco e descartado
+quando alguma concessionária é criada, alterada ou removida (evento
+after_commit da sessão) ou depois de DEALERSHIP_ROUTER_TTL segundos, para
+pegar alterações feitas por outros processos.
+"""
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.models import Dealership
+
+
+DEALERSHIP_ROUTER_TTL = int(os.getenv('DEALERSHIP_ROUTER_TTL', '300'))
+
+
+def _digits(value):
+    return re.sub(r'\D', '', str(value or ''))
+
+
+class DealershipRouter:
+    """Resolve o id da concessionária ativa a partir do metadata do webhook."""
+
+    def __init__(self, dealerships=()):
+        self.by_phone_number_id = {}
+        self.by_number = {}
+        for dealership in dealerships:
+            if dealership.whatsapp_phone_number_id:
+                self.by_phone_number_id[str(dealership.whatsapp_phone_number_id)] = dealership.id
+            if dealership.whatsapp_number:
+                self.by_number[_digits(dealership.whatsapp_number)] = dealership.id
+        self.dealership_ids = sorted({dealership.id for dealership in dealerships})
+        self.loaded_at = time.monotonic()
+
+    def resolve(self, metadata):
+        """Id da concessionária que recebeu a mensagem, ou None.
+
+        Sem correspondência, só cai na concessionária padrão quando existe
+        uma única ativa (instalações de uma loja só, payloads sem metadata);
+        quem chama registra a mensagem descartada.
+        """
+        metadata = metadata or {}
+        phone_number_id = metadata.get('phone_number_id')
+        if phone_number_id and str(phone_number_id) in self.by_phone_number_id:
+            return self.by_phone_number_id[str(phone_number_id)]
+        number = _digits(metadata.get('display_phone_number'))
+        if number and number in self.by_number:
+            return self.by_number[number]
+        if len(self.dealership_ids) == 1:
+            return self.dealership_ids[0]
+        return None
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_dealership_router():
+    """Mapa em memória das concessionárias ativas (recarregado após o TTL)."""
+    global _router
+    router = _router
+    if router is None or time.monotonic() - router.loaded_at > DEALERSHIP_ROUTER_TTL:
+        with _router_lock:
+            router = _router
+            if router is None or time.monotonic() - router.loaded_at > DEALERSHIP_ROUTER_TTL:
+                router = DealershipRouter(Dealership.query.filter_by(active=True).all())
+                _router = router
+    return router
+
+
+def resolve_dealership_id(metadata):
+    return get_dealership_router().resolve(metadata)
+
+
+def invalidate_dealership_router():
+    global _router
+    with _router_lock:
+        _router = None
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_dealership_changes(session, flush_context, instances):
+    if any(isinstance(obj, Dealership) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['dealerships_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('dealerships_changed', False):
+        invalidate_dealership_router()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('dealerships_changed', None)
@@ -0,0 +1,150 @@
+"""Embeddings dos veículos e das mensagens, calculados localmente (CPU).
+
+Dois modelos, escolhidos por EMBEDDING_MODEL:
+
+- `hashing` (padrão, sem dependências): palavras, pares de palavras e
+  conceitos ("econômico", "família", "terra", ...) espalhados por feature
+  hashing em EMBEDDING_DIM dimensões. Os conceitos vêm de CONCEPTS: a mensagem
+  ativa um conceito pelas palavras do cliente e o veículo pelas características
+  (motor 1.0, flex, 4x4, diesel, 7 lugares...), de modo que "carro econômico
+  pra família" se aproxima de um sedã 1.0 flex mesmo sem palavras em comum.
+- qualquer outro valor é o nome de um modelo do sentence-transformers (ex.:
+  `paraphrase-multilingual-MiniLM-L12-v2`), rodando em CPU. Requer o pacote
+  `sentence-transformers` (não está no requirements.txt; instale quando usar).
+
+Os vetores são float32 normalizados (produto interno = cosseno).
+"""
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from src.text_utils import normalize_search_text
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # dependência opcional
+    SentenceTransformer = None
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'hashing')
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '256'))
+
+# conceito -> (palavras do cliente, características do veículo); tudo normalizado
+CONCEPTS = {
+    'economico': ({'economico', 'economica', 'economia', 'consumo', 'gasta pouco', 'barato', 'em conta'},
+                  {'1.0', 'flex', 'hibrido', 'eletrico', 'economico', 'baixo consumo', 'eco'}),
+    'familia': ({'familia', 'filhos', 'criancas', 'espaco', 'espacoso', 'espacosa', 'grande', 'viagem'},
+                {'sedan', 'suv', 'minivan', '7 lugares', 'porta-malas', 'porta malas', 'isofix', 'familia',
+                 'espacoso'}),
+    'terra': ({'terra', 'estrada de terra', 'trilha', 'fazenda', 'sitio', 'offroad', 'off-road', 'lama',
+               'roca', 'estrada ruim'},
+              {'4x4', '4wd', 'awd', 'tracao', 'diesel', 'off-road', 'offroad', 'picape', 'pick-up', 'suv',
+               'cabine dupla'}),
+    'cidade': ({'cidade', 'urbano', 'estacionar', 'pequeno', 'compacto', 'dia a dia', 'trabalho'},
+               {'hatch', '1.0', 'compacto', 'sensor de estacionamento', 'camera de re', 'automatico'}),
+    'conforto': ({'conforto', 'confortavel', 'luxo', 'luxuoso', 'completo', 'top'},
+                 {'banco de couro', 'teto solar', 'ar condicionado digital', 'automatico', 'premium',
+                  'multimidia', 'piloto automatico'}),
+    'esportivo': ({'esportivo', 'potente', 'forte', 'rapido', 'desempenho', 'turbo'},
+                  {'turbo', 'tsi', 'gti', 'esportivo', 'sport', '2.0', 'v6', 'v8'}),
+    'carga': ({'carga', 'carregar', 'trabalho pesado', 'obra', 'cacamba', 'reboque'},
+              {'picape', 'pick-up', 'cacamba', 'cabine', 'diesel', 'furgao', 'utilitario'}),
+}
+# Peso de um conceito frente a uma palavra comum
+CONCEPT_WEIGHT = 3.0
+
+VEHICLE_TEXT_FIELDS = ('marca', 'modelo', 'versao', 'motor', 'potencia', 'cambio', 'combustivel', 'estado',
+                       'cor', 'itens_opcionais', 'observacoes')
+
+
+def vehicle_text(vehicle):
+    """Texto do veículo usado no embedding (versão, opcionais, observações, ficha técnica)."""
+    parts = []
+    for field in VEHICLE_TEXT_FIELDS:
+        value = getattr(vehicle, field, None)
+        if value:
+            parts.append(str(value).replace(';', ', '))
+    return '. '.join(parts)
+
+
+def _concept_pattern(terms):
+    alternatives = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(r'(?<![\w.])(?:' + alternatives + r')(?![\w])')
+
+
+# (conceito, padrão da mensagem, padrão do veículo)
+_CONCEPT_PATTERNS = [(concept, _concept_pattern(query_terms), _concept_pattern(vehicle_terms))
+                     for concept, (query_terms, vehicle_terms) in CONCEPTS.items()]
+
+
+class HashingEmbedder:
+    """Feature hashing de palavras, pares de palavras e conceitos (sem modelo treinado)."""
+
+    name = 'hashing'
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text, side):
+        text = normalize_search_text(text) or ''
+        words = re.findall(r'[\w.\-]+', text)
+        features = {}
+        for word in words:
+            features[word] = features.get(word, 0.0) + 1.0
+        for first, second in zip(words, words[1:]):
+            pair = f'{first} {second}'
+            features[pair] = features.get(pair, 0.0) + 0.5
+        for concept, query_pattern, vehicle_pattern in _CONCEPT_PATTERNS:
+            hits = len(set((query_pattern if side == 'query' else vehicle_pattern).findall(text)))
+            if hits:
+                features[f'#{concept}'] = CONCEPT_WEIGHT * (1 + np.log(hits))
+        return features
+
+    def _encode(self, texts, side):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text, side).items():
+                digest = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dim] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def encode_vehicles(self, texts):
+        return self._encode(texts, 'vehicle')
+
+    def encode_query(self, text):
+        return self._encode([text], 'query')[0]
+
+
+class SentenceTransformerEmbedder:
+    """Modelo do sentence-transformers em CPU."""
+
+    def __init__(self, model_name):
+        if SentenceTransformer is None:
+            raise RuntimeError(f'EMBEDDING_MODEL={model_name} requires the "sentence-transformers" package')
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def encode_vehicles(self, texts):
+        return self._model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                  convert_to_numpy=True).astype(np.float32)
+
+    def encode_query(self, text):
+        return self.encode_vehicles([text])[0]
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Embedder configurado por EMBEDDING_MODEL (carregado uma vez por processo)."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = HashingEmbedder() if EMBEDDING_MODEL == 'hashing' else SentenceTransformerEmbedder(EMBEDDING_MODEL)
+        return _embedder
@@ -0,0 +1,170 @@
+"""Casamento aproximado de marcas/modelos digitados pelo cliente.
+
+"corola", "hb 20", "volks", "onyx": o índice guarda os valores distintos de
+marca, modelo e versão do estoque (sem acento, minúsculos e sem espaços ou
+hífens) e um mapa trigrama -> valores. Uma consulta só compara o termo com os
+valores que têm algum trigrama em comum, com:
+
+- igualdade sem espaços/hífens ("hb 20" = "hb20", "tcross" = "t-cross");
+- prefixo de pelo menos 4 letras ("volks" -> "volkswagen");
+- coeficiente de Dice dos trigramas;
+- distância de edição (Levenshtein) para erros de digitação em termos curtos.
+
+Versões apontam para o modelo que as tem ("xei" -> Corolla). Apelidos comuns
+(ALIASES) são resolvidos antes. O índice é atualizado valor a valor pelo
+InventoryIndex, sem reconstrução.
+"""
+import os
+import re
+from collections import Counter
+
+from src.text_utils import normalize_search_text
+
+FUZZY_MIN_SCORE = float(os.getenv('FUZZY_MIN_SCORE', '0.6'))
+
+# Apelido (normalizado) -> nome como costuma estar cadastrado
+ALIASES = {
+    'vw': 'volkswagen',
+    'volks': 'volkswagen',
+    'wolks': 'volkswagen',
+    'wv': 'volkswagen',
+    'chevy': 'chevrolet',
+    'gm': 'chevrolet',
+    'chevrolete': 'chevrolet',
+    'mercedes': 'mercedes-benz',
+    'mb': 'mercedes-benz',
+    'benz': 'mercedes-benz',
+    'hyunday': 'hyundai',
+    'hiunday': 'hyundai',
+    'range': 'range rover',
+}
+
+
+def compact(value):
+    """Forma de comparação: sem acento, minúscula, sem espaços/hífens/pontos."""
+    return re.sub(r'[\s\-\.]+', '', normalize_search_text(value) or '')
+
+
+def trigrams(key):
+    padded = f'${key}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a, b, limit=2):
+    """Distância de edição, interrompida quando passa de `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def similarity(term, key, shared=None):
+    """Nota de 0 a 1 entre o termo digitado e um valor do índice (formas compactas)."""
+    if term == key:
+        return 1.0
+    if len(term) >= 4 and key.startswith(term):
+        return 0.85
+    term_grams, key_grams = trigrams(term), trigrams(key)
+    shared = len(term_grams & key_grams) if shared is None else shared
+    score = 2 * shared / (len(term_grams) + len(key_grams))
+    if len(term) >= 4:
+        distance = levenshtein(term, key)
+        if distance <= 2:
+            score = max(score, 1 - distance / max(len(term), len(key)) - 0.05)
+    return score
+
+
+class FuzzyIndex:
+    """Valores distintos por campo ('marca', 'modelo', 'versao') com índice de trigramas.
+
+    Não é thread-safe sozinho: o InventoryIndex chama tudo sob o próprio lock.
+    """
+
+    def __init__(self):
+        self.entries = {}  # (campo, chave compacta) -> {rótulo: contagem}
+        self.grams = {}  # trigrama -> {(campo, chave)}
+        self.versao_modelos = {}  # chave compacta da versão -> Counter(rótulo do modelo)
+
+    def add(self, field, label, modelo=None):
+        key = compact(label)
+        if not key:
+            return
+        labels = self.entries.get((field, key))
+        if labels is None:
+            labels = self.entries[(field, key)] = Counter()
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add((field, key))
+        labels[label] += 1
+        if field == 'versao' and modelo:
+            self.versao_modelos.setdefault(key, Counter())[modelo] += 1
+
+    def remove(self, field, label, modelo=None):
+        key = compact(label)
+        labels = self.entries.get((field, key))
+        if labels is None:
+            return
+        labels[label] -= 1
+        if labels[label] <= 0:
+            del labels[label]
+        if field == 'versao' and modelo and key in self.versao_modelos:
+            modelos = self.versao_modelos[key]
+            modelos[modelo] -= 1
+            if modelos[modelo] <= 0:
+                del modelos[modelo]
+            if not modelos:
+                del self.versao_modelos[key]
+        if not labels:
+            del self.entries[(field, key)]
+            for gram in trigrams(key):
+                keys = self.grams.get(gram)
+                if keys is not None:
+                    keys.discard((field, key))
+                    if not keys:
+                        del self.grams[gram]
+
+    def _label(self, field, key):
+        if field == 'versao':
+            modelos = self.versao_modelos.get(key)
+            return modelos.most_common(1)[0][0] if modelos else None
+        return self.entries[(field, key)].most_common(1)[0][0]
+
+    def matches(self, term, fields=('modelo', 'versao', 'marca'), limit=3, min_score=None):
+        """Melhores (nota, campo, rótulo) para o termo; versões viram o modelo delas."""
+        min_score = FUZZY_MIN_SCORE if min_score is None else min_score
+        normalized = normalize_search_text(term) or ''
+        term = compact(ALIASES.get(normalized, normalized))
+        if len(term) < 2:
+            return []
+        shared = Counter()
+        for gram in trigrams(term):
+            for entry in self.grams.get(gram, ()):
+                if entry[0] in fields:
+                    shared[entry] += 1
+        scored = {}
+        for (field, key), count in shared.items():
+            score = similarity(term, key, shared=count)
+            if score < min_score:
+                continue
+            target = 'modelo' if field == 'versao' else field
+            label = self._label(field, key)
+            if label is None:
+                continue
+            # versão pesa um pouco menos que um modelo/marca de mesmo nome
+            score -= 0.05 if field == 'versao' else 0
+            if score > scored.get((target, label), 0):
+                scored[(target, label)] = score
+        ranked = sorted(((score, field, label) for (field, label), score in scored.items()),
+                        key=lambda item: (-item[0], item[1], item[2]))
+        return ranked[:limit]
+
+    def best(self, term, fields=('modelo', 'versao', 'marca'), min_score=None):
+        """(campo, rótulo) da melhor correspondência, ou None."""
+        found = self.matches(term, fields=fields, limit=1, min_score=min_score)
+        return (found[0][1], found[0][2]) if found else None
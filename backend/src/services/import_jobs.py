@@ -0,0 +1,233 @@
+"""Importações de planilhas de veículos em segundo plano.
+
+O upload só grava o arquivo em IMPORT_STORAGE_DIR, cria um ImportJob e
+responde com o id. Um pool próprio de threads (IMPORT_WORKERS), separado dos
+workers do webhook, processa os jobs: importações de concessionárias
+diferentes rodam em paralelo e as da mesma concessionária uma de cada vez
+(um sync concorrente com outra importação marcaria vendidos errados). Cada
+concessionária tem uma fila: só o job da frente vai para o pool, e o próximo
+é enviado quando ele termina, então nenhuma thread fica parada esperando a
+vez da concessionária enquanto outras concessionárias aguardam.
+O progresso (linhas lidas, linhas com erro, linhas/s) é gravado no job a cada
+bloco da planilha, para o endpoint de status.
+
+O pool do processo e `flask import-worker` podem ver o mesmo job pendente:
+quem roda o job é quem o reserva com um UPDATE condicional (status de
+'pending' para 'running'). O bloco gravado renova locked_at; um job em
+'running' parado há mais de IMPORT_JOB_TIMEOUT segundos (worker morreu ou o
+processo reiniciou) volta para 'pending', ou vira 'failed' depois de
+IMPORT_MAX_ATTEMPTS tentativas.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import click
+from src.database import db
+from src.models import ImportJob
+from src.services.inventory_index import invalidate_inventory_index
+from src.services.inventory_version import bump_inventory_version
+from src.services.vehicle_import import import_vehicles, iter_vehicle_frames
+from src.services.vector_index import invalidate_vector_index
+
+logger = logging.getLogger(__name__)
+
+
+class ImportJobRunner:
+    """Grava uploads como ImportJob e os processa em um pool de threads."""
+
+    def __init__(self, app, storage_dir, num_workers=2, job_timeout=900, max_attempts=3):
+        self.app = app
+        self.storage_dir = storage_dir
+        self.num_workers = num_workers
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._queues_lock = threading.Lock()
+        self._queues = {}  # dealership_id -> jobs à espera do que está no pool
+
+    def submit(self, file, dealership_id, mode='append'):
+        """Salva o arquivo enviado, cria o job e o agenda. Retorna o job."""
+        os.makedirs(self.storage_dir, exist_ok=True)
+        extension = os.path.splitext(file.filename)[1].lower()
+        path = os.path.join(self.storage_dir, f'{uuid.uuid4().hex}{extension}')
+        file.save(path)
+        job = ImportJob(dealership_id=dealership_id, filename=file.filename, file_path=path, mode=mode)
+        db.session.add(job)
+        db.session.commit()
+        self.schedule(job.id, dealership_id)
+        for job_id, stale_dealership_id in self.requeue_stale():
+            self.schedule(job_id, stale_dealership_id)
+        return job
+
+    def schedule(self, job_id, dealership_id):
+        """Envia o job ao pool, ou o põe na fila se a concessionária já tem um lá."""
+        executor = self._get_executor()
+        if executor is None:
+            return
+        with self._queues_lock:
+            waiting = self._queues.get(dealership_id)
+            if waiting is not None:
+                waiting.append(job_id)
+                return
+            self._queues[dealership_id] = deque()
+        executor.submit(self._run_in_context, job_id, dealership_id)
+
+    def _next_job(self, dealership_id):
+        """Próximo job da fila da concessionária (None e fila encerrada se vazia)."""
+        with self._queues_lock:
+            waiting = self._queues[dealership_id]
+            if waiting:
+                return waiting.popleft()
+            del self._queues[dealership_id]
+            return None
+
+    def _get_executor(self):
+        """Cria o pool na primeira chamada (lazy, como os workers do webhook)."""
+        if self._executor is None and self.num_workers > 0:
+            with self._start_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.num_workers,
+                                                        thread_name_prefix='import-worker')
+        return self._executor
+
+    def _run_in_context(self, job_id, dealership_id):
+        try:
+            with self.app.app_context():
+                self.run(job_id)
+        except Exception as e:
+            logger.error(f"Erro no worker de importação (job {job_id}): {str(e)}")
+        finally:
+            next_job_id = self._next_job(dealership_id)
+            if next_job_id is not None:
+                self._executor.submit(self._run_in_context, next_job_id, dealership_id)
+
+    def claim(self, job_id):
+        """Reserva o job pendente para este worker; False se outro já o pegou."""
+        now = datetime.utcnow()
+        claimed = ImportJob.query.filter(
+            ImportJob.id == job_id,
+            ImportJob.status == 'pending'
+        ).update({
+            'status': 'running',
+            'started_at': now,
+            'locked_at': now,
+            'attempts': ImportJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    def requeue_stale(self):
+        """Devolve à fila os jobs presos em 'running'; (id, concessionária) dos que voltaram a 'pending'."""
+        stale = ImportJob.query.filter(
+            ImportJob.status == 'running',
+            ImportJob.locked_at < datetime.utcnow() - timedelta(seconds=self.job_timeout)
+        )
+        requeued = []
+        for job in stale.all():
+            exhausted = job.attempts >= self.max_attempts
+            changed = ImportJob.query.filter(
+                ImportJob.id == job.id,
+                ImportJob.status == 'running',
+                ImportJob.locked_at == job.locked_at
+            ).update({
+                'status': 'failed' if exhausted else 'pending',
+                'last_error': 'Worker stopped while importing' + (' (too many attempts)' if exhausted else ''),
+                'finished_at': datetime.utcnow() if exhausted else None
+            }, synchronize_session=False)
+            if changed:
+                logger.warning(f"Importação {job.id} parada desde {job.locked_at}: "
+                               f"{'falhou' if exhausted else 'voltou para a fila'}")
+                if not exhausted:
+                    requeued.append((job.id, job.dealership_id))
+        db.session.commit()
+        return requeued
+
+    def run(self, job_id):
+        """Processa um job. Deve rodar dentro de um app context."""
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status != 'pending':
+            return False
+        if not self.claim(job_id):
+            return False
+        db.session.refresh(job)
+        result, error = None, None
+        try:
+            with open(job.file_path, 'rb') as stream:
+                frames = iter_vehicle_frames(SimpleNamespace(filename=job.filename.lower(), stream=stream))
+                result = import_vehicles(job.dealership_id, frames, mode=job.mode,
+                                         on_progress=lambda importer: self._save_progress(job_id, importer))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao processar importação {job_id}: {str(e)}")
+            error = str(e)
+        finally:
+            # Blocos e vendidos confirmados antes de uma falha também mudaram o estoque
+            self._inventory_changed(job.dealership_id)
+        if error is None and result['rows'] - result['error_rows'] <= 0:
+            error = 'No vehicles were processed'
+        self._finish(job_id, 'failed' if error else 'done', result, error=error)
+        return True
+
+    def _inventory_changed(self, dealership_id):
+        invalidate_inventory_index(dealership_id)
+        invalidate_vector_index(dealership_id)
+        bump_inventory_version(dealership_id)
+
+    def run_pending(self):
+        """Processa de forma síncrona os jobs pendentes, do mais antigo ao mais novo."""
+        self.requeue_stale()
+        job_ids = [job_id for (job_id,) in db.session.query(ImportJob.id)
+                   .filter(ImportJob.status == 'pending').order_by(ImportJob.created_at, ImportJob.id)]
+        return sum(1 for job_id in job_ids if self.run(job_id))
+
+    def _save_progress(self, job_id, importer):
+        job = db.session.get(ImportJob, job_id)
+        job.rows = importer.rows
+        job.error_rows = importer.error_rows
+        job.rows_per_second = importer.rows_per_second
+        job.locked_at = datetime.utcnow()
+        db.session.commit()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        job = db.session.get(ImportJob, job_id)
+        job.status = status
+        job.last_error = error
+        job.finished_at = datetime.utcnow()
+        if result is not None:
+            job.rows = result['rows']
+            job.error_rows = result['error_rows']
+            job.rows_per_second = result['rows_per_second']
+            job.result = json.dumps(result, ensure_ascii=False)
+        db.session.commit()
+        try:
+            os.remove(job.file_path)
+        except OSError:
+            pass
+
+
+def init_import_jobs(app):
+    """Configura o pool de importações a partir das variáveis de ambiente."""
+    runner = ImportJobRunner(
+        app,
+        storage_dir=os.getenv('IMPORT_STORAGE_DIR', os.path.join(tempfile.gettempdir(), 'autoatende_imports')),
+        num_workers=int(app.config.setdefault('IMPORT_WORKERS', int(os.getenv('IMPORT_WORKERS', '2')))),
+        job_timeout=int(os.getenv('IMPORT_JOB_TIMEOUT', '900')),
+        max_attempts=int(os.getenv('IMPORT_MAX_ATTEMPTS', '3'))
+    )
+    app.extensions['import_jobs'] = runner
+
+    @app.cli.command('import-worker')
+    def import_worker():
+        """Processa as importações pendentes e as presas em 'running' (por exemplo, as de antes de um restart)."""
+        click.echo(f'{runner.run_pending()} import jobs processed')
+
+    return runner
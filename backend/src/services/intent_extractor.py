@@ -0,0 +1,276 @@
+"""Extrator determinístico de intenção/parâmetros na frente do Gemini.
+
+Boa parte das mensagens é trivial ("oi", "não obrigado", "tem corolla?",
+"até 80 mil", "2020 pra cima"). Este módulo reconhece essas mensagens com
+regras e com o vocabulário real de marcas/modelos do estoque da
+concessionária, devolvendo o mesmo dicionário que o Gemini devolveria. Só
+quando sobra texto que as regras não explicam é que a mensagem vai para a IA.
+"""
+import os
+import re
+from datetime import datetime
+
+from src import metrics
+from src.cache import create_cache
+from src.database import db
+from src.models import Vehicle
+from src.services.inventory_index import INVENTORY_INDEX_ENABLED, get_inventory_index
+from src.text_utils import normalize_message, strip_accents
+
+GREETING_WORDS = {'oi', 'ola', 'bom', 'boa', 'dia', 'tarde', 'noite', 'tudo', 'bem', 'opa', 'eai',
+                  'hello', 'hi', 'salve', 'blz', 'beleza'}
+DECLINE_MESSAGES = {'nao obrigado', 'nao obrigada', 'obrigado', 'obrigada', 'valeu', 'nao quero',
+                    'agora nao', 'so isso', 'so isso obrigado'}
+STOPWORDS = {'tem', 'tenho', 'teria', 'voce', 'voces', 'vc', 'vcs', 'quero', 'queria', 'gostaria',
+             'procuro', 'procurando', 'busco', 'buscando', 'estou', 'to', 'um', 'uma', 'uns', 'umas',
+             'o', 'a', 'os', 'as', 'de', 'do', 'da', 'dos', 'das', 'com', 'e', 'ou', 'pra', 'para',
+             'por', 'carro', 'carros', 'veiculo', 'veiculos', 'modelo', 'ano', 'cor', 'algum',
+             'alguma', 'disponivel', 'disponiveis', 'ai', 'no', 'na', 'em', 'me', 'mostra',
+             'mostre', 'ver', 'favor', 'preco', 'reais', 'r$', 'ate', 'km', 'cores', 'ainda',
+             'estoque', 'que', 'qual', 'quais'}
+
+# Cores no masculino, como costumam estar cadastradas
+COLORS = {'preto': 'preto', 'preta': 'preto', 'branco': 'branco', 'branca': 'branco',
+          'prata': 'prata', 'cinza': 'cinza', 'grafite': 'grafite', 'vermelho': 'vermelho',
+          'vermelha': 'vermelho', 'azul': 'azul', 'verde': 'verde', 'amarelo': 'amarelo',
+          'amarela': 'amarelo', 'marrom': 'marrom', 'bege': 'bege', 'dourado': 'dourado',
+          'dourada': 'dourado', 'laranja': 'laranja', 'vinho': 'vinho', 'roxo': 'roxo', 'roxa': 'roxo'}
+
+_NUM = r'(\d+(?:[.,]\d+)*)\s*(mil|k)?'
+_MONEY = r'(?:r\$\s*)?' + _NUM
+_MAX_WORDS = r'\b(?:ate|no maximo|maximo|abaixo de|menos de|por ate|custando ate|que custe ate)'
+_MIN_WORDS = r'\b(?:acima de|a partir de|mais de|no minimo|minimo|partindo de)'
+_NOT_MONEY = r'(?!\s*(?:mil|k|reais|km)\b)'
+_YEAR = r'\b((?:19[5-9]\d|20\d\d))' + _NOT_MONEY
+
+
+def parse_number(digits, multiplier=None):
+    """'80' + 'mil' -> 80000; '80,5' + 'mil' -> 80500; '80.000,00' -> 80000."""
+    if multiplier and digits.count('.') + digits.count(',') == 1:
+        value = float(digits.replace(',', '.'))
+    else:
+        value = float(digits.replace('.', '').replace(',', '.'))
+    return value * 1000 if multiplier else value
+
+
+def _year_in_range(value):
+    return 1950 <= int(value) <= datetime.now().year + 1
+
+
+class FastPathExtractor:
+    """Extrai parâmetros com regras e o vocabulário do estoque.
+
+    `vocabulary` é um dict com 'marca' e 'modelo', cada um mapeando o valor
+    normalizado (sem acento, minúsculo) para o valor como está no banco.
+    `opcionais` é a lista de opcionais conhecidos (KNOWN_OPCIONAIS).
+    `match_term(termo)`, se informado, devolve (campo, valor) do estoque mais
+    parecido com o termo (InventoryIndex.match_term); é usado para as palavras
+    que sobram ("corola", "hb 20", "volks").
+    """
+
+    def __init__(self, vocabulary, opcionais, match_term=None):
+        self.match_term = match_term
+        self.marcas = vocabulary.get('marca', {})
+        self.modelos = vocabulary.get('modelo', {})
+        self.opcionais = {strip_accents(op).lower(): op for op in opcionais}
+        self.max_ngram = max([len(v.split()) for v in list(self.marcas) + list(self.modelos)] + [1])
+
+    def extract(self, user_message):
+        """Retorna (params, confiança). params é None se nada foi reconhecido.
+
+        A confiança é a fração das palavras da mensagem explicadas pelas regras.
+        """
+        text = normalize_message(user_message)
+        if not text:
+            return None, 0.0
+        if re.sub(r'[^\w\s]', '', text) in DECLINE_MESSAGES:
+            return {'intent': 'other'}, 1.0
+
+        params = {}
+        text = self._extract_numbers(text, params)
+
+        tokens = re.findall(r'[\w$]+', text)
+        if not tokens and params:
+            return params, 1.0
+        explained = [False] * len(tokens)
+        self._match_vocabulary(tokens, explained, params)
+        opcionais = self._match_opcionais(tokens, explained)
+        if opcionais:
+            params['opcionais'] = opcionais
+        has_greeting = False
+        for i, token in enumerate(tokens):
+            if explained[i]:
+                continue
+            if token in COLORS and 'cor' not in params:
+                params['cor'] = COLORS[token]
+                explained[i] = True
+            elif token in GREETING_WORDS:
+                has_greeting = True
+                explained[i] = True
+            elif token in STOPWORDS:
+                explained[i] = True
+        if self.match_term is not None:
+            self._match_fuzzy(tokens, explained, params)
+
+        confidence = sum(explained) / len(tokens) if tokens else 1.0
+        if not params:
+            if has_greeting and confidence == 1.0:
+                return {'intent': 'greeting'}, 1.0
+            return None, confidence
+        return params, confidence
+
+    def _extract_numbers(self, text, params):
+        """Reconhece preço, ano e quilometragem, removendo os trechos do texto."""
+        def consume(pattern, handler):
+            nonlocal text
+            match = re.search(pattern, text)
+            if match and handler(match):
+                text = text[:match.start()] + ' ' + text[match.end():]
+
+        def km_max(m):
+            params['quilometragem_max'] = int(parse_number(m.group(1), m.group(2)))
+            return True
+        consume(r'(?:com\s+)?' + _MAX_WORDS + r'\s+' + _NUM + r'\s*(?:km|quilometros?|kms)\b', km_max)
+        consume(r'\b(?:km|quilometragem|rodagem)\s+(?:de\s+)?' + _MAX_WORDS + r'\s+' + _NUM + r'(?:\s*km)?', km_max)
+
+        def year_range(m):
+            if not (_year_in_range(m.group(1)) and _year_in_range(m.group(2))):
+                return False
+            params['ano_min'], params['ano_max'] = sorted([int(m.group(1)), int(m.group(2))])
+            return True
+        consume(r'\bentre\s+' + _YEAR + r'\s+e\s+' + _YEAR, year_range)
+
+        def year_min(m):
+            if not _year_in_range(m.group(1)):
+                return False
+            params['ano_min'] = int(m.group(1))
+            return True
+        consume(_YEAR + r'\s+(?:pra cima|para cima|ou mais|em diante|ou mais novo|acima)', year_min)
+        consume(r'\b(?:a partir de|acima de|depois de|apos|mais novo que|a partir do ano|do ano)\s+' + _YEAR, year_min)
+
+        def year_max(m):
+            if not _year_in_range(m.group(1)):
+                return False
+            params['ano_max'] = int(m.group(1))
+            return True
+        consume(r'\b(?:ate|antes de|no maximo)\s+' + _YEAR, year_max)
+
+        def price_range(m):
+            low_mult = m.group(2) or m.group(4)
+            params['preco_min'] = parse_number(m.group(1), low_mult)
+            params['preco_max'] = parse_number(m.group(3), m.group(4))
+            return True
+        consume(r'\bentre\s+' + _MONEY + r'\s+e\s+' + _MONEY, price_range)
+
+        def price(key):
+            def handler(m):
+                value = parse_number(m.group(1), m.group(2))
+                if value < 1000:  # "até 80" sem "mil" é ambíguo: fica para a IA
+                    return False
+                params[key] = value
+                return True
+            return handler
+        consume(_MAX_WORDS + r'\s+' + _MONEY, price('preco_max'))
+        consume(_MIN_WORDS + r'\s+' + _MONEY, price('preco_min'))
+
+        def bare_year(m):
+            if not _year_in_range(m.group(1)) or 'ano_min' in params or 'ano_max' in params:
+                return False
+            params['ano_min'] = params['ano_max'] = int(m.group(1))
+            return True
+        consume(_YEAR + r'\b', bare_year)
+        return text
+
+    def _match_vocabulary(self, tokens, explained, params):
+        """Casa n-gramas da mensagem com marcas/modelos do estoque (o maior primeiro)."""
+        for size in range(min(self.max_ngram, len(tokens)), 0, -1):
+            for start in range(0, len(tokens) - size + 1):
+                if any(explained[start:start + size]):
+                    continue
+                phrase = ' '.join(tokens[start:start + size])
+                if 'modelo' not in params and phrase in self.modelos:
+                    params['modelo'] = self.modelos[phrase]
+                elif 'marca' not in params and phrase in self.marcas:
+                    params['marca'] = self.marcas[phrase]
+                else:
+                    continue
+                for i in range(start, start + size):
+                    explained[i] = True
+
+    def _match_fuzzy(self, tokens, explained, params):
+        """Palavras não explicadas parecidas com marca/modelo/versão do estoque.
+
+        Pares de palavras primeiro ("hb 20", "t cross"), depois palavras soltas.
+        """
+        for size in (2, 1):
+            for start in range(0, len(tokens) - size + 1):
+                if any(explained[start:start + size]) or (size == 1 and tokens[start].isdigit()):
+                    continue
+                match = self.match_term(' '.join(tokens[start:start + size]))
+                # a versão de um modelo já reconhecido ("onix plus ltz") também conta
+                if match is None or params.get(match[0], match[1]) != match[1]:
+                    continue
+                params[match[0]] = match[1]
+                for i in range(start, start + size):
+                    explained[i] = True
+                metrics.increment('ai.fast_path.fuzzy_matches')
+
+    def _match_opcionais(self, tokens, explained):
+        found = []
+        joined = ' '.join(tokens)
+        for normalized, original in self.opcionais.items():
+            match = re.search(r'\b' + re.escape(normalized) + r'\b', joined)
+            if not match:
+                continue
+            found.append(original)
+            first = len(joined[:match.start()].split())
+            for i in range(first, first + len(normalized.split())):
+                explained[i] = True
+        return found
+
+
+# Vocabulário lido do banco quando o índice em memória está desligado
+_vocabulary_cache = create_cache('fast_path_vocabulary', maxsize=1000,
+                                 ttl=int(os.getenv('FAST_PATH_VOCABULARY_TTL', '300')))
+
+
+def get_inventory_vocabulary(dealership_id):
+    """Marcas e modelos distintos do estoque à venda: {'marca': {norm: valor}, 'modelo': {...}}."""
+    if INVENTORY_INDEX_ENABLED:
+        return get_inventory_index(dealership_id).vocabulary()
+    vocabulary = _vocabulary_cache.get(dealership_id)
+    if vocabulary is None:
+        rows = db.session.query(Vehicle.marca, Vehicle.modelo).filter_by(
+            dealership_id=dealership_id, vendido=False).distinct().all()
+        vocabulary = {'marca': {}, 'modelo': {}}
+        for marca, modelo in rows:
+            if marca:
+                vocabulary['marca'][normalize_message(marca)] = marca
+            if modelo:
+                vocabulary['modelo'][normalize_message(modelo)] = modelo
+        _vocabulary_cache.set(dealership_id, vocabulary)
+    return vocabulary
+
+
+def get_inventory_matcher(dealership_id):
+    """match_term do índice do estoque: termo -> (campo, valor) mais parecido, ou None.
+
+    Sem o índice em memória não há correção aproximada (None)."""
+    if not INVENTORY_INDEX_ENABLED:
+        return None
+    return get_inventory_index(dealership_id).match_term
+
+
+MIN_CONFIDENCE = float(os.getenv('FAST_PATH_MIN_CONFIDENCE', '0.8'))
+
+
+def extract_fast_path(user_message, vocabulary, opcionais, min_confidence=None, match_term=None):
+    """Tenta extrair os parâmetros sem IA. Retorna o dict ou None (usar o Gemini)."""
+    min_confidence = MIN_CONFIDENCE if min_confidence is None else min_confidence
+    params, confidence = FastPathExtractor(vocabulary, opcionais, match_term=match_term).extract(user_message)
+    if params is not None and confidence >= min_confidence:
+        metrics.increment('ai.fast_path.hits')
+        metrics.increment(f"ai.fast_path.intent.{params.get('intent', 'search')}")
+        return params
+    metrics.increment('ai.fast_path.misses')
+    return None
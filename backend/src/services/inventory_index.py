@@ -0,0 +1,376 @@
+"""Índice do estoque em memória, por concessionária, para a busca da conversa.
+
+A busca do WhatsApp (search_vehicles_in_db) vai ao banco a cada mensagem. Aqui
+o estoque à venda de cada concessionária fica em memória:
+
+- marca/modelo/cor: mapa valor distinto -> ids, mais um mapa
+  palavra -> valores distintos para achar os candidatos sem varrer tudo;
+- preco/ano_modelo/quilometragem: listas ordenadas de (valor, id) consultadas
+  com bisect;
+- opcionais: chave canônica (vehicle_attributes.canonical_option) -> ids,
+  montado uma vez na carga: o ranking conta os opcionais pedidos por esse
+  mapa, sem reler o itens_opcionais de cada veículo;
+- marca/modelo/versao: índice de trigramas (fuzzy_match) para corrigir o que o
+  cliente digitou ("corola", "hb 20", "volks") antes da busca.
+
+Os candidatos são os mesmos da busca no banco (mesmos filtros, sobre os
+valores normalizados das colunas *_busca), ordenados por vehicle_ranking. As rotas de veículos
+atualizam o índice a cada escrita; como outros processos também escrevem no
+banco, cada índice é reconstruído depois de INVENTORY_INDEX_TTL segundos (ver
+o limite junto da configuração).
+
+A reconstrução é feita por uma thread de cada vez, por concessionária:
+enquanto ela carrega o estoque, as outras seguem com o índice anterior (ou
+esperam, se ainda não há índice), e as escritas que chegam nesse meio tempo
+são aplicadas ao índice novo antes de ele entrar no lugar.
+
+Com INVENTORY_INDEX_ENABLED=false nada daqui é usado: a busca, o vocabulário
+do extrator e a correção de marca/modelo vão ao banco.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.models import Vehicle
+from src.services.fuzzy_match import FuzzyIndex
+from src.services.vehicle_ranking import rank, ranking_frame
+from src.text_utils import normalize_message, normalize_search_text
+from src.vehicle_attributes import canonical_option, split_options
+
+INVENTORY_INDEX_ENABLED = os.getenv('INVENTORY_INDEX_ENABLED', 'true').lower() == 'true'
+# Escritas de outros processos (outro worker do gunicorn, `flask import-worker`)
+# não chegam ao índice deste processo: ficam invisíveis na busca da conversa
+# por até INVENTORY_INDEX_TTL segundos, até a próxima reconstrução
+INVENTORY_INDEX_TTL = int(os.getenv('INVENTORY_INDEX_TTL', '300'))
+
+RANGE_FIELDS = ('preco', 'ano_modelo', 'quilometragem')
+VEHICLE_COLUMNS = tuple(column.name for column in Vehicle.__table__.columns)
+
+
+def snapshot_vehicle(vehicle):
+    """Cópia das colunas do veículo, independente da sessão do SQLAlchemy."""
+    return SimpleNamespace(**{name: getattr(vehicle, name) for name in VEHICLE_COLUMNS})
+
+
+class _ValueIndex:
+    """Valor distinto (normalizado) -> ids, com as palavras de cada valor."""
+
+    def __init__(self):
+        self.ids = {}
+        self.words = {}
+        self.labels = {}
+
+    def add(self, value, vehicle_id, label=None):
+        ids = self.ids.get(value)
+        if ids is None:
+            ids = self.ids[value] = set()
+            self.labels[value] = label if label is not None else value
+            for word in value.split(' '):
+                self.words.setdefault(word, set()).add(value)
+        ids.add(vehicle_id)
+
+    def remove(self, value, vehicle_id):
+        ids = self.ids.get(value)
+        if ids is None:
+            return
+        ids.discard(vehicle_id)
+        if not ids:
+            del self.ids[value]
+            del self.labels[value]
+            for word in value.split(' '):
+                values = self.words.get(word)
+                if values is not None:
+                    values.discard(value)
+                    if not values:
+                        del self.words[word]
+
+    def match_words(self, term):
+        """Equivalente a `= term`, `like term %`, `% term` e `% term %`."""
+        first = term.split(' ')[0]
+        padded = f' {term} '
+        found = set()
+        for value in self.words.get(first, ()):
+            if padded in f' {value} ':
+                found |= self.ids[value]
+        return found
+
+    def match_substring(self, term):
+        """Equivalente a `like %term%`."""
+        found = set()
+        for value, ids in self.ids.items():
+            if term in value:
+                found |= ids
+        return found
+
+
+class InventoryIndex:
+    """Estoque à venda de uma concessionária, indexado para search()."""
+
+    def __init__(self, vehicles=()):
+        self.vehicles = {}
+        self.marca = _ValueIndex()
+        self.modelo = _ValueIndex()
+        self.cor = _ValueIndex()
+        self.opcionais = {}  # chave canônica -> ids
+        self.option_keys = {}  # id -> chaves canônicas do veículo
+        self.fuzzy = FuzzyIndex()
+        self.ranges = {field: [] for field in RANGE_FIELDS}
+        self.built_at = time.monotonic()
+        self._vocabulary = None
+        self._ranking = None  # colunas do ranking (vehicle_ranking), refeitas após escritas
+        self._option_arrays = {}  # chave -> ids ordenados (np.array), refeitos após escritas
+        self._lock = threading.RLock()
+        for vehicle in vehicles:
+            self._add(snapshot_vehicle(vehicle), sort=False)
+        for entries in self.ranges.values():
+            entries.sort()
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def _add(self, vehicle, sort=True):
+        self.vehicles[vehicle.id] = vehicle
+        if vehicle.marca:
+            self.marca.add(normalize_search_text(vehicle.marca), vehicle.id, vehicle.marca)
+        if vehicle.modelo:
+            self.modelo.add(normalize_search_text(vehicle.modelo), vehicle.id, vehicle.modelo)
+        self._add_fuzzy(vehicle, self.fuzzy.add)
+        if vehicle.cor:
+            self.cor.add(normalize_search_text(vehicle.cor), vehicle.id)
+        keys = frozenset(key for key, _ in split_options(vehicle.itens_opcionais))
+        self.option_keys[vehicle.id] = keys
+        for key in keys:
+            self.opcionais.setdefault(key, set()).add(vehicle.id)
+        for field in RANGE_FIELDS:
+            value = getattr(vehicle, field)
+            if value is None:
+                continue
+            if sort:
+                self.ranges[field].insert(bisect_left(self.ranges[field], (value, vehicle.id)), (value, vehicle.id))
+            else:
+                self.ranges[field].append((value, vehicle.id))
+        self._vocabulary = None
+        self._ranking = None
+        self._option_arrays = {}
+
+    def _remove(self, vehicle_id):
+        vehicle = self.vehicles.pop(vehicle_id, None)
+        if vehicle is None:
+            return
+        if vehicle.marca:
+            self.marca.remove(normalize_search_text(vehicle.marca), vehicle_id)
+        if vehicle.modelo:
+            self.modelo.remove(normalize_search_text(vehicle.modelo), vehicle_id)
+        self._add_fuzzy(vehicle, self.fuzzy.remove)
+        if vehicle.cor:
+            self.cor.remove(normalize_search_text(vehicle.cor), vehicle_id)
+        for key in self.option_keys.pop(vehicle_id, ()):
+            ids = self.opcionais.get(key)
+            if ids is not None:
+                ids.discard(vehicle_id)
+                if not ids:
+                    del self.opcionais[key]
+        for field in RANGE_FIELDS:
+            value = getattr(vehicle, field)
+            if value is None:
+                continue
+            entries = self.ranges[field]
+            position = bisect_left(entries, (value, vehicle_id))
+            if position < len(entries) and entries[position] == (value, vehicle_id):
+                del entries[position]
+        self._vocabulary = None
+        self._ranking = None
+        self._option_arrays = {}
+
+    @staticmethod
+    def _add_fuzzy(vehicle, apply):
+        if vehicle.marca:
+            apply('marca', vehicle.marca)
+        if vehicle.modelo:
+            apply('modelo', vehicle.modelo)
+            if vehicle.versao:
+                apply('versao', vehicle.versao, modelo=vehicle.modelo)
+
+    def upsert(self, vehicle):
+        """Inclui/atualiza o veículo; vendidos saem do índice."""
+        with self._lock:
+            self._remove(vehicle.id)
+            if not vehicle.vendido:
+                self._add(snapshot_vehicle(vehicle))
+
+    def remove(self, vehicle_id):
+        with self._lock:
+            self._remove(vehicle_id)
+
+    def _range_ids(self, field, low=None, high=None):
+        entries = self.ranges[field]
+        start = 0 if low is None else bisect_left(entries, (low,))
+        end = len(entries) if high is None else bisect_right(entries, (high, float('inf')))
+        return {vehicle_id for _, vehicle_id in entries[start:end]}
+
+    def search_ids(self, query_params):
+        """Ids (ordenados) dos veículos que atendem query_params, como no banco."""
+        with self._lock:
+            candidates = []
+            if query_params.get('modelo'):
+                candidates.append(self.modelo.match_words(normalize_search_text(query_params['modelo'])))
+            if query_params.get('marca'):
+                candidates.append(self.marca.match_words(normalize_search_text(query_params['marca'])))
+            if query_params.get('cor'):
+                candidates.append(self.cor.match_substring(normalize_search_text(query_params['cor'])))
+            if query_params.get('preco_min') or query_params.get('preco_max'):
+                candidates.append(self._range_ids('preco', query_params.get('preco_min') or None,
+                                                  query_params.get('preco_max') or None))
+            if query_params.get('ano_min') or query_params.get('ano_max'):
+                candidates.append(self._range_ids('ano_modelo', query_params.get('ano_min') or None,
+                                                  query_params.get('ano_max') or None))
+            if query_params.get('quilometragem_max'):
+                candidates.append(self._range_ids('quilometragem', high=query_params['quilometragem_max']))
+
+            if not candidates:
+                return sorted(self.vehicles)
+            candidates.sort(key=len)
+            result = set(candidates[0])
+            for ids in candidates[1:]:
+                result &= ids
+                if not result:
+                    break
+            return sorted(result)
+
+    def search_ranked(self, query_params, limit=5, after=None, semantic=None):
+        """Até `limit` (chave, veículo) na ordem do ranking, depois do cursor `after`.
+
+        `semantic` são as notas da busca semântica ({id: nota}), somadas ao ranking.
+        """
+        with self._lock:
+            ids = self.search_ids(query_params)
+            if self._ranking is None:
+                self._ranking = ranking_frame(self.vehicles.values(), self.option_keys) \
+                    .sort_values('id', ignore_index=True)
+            # os ids vêm ordenados e todos estão no frame: posições por busca binária
+            positions = np.searchsorted(self._ranking['id'].to_numpy(), np.fromiter(ids, dtype=np.int64, count=len(ids)))
+            candidates = self._ranking.take(positions)
+            ranked = rank(candidates, query_params, limit, after=after, semantic=semantic,
+                          option_ids=self._option_ids(query_params.get('opcionais')))
+            return [(key, self.vehicles[vehicle_id]) for vehicle_id, key in ranked]
+
+    def _option_ids(self, opcionais):
+        """{chave: ids ordenados} dos opcionais pedidos que algum veículo tem."""
+        found = {}
+        for item in opcionais or []:
+            if not item or not item.strip():
+                continue
+            key = canonical_option(item)[0]
+            if key in self.opcionais and key not in found:
+                if key not in self._option_arrays:
+                    self._option_arrays[key] = np.array(sorted(self.opcionais[key]), dtype=np.int64)
+                found[key] = self._option_arrays[key]
+        return found
+
+    def search(self, query_params, limit=5, after=None):
+        return [vehicle for _, vehicle in self.search_ranked(query_params, limit=limit, after=after)]
+
+    def match_term(self, term, fields=('modelo', 'versao', 'marca')):
+        """(campo, rótulo) do estoque mais parecido com `term`, ou None."""
+        with self._lock:
+            return self.fuzzy.best(term, fields=fields)
+
+    def resolve_params(self, query_params):
+        """Troca marca/modelo sem nenhum veículo pelo valor mais parecido do estoque.
+
+        Retorna uma cópia de query_params; os valores que já existem no estoque
+        (mesma regra de palavras da busca) ficam como estão.
+        """
+        resolved = dict(query_params)
+        with self._lock:
+            for field, values, fields in (('modelo', self.modelo, ('modelo', 'versao')),
+                                          ('marca', self.marca, ('marca',))):
+                term = query_params.get(field)
+                if not term or values.match_words(normalize_search_text(term)):
+                    continue
+                match = self.fuzzy.best(term, fields=fields)
+                if match is not None:
+                    resolved[field] = match[1]
+        return resolved
+
+    def vocabulary(self):
+        """Marcas e modelos do estoque: {'marca': {norm: valor}, 'modelo': {...}}."""
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = {
+                    'marca': {normalize_message(label): label for label in self.marca.labels.values()},
+                    'modelo': {normalize_message(label): label for label in self.modelo.labels.values()},
+                }
+            return self._vocabulary
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_build_locks = {}
+# Escritas recebidas durante a reconstrução: dealership_id -> [snapshot do veículo]
+# (None = índice invalidado no meio da carga)
+_pending = {}
+
+
+def _is_fresh(index):
+    return index is not None and time.monotonic() - index.built_at < INVENTORY_INDEX_TTL
+
+
+def get_inventory_index(dealership_id):
+    """Índice da concessionária, (re)construído a partir do banco quando preciso."""
+    with _indexes_lock:
+        index = _indexes.get(dealership_id)
+        build_lock = _build_locks.setdefault(dealership_id, threading.Lock())
+    if _is_fresh(index):
+        return index
+    # com um índice vencido em mãos, não espera quem já está reconstruindo
+    if not build_lock.acquire(blocking=index is None):
+        return index
+    try:
+        with _indexes_lock:
+            index = _indexes.get(dealership_id)
+            if _is_fresh(index):
+                return index
+            _pending[dealership_id] = []
+        vehicles = Vehicle.query.filter_by(dealership_id=dealership_id, vendido=False).all()
+        index = InventoryIndex(vehicles)
+        with _indexes_lock:
+            pending = _pending.pop(dealership_id)
+            if None in pending:
+                # invalidado durante a carga: serve esta busca, mas não fica guardado
+                _indexes.pop(dealership_id, None)
+                return index
+            for vehicle in pending:
+                index.upsert(vehicle)
+            _indexes[dealership_id] = index
+        return index
+    finally:
+        build_lock.release()
+
+
+def update_inventory_index(vehicle):
+    """Aplica uma escrita de veículo ao índice já carregado (se houver)."""
+    with _indexes_lock:
+        pending = _pending.get(vehicle.dealership_id)
+        if pending is not None:
+            pending.append(snapshot_vehicle(vehicle))
+        index = _indexes.get(vehicle.dealership_id)
+    if index is not None:
+        index.upsert(vehicle)
+
+
+def invalidate_inventory_index(dealership_id=None):
+    """Descarta o índice da concessionária (ou todos), forçando nova carga."""
+    with _indexes_lock:
+        if dealership_id is None:
+            _indexes.clear()
+            for pending in _pending.values():
+                pending.append(None)
+        else:
+            _indexes.pop(dealership_id, None)
+            if dealership_id in _pending:
+                _pending[dealership_id].append(None)
@@ -0,0 +1,153 @@
+"""Versão do estoque por concessionária e GET condicional (ETag / Last-Modified).
+
+O frontend e os parceiros consultam GET /vehicles/?dealership_id= e
+GET /dealerships/ o tempo todo. Cada concessionária tem uma versão do
+estoque, derivada de count(*) e max(data_atualizacao) dos seus veículos e de
+Dealership.inventory_updated_at, e guardada no cache `inventory_versions`.
+As escritas (rotas de veículos e importação de planilhas) chamam
+bump_inventory_version, que grava inventory_updated_at e descarta a versão; a
+próxima leitura recalcula. inventory_updated_at cobre o que o
+max(data_atualizacao) não vê, como um veículo que sai para outra
+concessionária.
+
+A ETag da resposta é a versão mais os parâmetros da consulta; com
+If-None-Match (ou If-Modified-Since) batendo, a rota responde 304 só com a
+consulta ao cache, sem ler a tabela de veículos.
+
+Os destaques vencem com o tempo (destaque_ate), sem escrita nenhuma: a versão
+das listagens com `destaque` (listing_version) leva o próximo vencimento e é
+recalculada quando ele passa. Essas listagens não têm Last-Modified.
+
+Com CACHE_BACKEND=memory cada processo tem sua cópia: escritas de outro
+processo (ex.: `flask import-worker`) aparecem em até INVENTORY_VERSION_TTL
+segundos. Com redis a versão é compartilhada.
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import Response, request
+from sqlalchemy import func, update
+
+from src import metrics
+from src.cache import create_cache
+from src.database import db
+from src.models import Dealership, Vehicle
+
+INVENTORY_VERSION_TTL = int(os.getenv('INVENTORY_VERSION_TTL', '60'))
+
+version_cache = create_cache(
+    'inventory_versions',
+    maxsize=int(os.getenv('INVENTORY_VERSION_CACHE_SIZE', '10000')),
+    ttl=INVENTORY_VERSION_TTL
+)
+
+DEALERSHIPS_KEY = 'dealerships'
+
+
+def _stamp(count, *changed_at, **extra):
+    last_modified = max((value for value in changed_at if value), default=None)
+    return dict(extra, **{
+        'version': '-'.join([str(count)] + [value.isoformat() if value else '0' for value in changed_at]),
+        'last_modified': last_modified.isoformat() if last_modified else None,
+    })
+
+
+def _cached_stamp(key, compute):
+    stamp = version_cache.get(key)
+    if stamp is not None:
+        metrics.increment('http.inventory_version.hits')
+        return stamp
+    metrics.increment('http.inventory_version.misses')
+    stamp = compute()
+    version_cache.set(key, stamp)
+    return stamp
+
+
+def inventory_version(dealership_id):
+    """{'version', 'last_modified', 'destaque_expires_at'} do estoque da concessionária."""
+    def compute():
+        now = datetime.utcnow()
+        count, updated_at, expires_at = db.session.query(
+            func.count(Vehicle.id),
+            func.max(Vehicle.data_atualizacao),
+            func.min(Vehicle.destaque_ate).filter(Vehicle.destaque == True, Vehicle.vendido == False,
+                                                  Vehicle.destaque_ate > now)
+        ).filter(Vehicle.dealership_id == dealership_id).one()
+        inventory_updated_at = db.session.query(Dealership.inventory_updated_at) \
+            .filter(Dealership.id == dealership_id).scalar()
+        return _stamp(count, updated_at, inventory_updated_at,
+                      destaque_expires_at=expires_at.isoformat() if expires_at else None)
+    return _cached_stamp(f'vehicles:{dealership_id}', compute)
+
+
+def listing_version(dealership_id, destaque=False):
+    """Versão de uma listagem de veículos; com `destaque`, muda quando um destaque vence.
+
+    É a mesma versão usada na ETag e na chave do cache das listagens."""
+    stamp = inventory_version(dealership_id)
+    if not destaque:
+        return stamp
+    expires_at = stamp['destaque_expires_at']
+    if expires_at and datetime.fromisoformat(expires_at) <= datetime.utcnow():
+        version_cache.delete(f'vehicles:{dealership_id}')
+        stamp = inventory_version(dealership_id)
+        expires_at = stamp['destaque_expires_at']
+    # sem Last-Modified: o vencimento não muda data nenhuma que o cliente possa comparar
+    return {'version': f"{stamp['version']}-destaque-{expires_at or 0}", 'last_modified': None}
+
+
+def dealerships_version():
+    """{'version', 'last_modified'} da lista de concessionárias."""
+    def compute():
+        count, updated_at = db.session.query(func.count(Dealership.id), func.max(Dealership.updated_at)).one()
+        return _stamp(count, updated_at)
+    return _cached_stamp(DEALERSHIPS_KEY, compute)
+
+
+def bump_inventory_version(dealership_id):
+    """Registra uma escrita no estoque da concessionária (chamar depois do commit)."""
+    db.session.execute(update(Dealership).where(Dealership.id == dealership_id).values(
+        inventory_updated_at=datetime.utcnow(),
+        updated_at=Dealership.updated_at  # não é uma mudança da concessionária em si
+    ))
+    db.session.commit()
+    version_cache.delete(f'vehicles:{dealership_id}')
+
+
+def bump_dealerships_version():
+    version_cache.delete(DEALERSHIPS_KEY)
+
+
+def _etag(stamp):
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f"{stamp['version']}|{request.path}?{args}".encode('utf-8')).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return bool(since and last_modified and last_modified.replace(microsecond=0) <= since)
+
+
+def conditional_get(stamp, build_response):
+    """304 se o cliente já tem esta versão; senão a resposta de `build_response()`.
+
+    As duas levam ETag (fraca), Last-Modified e Cache-Control: no-cache (o
+    cliente pode guardar, mas revalida a cada uso)."""
+    etag = _etag(stamp)
+    last_modified = stamp['last_modified'] and \
+        datetime.fromisoformat(stamp['last_modified']).replace(tzinfo=timezone.utc)
+    if _not_modified(etag, last_modified):
+        metrics.increment('http.not_modified')
+        response = Response(status=304)
+    else:
+        response = build_response()
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,319 @@
+"""Índice vetorial (IVF) em disco, por concessionária, para a busca semântica.
+
+Cada concessionária tem um diretório em EMBEDDING_INDEX_DIR:
+
+    dealership_<id>/
+        current -> v<timestamp>     (symlink trocado atomicamente a cada build)
+        v<timestamp>/
+            vectors.npy   vetores float32 agrupados por lista (memory-mapped)
+            ids.npy       id do veículo de cada linha
+            offsets.npy   início de cada lista em vectors/ids
+            centroids.npy centróides do k-means (um por lista)
+            meta.json     modelo, dimensão, quantidade, data
+
+A consulta compara o vetor da mensagem com os centróides, percorre só as
+VECTOR_NPROBE listas mais próximas e devolve os SEMANTIC_TOP_K mais parecidos.
+Com poucos veículos (< IVF_MIN_VECTORS) há uma lista só (busca exata).
+
+A busca semântica é opcional: liga com SEMANTIC_SEARCH_ENABLED=true e um
+EMBEDDING_INDEX_DIR persistente (sem o diretório ela fica desligada).
+
+O índice é um retrato do estoque e nunca é construído durante uma mensagem:
+o VectorIndexBuilder o refaz em segundo plano quando a concessionária ainda
+não tem índice (a primeira busca só agenda o build), quando um veículo é
+criado, alterado ou removido e quando uma importação termina; `flask
+embeddings-build` refaz na hora. Até o novo índice ficar pronto vale o
+anterior: veículos novos continuam aparecendo na busca, só sem o bônus
+semântico.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import numpy as np
+from flask import current_app
+
+from src.models import Dealership, Vehicle
+from src.services.embeddings import get_embedder, vehicle_text
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_SEARCH_ENABLED = os.getenv('SEMANTIC_SEARCH_ENABLED', 'false').lower() == 'true'
+# Obrigatório com a busca semântica ligada: os índices sobrevivem a restarts e são compartilhados pelos processos
+EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', '')
+SEMANTIC_TOP_K = int(os.getenv('SEMANTIC_TOP_K', '100'))
+VECTOR_NPROBE = int(os.getenv('VECTOR_NPROBE', '24'))
+IVF_MIN_VECTORS = int(os.getenv('IVF_MIN_VECTORS', '2000'))
+# Cosseno mínimo para a mensagem contar como descrição de algum veículo
+SEMANTIC_MIN_SIMILARITY = float(os.getenv('SEMANTIC_MIN_SIMILARITY', '0.2'))
+KMEANS_SAMPLE = 50000
+BATCH = 8192
+
+
+def semantic_search_enabled():
+    return SEMANTIC_SEARCH_ENABLED and bool(EMBEDDING_INDEX_DIR)
+
+
+def _assign(vectors, centroids):
+    """Lista (centróide mais próximo) de cada vetor, em lotes."""
+    assignment = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), BATCH):
+        assignment[start:start + BATCH] = np.argmax(vectors[start:start + BATCH] @ centroids.T, axis=1)
+    return assignment
+
+
+def kmeans(vectors, nlist, iterations=10, seed=0):
+    """k-means esférico (cosseno) sobre uma amostra dos vetores."""
+    rng = np.random.default_rng(seed)
+    sample = vectors if len(vectors) <= KMEANS_SAMPLE else vectors[rng.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms == 0, 1, norms)
+    return centroids.astype(np.float32)
+
+
+def write_vector_index(path, ids, vectors, meta, nlist=None):
+    """Grava um novo índice em `path` e o torna o atual (troca do symlink)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if nlist is None:
+        nlist = 1 if len(ids) < IVF_MIN_VECTORS else int(np.sqrt(len(ids)))
+    nlist = max(1, min(nlist, len(ids)))
+    if nlist == 1:
+        centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        assignment = np.zeros(len(ids), dtype=np.int64)
+    else:
+        centroids = kmeans(vectors, nlist)
+        assignment = _assign(vectors, centroids)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+    os.makedirs(path, exist_ok=True)
+    version = os.path.join(path, f'v{time.time_ns()}')
+    os.makedirs(version)
+    np.save(os.path.join(version, 'vectors.npy'), vectors[order])
+    np.save(os.path.join(version, 'ids.npy'), ids[order])
+    np.save(os.path.join(version, 'offsets.npy'), offsets)
+    np.save(os.path.join(version, 'centroids.npy'), centroids)
+    with open(os.path.join(version, 'meta.json'), 'w') as f:
+        json.dump(dict(meta, count=len(ids), dim=int(vectors.shape[1]), nlist=nlist), f)
+
+    link = os.path.join(path, f'current.tmp-{os.getpid()}-{threading.get_ident()}')
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, os.path.join(path, 'current'))
+    # Fica a versão anterior para quem ainda está abrindo os arquivos dela; quem
+    # já os mapeou continua lendo mesmo depois de apagados
+    versions = sorted((name for name in os.listdir(path) if name.startswith('v')), key=lambda name: int(name[1:]))
+    for name in versions[:-2]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    return version
+
+
+class VectorIndex:
+    """Índice IVF carregado de um diretório de versão; os vetores ficam em mmap."""
+
+    def __init__(self, version_path):
+        self.path = version_path
+        self.vectors = np.load(os.path.join(version_path, 'vectors.npy'), mmap_mode='r')
+        self.ids = np.load(os.path.join(version_path, 'ids.npy'))
+        self.offsets = np.load(os.path.join(version_path, 'offsets.npy'))
+        self.centroids = np.load(os.path.join(version_path, 'centroids.npy'))
+        with open(os.path.join(version_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=SEMANTIC_TOP_K, nprobe=VECTOR_NPROBE):
+        """(ids, notas) dos k vetores mais parecidos com `query`, da maior nota para a menor."""
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        nlist = len(self.centroids)
+        lists = np.arange(nlist) if nprobe >= nlist else \
+            np.argpartition(-(self.centroids @ query), nprobe)[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in np.sort(lists)])
+        if not len(rows):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.vectors[rows] @ query
+        top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return self.ids[rows[top]], scores[top]
+
+
+def index_path(dealership_id):
+    return os.path.join(EMBEDDING_INDEX_DIR, f'dealership_{dealership_id}')
+
+
+def build_vector_index(dealership_id, embedder=None):
+    """Calcula os embeddings do estoque à venda e grava um novo índice."""
+    embedder = embedder or get_embedder()
+    started = time.monotonic()
+    ids, texts = [], []
+    for vehicle in Vehicle.query.filter_by(dealership_id=dealership_id, vendido=False).yield_per(1000):
+        ids.append(vehicle.id)
+        texts.append(vehicle_text(vehicle))
+    vectors = embedder.encode_vehicles(texts) if texts else np.zeros((0, embedder.dim), dtype=np.float32)
+    version = write_vector_index(index_path(dealership_id), ids, vectors,
+                                 {'model': embedder.name, 'built_at': time.time()})
+    logger.info('Vector index for dealership %s: %d vehicles in %.1fs', dealership_id, len(ids),
+                time.monotonic() - started)
+    return VectorIndex(version)
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_vector_index(dealership_id):
+    """Índice atual da concessionária (recarregado se outro processo o refez), ou
+    None se ainda não existe ou foi feito com outro modelo. Não constrói."""
+    current = os.path.join(index_path(dealership_id), 'current')
+    version = os.path.realpath(current) if os.path.islink(current) else None
+    with _loaded_lock:
+        index = _loaded.get(dealership_id)
+    if index is not None and index.path == version:
+        return index
+    if version is None:
+        return None
+    index = VectorIndex(version)
+    if index.meta.get('model') != get_embedder().name:
+        return None
+    with _loaded_lock:
+        _loaded[dealership_id] = index
+    return index
+
+
+class VectorIndexBuilder:
+    """Refaz os índices vetoriais em segundo plano, fora do caminho das mensagens.
+
+    Pedidos para uma concessionária que já espera ou está sendo refeita viram
+    um build só (depois do atual). Com num_workers=0 nada roda sozinho: use
+    run_pending() ou `flask embeddings-build`.
+    """
+
+    def __init__(self, app, num_workers=1):
+        self.app = app
+        self.num_workers = num_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._running = set()
+
+    def schedule(self, dealership_id):
+        with self._lock:
+            if dealership_id in self._pending:
+                return
+            self._pending.add(dealership_id)
+            if dealership_id in self._running:
+                return  # o worker atual refaz de novo ao terminar
+        executor = self._get_executor()
+        if executor is not None:
+            executor.submit(self._run_in_context, dealership_id)
+
+    def _get_executor(self):
+        if self._executor is None and self.num_workers > 0:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.num_workers,
+                                                        thread_name_prefix='vector-index')
+        return self._executor
+
+    def run(self, dealership_id):
+        """Refaz o índice pedido para a concessionária. Deve rodar dentro de um app context."""
+        with self._lock:
+            if dealership_id not in self._pending or dealership_id in self._running:
+                return False
+            self._pending.discard(dealership_id)
+            self._running.add(dealership_id)
+        try:
+            index = build_vector_index(dealership_id)
+            with _loaded_lock:
+                _loaded[dealership_id] = index
+        finally:
+            with self._lock:
+                self._running.discard(dealership_id)
+        return True
+
+    def run_pending(self):
+        """Refaz de forma síncrona os índices pedidos."""
+        with self._lock:
+            dealership_ids = sorted(self._pending)
+        return sum(1 for dealership_id in dealership_ids if self.run(dealership_id))
+
+    def _run_in_context(self, dealership_id):
+        try:
+            with self.app.app_context():
+                self.run(dealership_id)
+        except Exception as e:
+            logger.error(f"Erro ao refazer o índice vetorial da concessionária {dealership_id}: {str(e)}")
+        finally:
+            with self._lock:
+                again = dealership_id in self._pending and dealership_id not in self._running
+            if again:
+                self._executor.submit(self._run_in_context, dealership_id)
+
+
+def invalidate_vector_index(dealership_id):
+    """Pede um novo índice da concessionária (o estoque mudou); o atual vale até ele ficar pronto."""
+    builder = current_app.extensions.get('vector_index')
+    if builder is not None and dealership_id is not None and semantic_search_enabled():
+        builder.schedule(dealership_id)
+
+
+def semantic_scores(dealership_id, text, k=SEMANTIC_TOP_K, min_similarity=0.0):
+    """{id do veículo: nota de 0 a 1} dos mais parecidos com `text`.
+
+    A nota é relativa ao mais parecido (1.0), para pesar igual no ranking
+    qualquer que seja o modelo. Só entram veículos com cosseno acima de
+    `min_similarity`. Vazio se a busca semântica estiver desligada ou se a
+    concessionária ainda não tiver índice (o build é agendado).
+    """
+    if not semantic_search_enabled() or not text or not text.strip():
+        return {}
+    index = get_vector_index(dealership_id)
+    if index is None:
+        invalidate_vector_index(dealership_id)
+        return {}
+    ids, scores = index.search(get_embedder().encode_query(text), k=k)
+    keep = scores > max(min_similarity, 0)
+    ids, scores = ids[keep], scores[keep]
+    if not len(ids):
+        return {}
+    scores = np.clip(scores / scores[0], 0, 1)
+    return {int(vehicle_id): float(score) for vehicle_id, score in zip(ids, scores) if score > 0}
+
+
+def init_vector_index(app):
+    """Configura o builder dos índices (EMBEDDING_BUILD_WORKERS) e o comando `flask embeddings-build`."""
+    builder = VectorIndexBuilder(
+        app, num_workers=int(app.config.setdefault('EMBEDDING_BUILD_WORKERS',
+                                                   int(os.getenv('EMBEDDING_BUILD_WORKERS', '1')))))
+    app.extensions['vector_index'] = builder
+    if SEMANTIC_SEARCH_ENABLED and not EMBEDDING_INDEX_DIR:
+        logger.warning('SEMANTIC_SEARCH_ENABLED sem EMBEDDING_INDEX_DIR: busca semântica desligada')
+
+    @app.cli.command('embeddings-build')
+    @click.option('--dealership-id', type=int, default=None, help='Só esta concessionária (padrão: todas).')
+    def embeddings_build(dealership_id):
+        """Refaz o índice vetorial da busca semântica."""
+        if not EMBEDDING_INDEX_DIR:
+            raise click.UsageError('Configure EMBEDDING_INDEX_DIR')
+        ids = [dealership_id] if dealership_id else [d.id for d in Dealership.query.filter_by(active=True)]
+        for current in ids:
+            index = build_vector_index(current)
+            click.echo(f'dealership {current}: {len(index)} vehicles indexed')
+
+    return builder
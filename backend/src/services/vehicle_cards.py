@@ -0,0 +1,84 @@
+"""Cartões de WhatsApp de cada veículo, renderizados uma vez e guardados em cache.
+
+O mesmo carro aparece em milhares de respostas por dia. Em vez de refazer os
+textos (preço, km, opcionais) e separar link_fotos a cada mensagem, o cartão
+do veículo fica no cache:
+
+    {'version': data_atualizacao, 'list': texto do resultado da busca,
+     'detail': texto do "Quero saber mais", 'photos': [urls]}
+
+A entrada é descartada quando data_atualizacao muda (comparada na leitura)
+e pelas rotas de veículos a cada escrita (invalidate_vehicle_card). Usa o
+backend de CACHE_BACKEND; os valores são serializáveis em JSON.
+"""
+import os
+
+from src import metrics
+from src.cache import create_cache
+from src.vehicle_attributes import split_photos
+
+card_cache = create_cache(
+    'vehicle_cards',
+    maxsize=int(os.getenv('VEHICLE_CARD_CACHE_SIZE', '20000')),
+    ttl=int(os.getenv('VEHICLE_CARD_CACHE_TTL', '86400'))
+)
+
+
+def _price(value):
+    return f"R$ {value:,.2f}" if value is not None else 'Não informado'
+
+
+def _km(value):
+    return f"{value:,} km" if value is not None else 'Não informado'
+
+
+def render_card(vehicle):
+    """Textos e fotos do veículo (sem cache)."""
+    title = f"*{vehicle.marca} {vehicle.modelo} {vehicle.ano_modelo}*"
+    itens = vehicle.itens_opcionais
+    list_text = f"{title}\n" \
+                f"Preço: {_price(vehicle.preco)}\n" \
+                f"Cor: {vehicle.cor}\n" \
+                f"Quilometragem: {_km(vehicle.quilometragem)}\n" \
+                f"Câmbio: {vehicle.cambio}\n" \
+                f"Combustível: {vehicle.combustivel}\n" \
+                f"Itens: {itens if itens else 'Não informado'}"
+    detail_text = f"{title}\n\n" \
+                  f"Características Técnicas:\n" \
+                  f"• Motor: {vehicle.motor or 'Não informado'}\n" \
+                  f"• Câmbio: {vehicle.cambio}\n" \
+                  f"• Combustível: {vehicle.combustivel}\n" \
+                  f"• Quilometragem: {_km(vehicle.quilometragem)}\n\n" \
+                  f"Itens de Série:\n" \
+                  f"• {itens.replace(';', chr(10) + '• ') if itens else 'Não informado'}\n\n" \
+                  f"Preço: {_price(vehicle.preco)}\n\n" \
+                  f"Gostaria de:\n" \
+                  f"• Ver mais fotos?"
+    return {
+        'version': _version(vehicle),
+        'list': list_text,
+        'detail': detail_text,
+        'photos': split_photos(vehicle.link_fotos),
+    }
+
+
+def _version(vehicle):
+    updated_at = getattr(vehicle, 'data_atualizacao', None)
+    return updated_at.isoformat() if updated_at else None
+
+
+def get_vehicle_card(vehicle):
+    """Cartão do veículo: do cache se a versão (data_atualizacao) confere."""
+    key = str(vehicle.id)
+    card = card_cache.get(key)
+    if card is not None and card.get('version') == _version(vehicle):
+        metrics.increment('whatsapp.card_cache.hits')
+        return card
+    metrics.increment('whatsapp.card_cache.misses')
+    card = render_card(vehicle)
+    card_cache.set(key, card)
+    return card
+
+
+def invalidate_vehicle_card(vehicle_id):
+    card_cache.delete(str(vehicle_id))
@@ -0,0 +1,550 @@
+"""Importação em lote de veículos a partir de planilhas (CSV/XLSX).
+
+O arquivo é lido em blocos (iter_vehicle_frames), então a memória usada
+depende de IMPORT_CHUNK_SIZE e não do tamanho da planilha.
+
+O mapeamento de colunas é resolvido uma vez por arquivo; conversão de tipos e
+validação (as mesmas regras dos validators de Vehicle) são feitas por coluna
+com pandas/NumPy; as linhas válidas são gravadas em blocos de
+IMPORT_CHUNK_SIZE com executemany (ou COPY no PostgreSQL). Cada bloco é
+confirmado separadamente: uma falha de banco descarta só o bloco e entra no
+relatório de erros.
+
+No modo sync (VehicleSync) a planilha é o estoque completo da loja: cada
+linha é casada com o veículo já cadastrado pela identidade (SKU ou hash de
+marca/modelo/versão/anos/final da placa) e só as diferenças são gravadas.
+"""
+import csv
+import io
+import logging
+import os
+import time
+import unicodedata
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import insert, select, update
+
+from src import metrics
+from src.database import db
+from src.models import Vehicle
+from src.services.vehicle_options import sync_changed_vehicles
+from src.text_utils import normalize_search_text
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+# auto = COPY quando o banco é PostgreSQL; false = sempre executemany
+IMPORT_USE_COPY = os.getenv('IMPORT_USE_COPY', 'auto').lower()
+# Mensagens de erro guardadas por importação (as demais só entram na contagem)
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', '1000'))
+
+# Campo do modelo -> nomes aceitos na planilha (comparados sem caixa/acento)
+COLUMN_MAPPING = {
+    'sku': ['SKU', 'Código', 'Referência'],
+    'marca': ['Marca'],
+    'modelo': ['Modelo'],
+    'versao': ['Versão'],
+    'ano_fabricacao': ['Ano Fabricação'],
+    'ano_modelo': ['Ano Modelo'],
+    'quilometragem': ['Quilometragem'],
+    'estado': ['Estado'],
+    'cambio': ['Câmbio'],
+    'combustivel': ['Combustível'],
+    'motor': ['Motor'],
+    'potencia': ['Potência'],
+    'final_placa': ['Final Placa'],
+    'cor': ['Cor'],
+    'preco': ['Preço'],
+    'preco_promocional': ['Preço Promocional'],
+    'itens_opcionais': ['Itens Opcionais'],
+    'link_fotos': ['Link Fotos'],
+    'observacoes': ['Observações'],
+}
+
+TEXT_FIELDS = ['sku', 'marca', 'modelo', 'versao', 'estado', 'cambio', 'combustivel', 'motor', 'potencia',
+               'final_placa', 'cor', 'itens_opcionais', 'link_fotos', 'observacoes']
+YEAR_FIELDS = ['ano_fabricacao', 'ano_modelo']
+PRICE_FIELDS = ['preco', 'preco_promocional']
+REQUIRED_FIELDS = ['marca', 'modelo']
+# Campo -> coluna normalizada usada nas buscas
+SEARCH_FIELDS = {'marca': 'marca_busca', 'modelo': 'modelo_busca', 'cor': 'cor_busca'}
+
+ESTADOS = ['Novo', 'Usado']
+CAMBIOS = ['Manual', 'Automático']
+COMBUSTIVEIS = ['Flex', 'Gasolina', 'Diesel', 'Elétrico', 'Híbrido']
+
+# Limites das colunas String do modelo (o PostgreSQL rejeita valores maiores)
+MAX_LENGTHS = {column.name: column.type.length for column in Vehicle.__table__.columns
+               if getattr(column.type, 'length', None)}
+
+
+def _header_key(name):
+    text = unicodedata.normalize('NFKD', str(name))
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).lower().split())
+
+
+def resolve_columns(columns):
+    """Campo -> colunas da planilha que o alimentam, na ordem de preferência."""
+    by_key = {}
+    for column in columns:
+        by_key.setdefault(_header_key(column), []).append(column)
+    resolved = {}
+    for field, names in COLUMN_MAPPING.items():
+        matches = [column for name in names for column in by_key.get(_header_key(name), [])]
+        if matches:
+            resolved[field] = matches
+    return resolved
+
+
+def _as_text(series):
+    """Texto sem espaços nas pontas; vazio vira nulo."""
+    text = series.astype('string').str.strip()
+    text = text.mask(text == '')
+    return text.astype(object).where(text.notna(), None)
+
+
+def _as_number(series):
+    """Converte números, aceitando o formato brasileiro ("R$ 85.000,00")."""
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.to_numeric(series, errors='coerce')
+    text = _as_text(series).str.replace(r'[R$\s]', '', regex=True)
+    # vírgula decimal, ou só pontos de milhar ("85.000")
+    brazilian = text.str.contains(',', na=False) | text.str.fullmatch(r'\d{1,3}(?:\.\d{3})+', na=False)
+    text = text.where(~brazilian, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(text, errors='coerce')
+
+
+def _unique_map(series, func):
+    """Aplica `func` só uma vez por valor distinto."""
+    mapping = {value: func(value) for value in series.dropna().unique()}
+    return series.map(mapping)
+
+
+class VehicleImport:
+    """Importa DataFrames de uma planilha para o estoque de uma concessionária.
+
+    Pode receber vários DataFrames (blocos do mesmo arquivo): o mapeamento de
+    colunas é resolvido no primeiro e a numeração das linhas continua entre
+    eles. `rows`, `inserted`, `error_rows` e `rows_per_second` trazem o
+    progresso; `errors` guarda até IMPORT_MAX_ERRORS mensagens. `on_progress`,
+    se informado, é chamado com o importador depois de cada bloco da planilha.
+    """
+
+    def __init__(self, dealership_id, chunk_size=None, on_progress=None):
+        self.dealership_id = int(dealership_id)
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.on_progress = on_progress
+        self.columns = None
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []
+        self.error_rows = 0
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.elapsed, 1) if self.elapsed else 0.0
+
+    def run(self, frames):
+        """Importa todos os DataFrames de `frames` e retorna o resumo."""
+        self.started_at = time.perf_counter()
+        written_since = datetime.utcnow()
+        for frame in frames:
+            self.import_frame(frame)
+        self.finish()
+        # As gravações em lote não passam pelos validators de Vehicle
+        sync_changed_vehicles(self.dealership_id, written_since)
+        self.finished_at = time.perf_counter()
+        metrics.increment('vehicle_import.rows', self.rows)
+        metrics.increment('vehicle_import.inserted', self.inserted)
+        logger.info('Vehicle import for dealership %s: %s rows, %s inserted, %s errors, %.1f rows/s',
+                    self.dealership_id, self.rows, self.inserted, self.error_rows, self.rows_per_second)
+        return self.summary()
+
+    def finish(self):
+        """Chamado depois do último bloco."""
+
+    def summary(self):
+        return {
+            'mode': 'append',
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'errors': self.errors,
+            'error_rows': self.error_rows,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+        }
+
+    def import_frame(self, frame):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        if self.columns is None:
+            self.columns = resolve_columns(frame.columns)
+        first_row = self.rows + 2  # cabeçalho na linha 1 da planilha
+        self.rows += len(frame)
+        if not frame.empty:
+            records = self.prepare(frame, first_row)
+            for start in range(0, len(records), self.chunk_size):
+                self.write_chunk(records.iloc[start:start + self.chunk_size])
+        if self.on_progress:
+            self.on_progress(self)
+
+    def write_chunk(self, chunk):
+        self._insert_chunk(chunk)
+
+    def prepare(self, frame, first_row):
+        """Converte e valida o bloco; retorna só as linhas válidas.
+
+        A coluna `_row` guarda o número da linha na planilha, para o relatório.
+        """
+        frame = frame.reset_index(drop=True)
+        data = pd.DataFrame(index=frame.index)
+        for field, columns in self.columns.items():
+            values = frame[columns[0]]
+            for column in columns[1:]:
+                values = values.where(values.notna(), frame[column])
+            data[field] = values
+        for field in COLUMN_MAPPING:
+            if field not in data:
+                data[field] = None
+
+        error = pd.Series(None, index=data.index, dtype=object)
+
+        def fail(mask, message):
+            nonlocal error
+            error = error.where(error.notna() | ~mask, message)
+
+        for field in TEXT_FIELDS:
+            data[field] = _as_text(data[field])
+        for field in REQUIRED_FIELDS:
+            fail(data[field].isna(), f'Missing required field: {field}')
+
+        max_year = datetime.now().year + 1
+        for field in YEAR_FIELDS:
+            raw = data[field]
+            number = _as_number(raw)
+            fail(raw.notna() & number.isna(), f'Invalid {field}: not a number')
+            fail(number.notna() & ((number < 1900) | (number > max_year) | (number % 1 != 0)),
+                 f'Invalid {field}: must be between 1900 and {max_year}')
+            data[field] = number
+
+        raw = data['quilometragem']
+        number = _as_number(raw)
+        fail(raw.notna() & number.isna(), 'Invalid quilometragem: not a number')
+        fail(number < 0, 'Quilometragem cannot be negative')
+        data['quilometragem'] = number.fillna(0)
+
+        for field in PRICE_FIELDS:
+            raw = data[field]
+            number = _as_number(raw)
+            fail(raw.notna() & number.isna(), f'Invalid {field}: not a number')
+            fail(number < 0, f'{field} cannot be negative')
+            data[field] = number.astype(float)
+
+        fail(data['estado'].notna() & ~data['estado'].isin(ESTADOS), 'Estado must be either "Novo" or "Usado"')
+        fail(data['cambio'].notna() & ~data['cambio'].isin(CAMBIOS), 'Câmbio must be either "Manual" or "Automático"')
+        fail(data['combustivel'].notna() & ~data['combustivel'].isin(COMBUSTIVEIS), 'Invalid combustível value')
+        for field in TEXT_FIELDS:
+            if field in MAX_LENGTHS:
+                fail(data[field].str.len() > MAX_LENGTHS[field],
+                     f'{field} is longer than {MAX_LENGTHS[field]} characters')
+
+        rows = np.arange(first_row, first_row + len(data))
+        invalid = error.notna().to_numpy()
+        self._add_errors((f'Error in row {row}: {message}' for row, message in zip(rows[invalid], error[invalid])),
+                         int(invalid.sum()))
+
+        data = data[~invalid].copy()
+        data['_row'] = rows[~invalid]
+        for field in YEAR_FIELDS + ['quilometragem']:
+            data[field] = data[field].astype('Int64')
+        for field, search_field in SEARCH_FIELDS.items():
+            data[search_field] = _unique_map(data[field], normalize_search_text)
+        now = datetime.utcnow()
+        data['dealership_id'] = self.dealership_id
+        data['destaque'] = False
+        data['vendido'] = False
+        data['data_cadastro'] = now
+        data['data_atualizacao'] = now
+        return data
+
+    def _insert_chunk(self, chunk):
+        if chunk.empty:
+            return
+        records = chunk.drop(columns='_row')
+        with self._chunk_errors(chunk['_row']):
+            if self._use_copy():
+                copy_records(records)
+            else:
+                db.session.execute(insert(Vehicle), to_records(records))
+            db.session.commit()
+            self.inserted += len(records)
+
+    @contextmanager
+    def _chunk_errors(self, rows):
+        """Desfaz o bloco que falhar no banco e registra o intervalo de linhas."""
+        try:
+            yield
+        except Exception as e:
+            db.session.rollback()
+            logger.warning('Vehicle import chunk failed (rows %s-%s): %s', rows.min(), rows.max(), e)
+            self._add_errors([f'Error in rows {rows.min()}-{rows.max()}: {str(e).splitlines()[0]}'], len(rows))
+
+    def _add_errors(self, messages, count):
+        self.error_rows += count
+        room = IMPORT_MAX_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend(islice(messages, room))
+
+    def _use_copy(self):
+        if IMPORT_USE_COPY == 'false':
+            return False
+        return db.session.get_bind().dialect.name == 'postgresql'
+
+
+SYNC_IDENTITY_FIELDS = ['marca', 'modelo', 'versao', 'ano_fabricacao', 'ano_modelo', 'final_placa']
+SYNC_CONTENT_FIELDS = list(COLUMN_MAPPING)
+
+
+def _canonical(frame, fields):
+    """Campos como texto, no mesmo formato para a planilha e para o banco."""
+    canonical = pd.DataFrame(index=frame.index)
+    for field in fields:
+        values = frame[field]
+        if field in PRICE_FIELDS:
+            values = pd.to_numeric(values, errors='coerce').astype('Float64').round(2).astype('string')
+        elif field in YEAR_FIELDS or field == 'quilometragem':
+            values = pd.to_numeric(values, errors='coerce').astype('Int64').astype('string')
+        else:
+            values = values.astype('string').str.strip()
+        canonical[field] = values.fillna('')
+    return canonical
+
+
+def identity_hashes(frame, fields=SYNC_IDENTITY_FIELDS):
+    """'h:<hash de marca/modelo/versão/anos/placa>' de cada linha (só os `fields`)."""
+    identity = _canonical(frame, fields)
+    for field in ('marca', 'modelo', 'versao'):
+        if field in identity:
+            identity[field] = _unique_map(identity[field], normalize_search_text)
+    hashes = pd.util.hash_pandas_object(identity, index=False).map('{:016x}'.format)
+    return 'h:' + hashes.astype('string')
+
+
+def sync_keys(frame, fields=SYNC_IDENTITY_FIELDS, use_sku=True):
+    """Identidade do veículo: 'sku:<SKU>' ou, sem SKU, o hash de identity_hashes."""
+    keys = identity_hashes(frame, fields)
+    if use_sku:
+        sku = frame['sku'].astype('string').str.strip()
+        has_sku = (sku.notna() & (sku != '')).to_numpy()
+        keys[has_sku] = 'sku:' + sku[has_sku]
+    return keys
+
+
+def content_hashes(frame, fields=SYNC_CONTENT_FIELDS):
+    """Hash dos campos importados, para saber se o veículo mudou."""
+    return pd.util.hash_pandas_object(_canonical(frame, fields), index=False)
+
+
+class VehicleSync(VehicleImport):
+    """Sincroniza o estoque da concessionária com uma planilha completa.
+
+    Linhas novas são inseridas, as que mudaram são atualizadas em lote
+    (reativando veículos vendidos que voltaram à planilha) e os veículos à
+    venda que não aparecem na planilha são marcados como vendidos. Só as
+    colunas que a planilha traz são comparadas e gravadas: as demais ficam
+    como estão no banco.
+
+    Nada é marcado como vendido se alguma linha tiver erro (a linha com erro
+    pode ser de um veículo ainda à venda), se a planilha não tiver linhas ou
+    se faltar uma coluna obrigatória (marca/modelo). Uma linha com SKU que
+    não casa com nenhum SKU cadastrado ainda pode casar, pelo hash, com um
+    veículo sem SKU: é assim que uma planilha passa a trazer a coluna SKU sem
+    recriar o estoque.
+    """
+
+    def __init__(self, dealership_id, chunk_size=None, on_progress=None):
+        super().__init__(dealership_id, chunk_size=chunk_size, on_progress=on_progress)
+        self.updated = 0
+        self.unchanged = 0
+        self.marked_sold = 0
+        self.sold_marking_skipped = False
+        self.existing = None
+        self.seen = set()
+
+    @property
+    def synced_fields(self):
+        """Campos que a planilha trouxe, na ordem de COLUMN_MAPPING."""
+        return [field for field in SYNC_CONTENT_FIELDS if field in (self.columns or {})]
+
+    def _keys(self, frame):
+        """(identidade, hash de identidade) de cada linha, só com as colunas da planilha."""
+        fields = self.synced_fields
+        identity = [field for field in SYNC_IDENTITY_FIELDS if field in fields]
+        return sync_keys(frame, identity, use_sku='sku' in fields), identity_hashes(frame, identity)
+
+    def load_existing(self):
+        """Identidade -> [(id, hash do conteúdo, vendido)], à venda primeiro."""
+        fields = self.synced_fields
+        columns = [Vehicle.id, Vehicle.vendido] + [getattr(Vehicle, field) for field in fields]
+        rows = db.session.execute(
+            select(*columns).where(Vehicle.dealership_id == self.dealership_id)
+            .order_by(Vehicle.vendido, Vehicle.id)
+        ).all()
+        frame = pd.DataFrame(rows, columns=['id', 'vendido'] + fields)
+        existing = {}
+        if not frame.empty:
+            keys, _ = self._keys(frame)
+            for key, vehicle_id, content, vendido in zip(keys, frame['id'], content_hashes(frame, fields),
+                                                         frame['vendido']):
+                existing.setdefault(key, []).append((int(vehicle_id), int(content), bool(vendido)))
+        return existing
+
+    def write_chunk(self, chunk):
+        if self.existing is None:
+            self.existing = self.load_existing()
+        keys, hashes = self._keys(chunk)
+        matched_ids = []
+        for key, fallback, content in zip(keys, hashes, content_hashes(chunk, self.synced_fields)):
+            # SKU novo: pode ser um veículo cadastrado antes sem SKU
+            candidates = self.existing.get(key) or self.existing.get(fallback)
+            if not candidates:
+                matched_ids.append(None)
+                continue
+            vehicle_id, current_content, vendido = candidates.pop(0)
+            self.seen.add(vehicle_id)
+            if int(content) == current_content and not vendido:
+                self.unchanged += 1
+                matched_ids.append(0)
+            else:
+                matched_ids.append(vehicle_id)
+        matched = pd.Series(matched_ids, index=chunk.index, dtype=object)
+        self._insert_chunk(chunk[matched.isna()])
+        self._update_chunk(chunk[matched.notna() & (matched != 0)], matched)
+
+    def _update_chunk(self, chunk, matched):
+        if chunk.empty:
+            return
+        fields = self.synced_fields
+        records = chunk[fields + [SEARCH_FIELDS[field] for field in SEARCH_FIELDS if field in fields]
+                        + ['data_atualizacao']].copy()
+        records['id'] = matched[chunk.index].astype(int)
+        records['vendido'] = False
+        records['data_venda'] = None
+        with self._chunk_errors(chunk['_row']):
+            db.session.execute(update(Vehicle), to_records(records))
+            db.session.commit()
+            self.updated += len(records)
+
+    def finish(self):
+        if not self.rows or any(field not in (self.columns or {}) for field in REQUIRED_FIELDS):
+            self.sold_marking_skipped = True
+            logger.warning('Vehicle sync for dealership %s: no rows or missing required columns, '
+                           'nothing marked as sold', self.dealership_id)
+            return
+        if self.existing is None:
+            self.existing = self.load_existing()
+        missing = [vehicle_id for candidates in self.existing.values()
+                   for vehicle_id, _, vendido in candidates if not vendido and vehicle_id not in self.seen]
+        if not missing:
+            return
+        if self.error_rows:
+            self.sold_marking_skipped = True
+            logger.warning('Vehicle sync for dealership %s: %s vehicles not marked as sold because of row errors',
+                           self.dealership_id, len(missing))
+            return
+        now = datetime.utcnow()
+        for start in range(0, len(missing), self.chunk_size):
+            ids = missing[start:start + self.chunk_size]
+            db.session.execute(update(Vehicle).where(Vehicle.id.in_(ids))
+                               .values(vendido=True, data_venda=now, data_atualizacao=now))
+            db.session.commit()
+            self.marked_sold += len(ids)
+
+    def summary(self):
+        summary = super().summary()
+        summary.update({
+            'mode': 'sync',
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'marked_sold': self.marked_sold,
+            'sold_marking_skipped': self.sold_marking_skipped,
+        })
+        return summary
+
+
+def to_records(frame):
+    """Linhas do DataFrame como dicts, com nulos do pandas trocados por None."""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict('records')
+
+
+def copy_records(frame):
+    """Grava o DataFrame com COPY ... FROM STDIN (PostgreSQL/psycopg2)."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL,
+                 date_format='%Y-%m-%d %H:%M:%S.%f')
+    buffer.seek(0)
+    columns = ', '.join(frame.columns)
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {Vehicle.__tablename__} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def iter_vehicle_frames(file, chunk_size=None):
+    """Lê o upload (CSV/XLSX) em DataFrames de até `chunk_size` linhas.
+
+    CSV vai em blocos do pandas, como texto; XLSX pelo iterador de linhas do
+    openpyxl em modo read-only. A conversão de tipos é do importador.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    if file.filename.endswith('.csv'):
+        yield from pd.read_csv(file.stream, dtype=str, chunksize=chunk_size)
+        return
+
+    workbook = load_workbook(file.stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next((row for row in rows if any(value is not None for value in row)), None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f'_col{i}' for i, name in enumerate(header)]
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            # linhas totalmente vazias são ignoradas, como no read_csv
+            width = len(columns)
+            batch = [tuple(row[:width]) + (None,) * (width - len(row))
+                     for row in batch if any(value is not None for value in row)]
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+IMPORT_MODES = {'append': VehicleImport, 'sync': VehicleSync}
+
+
+def import_vehicles(dealership_id, frames, chunk_size=None, mode='append', on_progress=None):
+    """Importa um ou mais DataFrames para a concessionária e retorna o resumo.
+
+    mode='append' só insere; mode='sync' trata a planilha como o estoque completo.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    return IMPORT_MODES[mode](dealership_id, chunk_size=chunk_size, on_progress=on_progress).run(frames)
@@ -0,0 +1,60 @@
+"""Cache das respostas de GET /vehicles/ por concessionária e filtros.
+
+As mesmas combinações de filtros (marca, max_price, cambio, destaque...) se
+repetem o dia todo. A página já serializada (corpo JSON e cabeçalhos do
+cursor) fica no cache `vehicle_lists`, LRU limitado a VEHICLE_LIST_CACHE_SIZE
+entradas, na memória do processo ou no backend de VEHICLE_LIST_CACHE_BACKEND
+(padrão: o de CACHE_BACKEND; redis compartilha entre processos).
+
+A chave leva a versão da listagem (listing_version em
+services/inventory_version.py), a mesma da ETag: com `destaque`, ela muda
+quando um destaque vence.
+As escritas que mudam o estoque (cadastro, edição e venda de veículos,
+importação de planilhas) trocam a versão, então as entradas antigas deixam
+de ser lidas na hora e saem pelo LRU/TTL. A exportação em streaming
+(`format=`) não passa pelo cache.
+"""
+import hashlib
+import json
+import os
+
+from flask import Response
+
+from src import metrics
+from src.cache import create_cache
+
+VEHICLE_LIST_CACHE_ENABLED = os.getenv('VEHICLE_LIST_CACHE_ENABLED', 'true').lower() == 'true'
+
+list_cache = create_cache(
+    'vehicle_lists',
+    maxsize=int(os.getenv('VEHICLE_LIST_CACHE_SIZE', '5000')),
+    ttl=int(os.getenv('VEHICLE_LIST_CACHE_TTL', '600')),
+    backend=os.getenv('VEHICLE_LIST_CACHE_BACKEND') or None
+)
+
+# Cabeçalhos da resposta guardados junto com o corpo
+CACHED_HEADERS = ('X-Next-Cursor', 'Link')
+
+
+def list_cache_key(dealership_id, version, filters):
+    """Chave de (concessionária, versão do estoque, filtros normalizados)."""
+    normalized = json.dumps(sorted((name, value) for name, value in filters.items() if value is not None))
+    return f"{dealership_id}:{hashlib.sha1(f'{version}|{normalized}'.encode('utf-8')).hexdigest()}"
+
+
+def cached_list_response(key, build_response):
+    """Resposta guardada em `key` ou a de `build_response()` (guardada se 200)."""
+    if not VEHICLE_LIST_CACHE_ENABLED:
+        return build_response()
+    cached = list_cache.get(key)
+    if cached is not None:
+        metrics.increment('http.vehicle_list_cache.hits')
+        return Response(cached['body'], headers=cached['headers'], mimetype='application/json')
+    metrics.increment('http.vehicle_list_cache.misses')
+    response = build_response()
+    if response.status_code == 200:
+        list_cache.set(key, {
+            'body': response.get_data(as_text=True),
+            'headers': {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+        })
+    return response
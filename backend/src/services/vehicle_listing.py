@@ -0,0 +1,133 @@
+"""Listagens de veículos da API: páginas por cursor, seleção de campos e exportação em streaming.
+
+- Páginas: ordem por id, `limit` (padrão VEHICLE_LIST_PAGE_SIZE, no máximo
+  VEHICLE_LIST_MAX_PAGE_SIZE) e `cursor` opaco com o último id entregue; a
+  consulta é `id > último` no índice da PK, sem OFFSET.
+- `fields=id,marca,preco`: só essas colunas saem do banco (linhas do Core,
+  não objetos do ORM), serializadas por src/serializers.py.
+- `format=ndjson` ou `format=json`: o resultado inteiro, lido do banco em
+  blocos de VEHICLE_STREAM_BATCH_SIZE por um cursor do lado do servidor
+  (stream_results) e escrito na resposta à medida que chega, com memória
+  constante no worker.
+"""
+import base64
+import binascii
+import json
+import os
+from urllib.parse import urlencode
+
+from flask import Response, stream_with_context
+
+from src.models import Vehicle
+from src.serializers import columns_serializer, dumps
+
+LIST_PAGE_SIZE = int(os.getenv('VEHICLE_LIST_PAGE_SIZE', '100'))
+LIST_MAX_PAGE_SIZE = int(os.getenv('VEHICLE_LIST_MAX_PAGE_SIZE', '1000'))
+STREAM_BATCH_SIZE = int(os.getenv('VEHICLE_STREAM_BATCH_SIZE', '1000'))
+
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+
+class ListingError(ValueError):
+    """Parâmetro de listagem inválido (vira 400 na rota)."""
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({'id': last_id}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Último id entregue, a partir do cursor recebido (None sem cursor)."""
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return int(data['id'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ListingError('invalid cursor')
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return LIST_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ListingError('limit must be an integer')
+    if limit < 1:
+        raise ListingError('limit must be positive')
+    return min(limit, LIST_MAX_PAGE_SIZE)
+
+
+def parse_fields(value, allowed):
+    """Campos pedidos em `fields` (na ordem de `allowed`); todos sem o parâmetro."""
+    if not value:
+        return list(allowed)
+    wanted = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = wanted - set(allowed)
+    if unknown:
+        raise ListingError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in allowed if field in wanted]
+
+
+def parse_format(value):
+    if value and value not in STREAM_FORMATS:
+        raise ListingError(f"format must be one of: {', '.join(STREAM_FORMATS)}")
+    return value or None
+
+
+def select_columns(query, fields):
+    """`query` devolvendo só as colunas de `fields`, nessa ordem (mais o id no fim,
+    chave do cursor)."""
+    columns = [getattr(Vehicle, field) for field in fields]
+    if 'id' not in fields:
+        columns.append(Vehicle.id)
+    return query.with_entities(*columns).order_by(Vehicle.id)
+
+
+def fetch_page(query, fields, limit, after=None):
+    """(linhas da página como dicts, cursor da próxima página ou None)."""
+    query = select_columns(query, fields)
+    if after is not None:
+        query = query.filter(Vehicle.id > after)
+    rows = query.limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
+    return columns_serializer(Vehicle, tuple(fields), positional=True).many(rows[:limit]), next_cursor
+
+
+def iter_rows(query, fields, after=None):
+    """Linhas de `query` como dicts, lidas em blocos por um cursor do servidor."""
+    serialize = columns_serializer(Vehicle, tuple(fields), positional=True)
+    query = select_columns(query, fields)
+    if after is not None:
+        query = query.filter(Vehicle.id > after)
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield serialize(row)
+
+
+def _encode_stream(rows, fmt):
+    if fmt == 'ndjson':
+        for row in rows:
+            yield dumps(row) + b'\n'
+        return
+    yield b'['
+    separator = b''
+    for row in rows:
+        yield separator + dumps(row)
+        separator = b','
+    yield b']'
+
+
+def stream_response(query, fields, fmt, after=None):
+    """Resposta em streaming (NDJSON ou array JSON) com todas as linhas de `query`."""
+    return Response(stream_with_context(_encode_stream(iter_rows(query, fields, after), fmt)),
+                    mimetype=STREAM_FORMATS[fmt])
+
+
+def next_page_headers(next_cursor, path, args):
+    """Cabeçalhos X-Next-Cursor/Link da próxima página (vazios na última)."""
+    if not next_cursor:
+        return {}
+    params = [(key, value) for key, value in args.items(multi=True) if key != 'cursor']
+    params.append(('cursor', next_cursor))
+    return {'X-Next-Cursor': next_cursor, 'Link': f'<{path}?{urlencode(params)}>; rel="next"'}
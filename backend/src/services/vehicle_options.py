@@ -0,0 +1,58 @@
+"""Tabelas vehicle_options / vehicle_photos: sincronização em lote e filtro.
+
+Nas escritas pelo ORM os validators de Vehicle mantêm as tabelas. A
+importação de planilhas grava direto (executemany/COPY), sem passar pelos
+validators; depois dela sync_vehicle_children refaz as linhas dos veículos
+gravados, a partir de itens_opcionais/link_fotos.
+"""
+from sqlalchemy import delete, distinct, func, insert, select
+
+from src.database import db
+from src.models import Vehicle, VehicleOption, VehiclePhoto
+from src.vehicle_attributes import canonical_option, split_options, split_photos
+
+SYNC_BATCH_SIZE = 2000
+
+
+def sync_vehicle_children(vehicle_ids):
+    """Refaz opcionais e fotos dos veículos de `vehicle_ids` (em blocos)."""
+    vehicle_ids = list(vehicle_ids)
+    for start in range(0, len(vehicle_ids), SYNC_BATCH_SIZE):
+        batch = vehicle_ids[start:start + SYNC_BATCH_SIZE]
+        rows = db.session.execute(
+            select(Vehicle.id, Vehicle.itens_opcionais, Vehicle.link_fotos).where(Vehicle.id.in_(batch))
+        ).all()
+        db.session.execute(delete(VehicleOption).where(VehicleOption.vehicle_id.in_(batch)))
+        db.session.execute(delete(VehiclePhoto).where(VehiclePhoto.vehicle_id.in_(batch)))
+        options = [{'vehicle_id': row.id, 'option': option, 'label': label}
+                   for row in rows for option, label in split_options(row.itens_opcionais)]
+        photos = [{'vehicle_id': row.id, 'position': position, 'url': url}
+                  for row in rows for position, url in enumerate(split_photos(row.link_fotos))]
+        if options:
+            db.session.execute(insert(VehicleOption), options)
+        if photos:
+            db.session.execute(insert(VehiclePhoto), photos)
+        db.session.commit()
+
+
+def sync_changed_vehicles(dealership_id, since):
+    """Sincroniza os veículos da concessionária gravados a partir de `since`."""
+    ids = db.session.execute(
+        select(Vehicle.id).where(Vehicle.dealership_id == dealership_id, Vehicle.data_atualizacao >= since)
+    ).scalars().all()
+    sync_vehicle_children(ids)
+    return len(ids)
+
+
+def filter_by_options(query, options):
+    """Restringe `query` aos veículos com todos os opcionais pedidos.
+
+    Usa o índice (option, vehicle_id): os ids saem só do índice e entram na
+    consulta principal como `vehicles.id IN (...)`.
+    """
+    keys = {canonical_option(option)[0] for option in options if option and option.strip()}
+    if not keys:
+        return query
+    with_all = select(VehicleOption.vehicle_id).where(VehicleOption.option.in_(keys)) \
+        .group_by(VehicleOption.vehicle_id).having(func.count(distinct(VehicleOption.option)) == len(keys))
+    return query.filter(Vehicle.id.in_(with_all))
@@ -0,0 +1,149 @@
+"""Ranking dos veículos encontrados pela busca da conversa.
+
+A busca (índice em memória ou banco) só decide quais veículos atendem aos
+filtros; a ordem vem daqui. A pontuação é calculada de uma vez, com NumPy,
+sobre todos os candidatos:
+
+- proximidade do preço alvo (preco_min/preco_max), usando o preço promocional
+  quando houver;
+- proximidade do ano alvo (ano_min/ano_max);
+- fração dos opcionais pedidos que o veículo tem, comparando as chaves
+  canônicas (vehicle_attributes.canonical_option: sem acento, com os
+  apelidos "a/c", "abs"...) inteiras, não trechos do texto;
+- destaque ativo (destaque, com destaque_ate ainda no futuro ou vazio);
+- preço promocional menor que o preço cheio;
+- semelhança com a descrição do cliente ("econômico pra família"), quando a
+  busca semântica (vector_index.semantic_scores) devolve notas.
+
+A chave de ordenação (-pontuação, preço efetivo, id) também é o cursor da
+paginação: a próxima página são os candidatos com chave maior que a do último
+veículo mostrado.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.vehicle_attributes import canonical_option, split_options
+
+RANKING_COLUMNS = ['id', 'preco', 'preco_promocional', 'ano_modelo', 'destaque', 'destaque_ate',
+                   'itens_opcionais']
+
+WEIGHTS = {
+    'preco': 3.0,
+    'ano': 2.0,
+    'opcionais': 2.0,
+    'destaque': 1.5,
+    'promocao': 1.0,
+    'semantica': 4.0,
+}
+# Distância (relativa ao preço alvo / em anos) a partir da qual a proximidade vale zero
+PRICE_TOLERANCE = 0.5
+YEAR_TOLERANCE = 10
+# Veículos sem preço vão para o fim entre os de mesma pontuação
+PRICE_SORT_NULL = 1e12
+
+
+def ranking_frame(vehicles, option_keys=None):
+    """DataFrame com as colunas do ranking, a partir de objetos Vehicle (ou
+    snapshots) ou de tuplas na ordem de RANKING_COLUMNS.
+
+    `option_keys` ({id: chaves canônicas}, ex.: lidas de vehicle_options)
+    substitui a leitura de itens_opcionais."""
+    rows = [vehicle if isinstance(vehicle, tuple) else tuple(getattr(vehicle, name) for name in RANKING_COLUMNS)
+            for vehicle in vehicles]
+    frame = pd.DataFrame.from_records(rows, columns=RANKING_COLUMNS)
+    frame['id'] = frame['id'].astype('int64')
+    for field in ('preco', 'preco_promocional', 'ano_modelo'):
+        frame[field] = pd.to_numeric(frame[field], errors='coerce').astype(float)
+    frame['destaque'] = frame['destaque'].fillna(False).astype(bool)
+    frame['destaque_ate'] = pd.to_datetime(frame['destaque_ate'])
+    itens = frame.pop('itens_opcionais')
+    if option_keys is None:
+        frame['opcionais'] = [frozenset(key for key, _ in split_options(text)) for text in itens]
+    else:
+        frame['opcionais'] = [frozenset(option_keys.get(vehicle_id, ())) for vehicle_id in frame['id'].tolist()]
+    return frame
+
+
+def _targets(params):
+    preco_min, preco_max = params.get('preco_min'), params.get('preco_max')
+    if preco_min and preco_max:
+        price = (float(preco_min) + float(preco_max)) / 2
+    else:
+        price = float(preco_max or preco_min or 0) or None
+    ano_min, ano_max = params.get('ano_min'), params.get('ano_max')
+    if ano_max:
+        year = float(ano_max)
+    elif ano_min:
+        year = float(datetime.now().year + 1)  # "de 2020 pra cima": quanto mais novo, melhor
+    else:
+        year = None
+    return price, year
+
+
+def effective_prices(frame):
+    """Preço promocional quando menor que o cheio; senão o preço cheio."""
+    preco = frame['preco'].to_numpy()
+    promocional = frame['preco_promocional'].to_numpy()
+    promocao = (promocional > 0) & (np.isnan(preco) | (promocional < preco))
+    return np.where(promocao, promocional, preco), promocao
+
+
+def score_frame(frame, params, now=None, semantic=None, option_ids=None):
+    """Pontuação de cada linha de `frame` para os parâmetros da busca.
+
+    `semantic` é um dict {id: nota de 0 a 1}; ids fora dele valem zero.
+    `option_ids` ({chave canônica: array ordenado dos ids que a têm}, ex.: do
+    índice em memória) conta os opcionais sem percorrer os de cada veículo.
+    """
+    now = now or datetime.utcnow()
+    preco, promocao = effective_prices(frame)
+    price_target, year_target = _targets(params)
+    score = np.zeros(len(frame))
+    if price_target:
+        distance = np.abs(preco - price_target) / (price_target * PRICE_TOLERANCE)
+        score += WEIGHTS['preco'] * np.nan_to_num(1 - np.minimum(distance, 1))
+    if year_target:
+        distance = np.abs(frame['ano_modelo'].to_numpy() - year_target) / YEAR_TOLERANCE
+        score += WEIGHTS['ano'] * np.nan_to_num(1 - np.minimum(distance, 1))
+    opcionais = {canonical_option(item)[0] for item in params.get('opcionais') or [] if item and item.strip()}
+    if opcionais and option_ids is not None:
+        ids = frame['id'].to_numpy()
+        matched = np.zeros(len(frame))
+        for key in opcionais:
+            if key in option_ids:
+                matched += np.isin(ids, option_ids[key], assume_unique=True)
+        score += WEIGHTS['opcionais'] * matched / len(opcionais)
+    elif opcionais:
+        keys = frame['opcionais'].tolist()
+        matched = np.fromiter((len(opcionais & vehicle_keys) for vehicle_keys in keys), dtype=float, count=len(keys))
+        score += WEIGHTS['opcionais'] * matched / len(opcionais)
+    ate = frame['destaque_ate']
+    destaque = frame['destaque'].to_numpy() & (ate.isna() | (ate >= now)).to_numpy()
+    score += WEIGHTS['destaque'] * destaque
+    score += WEIGHTS['promocao'] * promocao
+    if semantic:
+        ids = frame['id'].to_numpy()
+        score += WEIGHTS['semantica'] * np.fromiter((semantic.get(i, 0.0) for i in ids.tolist()),
+                                                    dtype=float, count=len(ids))
+    return score
+
+
+def rank(frame, params, limit, after=None, now=None, semantic=None, option_ids=None):
+    """Até `limit` (id, chave) na ordem do ranking, depois do cursor `after`.
+
+    A chave é [-pontuação, preço efetivo, id]; ela é o cursor da próxima página.
+    """
+    if frame.empty:
+        return []
+    key = -np.round(score_frame(frame, params, now=now, semantic=semantic, option_ids=option_ids), 9)
+    preco = np.nan_to_num(effective_prices(frame)[0], nan=PRICE_SORT_NULL)
+    ids = frame['id'].to_numpy()
+    if after is not None:
+        after_score, after_price, after_id = after
+        keep = (key > after_score) | ((key == after_score) & (
+            (preco > after_price) | ((preco == after_price) & (ids > after_id))))
+        key, preco, ids = key[keep], preco[keep], ids[keep]
+    order = np.lexsort((ids, preco, key))[:limit]
+    return [(int(ids[i]), [float(key[i]), float(preco[i]), int(ids[i])]) for i in order]
@@ -0,0 +1,134 @@
+"""Despacho das mensagens de um payload do webhook do WhatsApp.
+
+A Meta agrupa várias entries, changes e mensagens em um único POST. Este
+módulo percorre o lote inteiro, descarta mensagens repetidas (pelo id do
+WhatsApp) e processa as conversas em paralelo.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from src.cache import create_cache
+
+logger = logging.getLogger("webhook_dispatcher")
+
+
+def iter_webhook_messages(data):
+    """Percorre todas as entries/changes/messages do payload.
+
+    Gera tuplas (metadata, message), onde metadata é o bloco `value.metadata`
+    (phone_number_id/display_phone_number do número que recebeu a mensagem).
+    """
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            metadata = value.get('metadata') or {}
+            for message in value.get('messages') or []:
+                yield metadata, message
+
+
+class MessageDeduplicator:
+    """Conjunto com TTL dos ids de mensagens já despachadas.
+
+    Cobre os reenvios da Meta e as retentativas da fila: uma mensagem só é
+    liberada de novo se o processamento dela falhar. Os ids ficam no cache de
+    WEBHOOK_DEDUP_BACKEND (padrão: o de CACHE_BACKEND); com redis o conjunto é
+    compartilhado por todos os processos (workers do gunicorn, `flask
+    webhook-worker`), com memory cada processo tem o seu.
+    """
+
+    def __init__(self, maxsize=50000, ttl=3600, backend=None):
+        self._seen = create_cache('webhook_dedup', maxsize=maxsize, ttl=ttl, backend=backend)
+
+    def claim(self, message_id):
+        """Marca a mensagem como em processamento. Retorna False se já foi vista."""
+        if not message_id:
+            return True
+        return self._seen.add(message_id, True)
+
+    def release(self, message_id):
+        if not message_id:
+            return
+        self._seen.delete(message_id)
+
+
+deduplicator = MessageDeduplicator(
+    maxsize=int(os.getenv('WEBHOOK_DEDUP_SIZE', '50000')),
+    ttl=int(os.getenv('WEBHOOK_DEDUP_TTL', '3600')),
+    backend=os.getenv('WEBHOOK_DEDUP_BACKEND') or None
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook-dispatch')
+    return _executor
+
+
+def group_messages_by_sender(data):
+    """Agrupa as mensagens novas do lote por remetente, preservando a ordem.
+
+    Retorna um OrderedDict {remetente: [(metadata, message), ...]}.
+    """
+    batch_ids = set()
+    groups = OrderedDict()
+    for metadata, message in iter_webhook_messages(data):
+        message_id = message.get('id')
+        if message_id:
+            if message_id in batch_ids:
+                continue
+            batch_ids.add(message_id)
+        if not deduplicator.claim(message_id):
+            logger.info(f"Mensagem {message_id} duplicada, ignorando")
+            continue
+        groups.setdefault(message.get('from'), []).append((metadata, message))
+    return groups
+
+
+def dispatch_webhook_messages(data, handler):
+    """Processa todas as mensagens do payload com `handler(message, metadata)`.
+
+    Conversas diferentes rodam em paralelo; mensagens do mesmo remetente são
+    tratadas em sequência para manter a ordem da conversa. Retorna o número de
+    mensagens processadas. Se alguma falhar, levanta RuntimeError depois que o
+    lote inteiro terminar (as que deram certo não são repetidas na retentativa).
+    """
+    groups = group_messages_by_sender(data)
+    if not groups:
+        return 0
+
+    app = current_app._get_current_object()
+
+    def run_group(items):
+        failures = []
+        with app.app_context():
+            for metadata, message in items:
+                try:
+                    handler(message, metadata)
+                except Exception as e:
+                    deduplicator.release(message.get('id'))
+                    logger.error(f"Erro ao processar mensagem {message.get('id')}: {str(e)}")
+                    failures.append(e)
+        return len(items), failures
+
+    max_workers = int(app.config.get('WEBHOOK_DISPATCH_WORKERS') or os.getenv('WEBHOOK_DISPATCH_WORKERS', '8'))
+    if len(groups) == 1 or max_workers <= 1:
+        results = [run_group(items) for items in groups.values()]
+    else:
+        futures = [_get_executor(max_workers).submit(run_group, items) for items in groups.values()]
+        results = [future.result() for future in futures]
+
+    failures = [e for _, group_failures in results for e in group_failures]
+    if failures:
+        raise RuntimeError(f"{len(failures)} mensagem(ns) falharam: {failures[0]}")
+    return sum(count for count, _ in results)
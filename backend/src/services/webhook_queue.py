@@ -0,0 +1,275 @@
+"""Fila de ingestão do webhook do WhatsApp.
+
+O endpoint do webhook apenas grava o payload bruto na fila e responde 200.
+Um pool de workers consome a fila e executa a IA e os envios, de modo que a
+latência de confirmação para a Meta não depende do Gemini nem da Graph API.
+"""
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from src.database import db
+from src.models import WebhookJob
+
+logger = logging.getLogger("webhook_queue")
+if not logger.hasHandlers():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+    logger.addHandler(handler)
+logger.setLevel(logging.INFO)
+
+
+class DatabaseQueue:
+    """Fila durável na tabela webhook_jobs. Sobrevive a restarts e pode ser
+    consumida por vários processos (SKIP LOCKED no PostgreSQL)."""
+
+    def __init__(self, max_attempts=5, visibility_timeout=300, retry_delay=5):
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+
+    def put(self, payload):
+        job = WebhookJob(payload=json.dumps(payload, ensure_ascii=False))
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+    def claim(self):
+        """Reserva o próximo job disponível. Retorna (job_id, payload) ou None."""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.visibility_timeout)
+        query = WebhookJob.query.filter(
+            db.or_(
+                db.and_(WebhookJob.status == 'pending', WebhookJob.available_at <= now),
+                # Jobs presos em 'processing' (worker morreu) voltam para a fila
+                db.and_(WebhookJob.status == 'processing', WebhookJob.locked_at < stale)
+            )
+        ).order_by(WebhookJob.id)
+        if db.engine.dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        job = query.first()
+        if not job:
+            db.session.commit()
+            return None
+        # Lock otimista em attempts: se outro worker pegou o job antes, rowcount == 0
+        claimed = WebhookJob.query.filter(
+            WebhookJob.id == job.id,
+            WebhookJob.attempts == job.attempts
+        ).update({
+            'status': 'processing',
+            'locked_at': now,
+            'attempts': job.attempts + 1
+        }, synchronize_session=False)
+        payload = job.payload
+        db.session.commit()
+        if not claimed:
+            return None
+        return job.id, json.loads(payload)
+
+    def ack(self, job_id):
+        WebhookJob.query.filter_by(id=job_id).update({
+            'status': 'done',
+            'processed_at': datetime.utcnow(),
+            'last_error': None
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def fail(self, job_id, error):
+        job = db.session.get(WebhookJob, job_id)
+        if not job:
+            return
+        job.last_error = error
+        if job.attempts >= self.max_attempts:
+            job.status = 'failed'
+            job.processed_at = datetime.utcnow()
+        else:
+            job.status = 'pending'
+            job.available_at = datetime.utcnow() + timedelta(seconds=self.retry_delay * job.attempts)
+        db.session.commit()
+
+    def pending_count(self):
+        return WebhookJob.query.filter(WebhookJob.status.in_(['pending', 'processing'])).count()
+
+
+class LocalQueue:
+    """Fila em memória do próprio processo. Não é durável: jobs pendentes se
+    perdem em um restart. Útil em desenvolvimento ou com um único worker.
+
+    Como na DatabaseQueue, um job que falhou só volta para a fila depois de
+    retry_delay * tentativas segundos."""
+
+    def __init__(self, max_attempts=5, retry_delay=5):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._in_flight = {}
+        self._delayed = []  # heap de (disponível em, job_id, payload, tentativas)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def put(self, payload):
+        with self._lock:
+            self._next_id += 1
+            job_id = self._next_id
+        self._queue.put((job_id, payload, 0))
+        return job_id
+
+    def claim(self):
+        self._release_delayed()
+        try:
+            job_id, payload, attempts = self._queue.get_nowait()
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._in_flight[job_id] = (payload, attempts + 1)
+        return job_id, payload
+
+    def ack(self, job_id):
+        with self._lock:
+            self._in_flight.pop(job_id, None)
+
+    def fail(self, job_id, error):
+        with self._lock:
+            payload, attempts = self._in_flight.pop(job_id, (None, self.max_attempts))
+        if attempts < self.max_attempts:
+            with self._lock:
+                heapq.heappush(self._delayed, (time.monotonic() + self.retry_delay * attempts,
+                                               job_id, payload, attempts))
+        else:
+            logger.error(f"Job {job_id} descartado após {attempts} tentativas: {error}")
+
+    def _release_delayed(self):
+        """Devolve à fila os jobs cujo atraso da retentativa já passou."""
+        now = time.monotonic()
+        with self._lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, job_id, payload, attempts = heapq.heappop(self._delayed)
+                self._queue.put((job_id, payload, attempts))
+
+    def pending_count(self):
+        with self._lock:
+            return self._queue.qsize() + len(self._in_flight) + len(self._delayed)
+
+
+class WebhookQueue:
+    """Fila + pool de workers que drena a fila dentro de um app context."""
+
+    def __init__(self, app, backend, handler, num_workers=4, poll_interval=1.0):
+        self.app = app
+        self.backend = backend
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, payload):
+        job_id = self.backend.put(payload)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        """Sobe os workers na primeira chamada (lazy, para não criar threads em
+        comandos de CLI como `flask db upgrade`)."""
+        if self._threads or self.num_workers <= 0:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"{self.num_workers} workers do webhook iniciados ({type(self.backend).__name__})")
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self):
+        """Processa um job, se houver. Deve rodar dentro de um app context."""
+        claimed = self.backend.claim()
+        if not claimed:
+            return False
+        job_id, payload = claimed
+        try:
+            self.handler(payload)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao processar job {job_id} do webhook: {str(e)}")
+            self.backend.fail(job_id, str(e))
+        else:
+            self.backend.ack(job_id)
+        return True
+
+    def drain(self, max_jobs=None):
+        """Processa jobs de forma síncrona até esvaziar a fila."""
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            if not self.run_once():
+                break
+            processed += 1
+        return processed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    processed = self.run_once()
+            except Exception as e:
+                logger.error(f"Erro no worker do webhook: {str(e)}")
+                processed = False
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+def init_webhook_queue(app, handler):
+    """Configura a fila do webhook a partir das variáveis de ambiente."""
+    backend_name = app.config.setdefault('WEBHOOK_QUEUE_BACKEND', os.getenv('WEBHOOK_QUEUE_BACKEND', 'database'))
+    max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '5'))
+    retry_delay = float(os.getenv('WEBHOOK_RETRY_DELAY', '5'))
+    if backend_name == 'local':
+        backend = LocalQueue(max_attempts=max_attempts, retry_delay=retry_delay)
+    elif backend_name == 'database':
+        backend = DatabaseQueue(
+            max_attempts=max_attempts,
+            visibility_timeout=int(os.getenv('WEBHOOK_VISIBILITY_TIMEOUT', '300')),
+            retry_delay=retry_delay
+        )
+    else:
+        raise ValueError(f'Invalid WEBHOOK_QUEUE_BACKEND: {backend_name}')
+
+    webhook_queue = WebhookQueue(
+        app,
+        backend,
+        handler,
+        num_workers=int(app.config.setdefault('WEBHOOK_WORKERS', int(os.getenv('WEBHOOK_WORKERS', '4')))),
+        poll_interval=float(os.getenv('WEBHOOK_POLL_INTERVAL', '1.0'))
+    )
+    app.extensions['webhook_queue'] = webhook_queue
+
+    @app.cli.command('webhook-worker')
+    @click.option('--workers', default=None, type=int, help='Número de threads consumindo a fila')
+    def webhook_worker(workers):
+        """Roda um pool dedicado de workers consumindo a fila do webhook."""
+        if workers is not None:
+            webhook_queue.num_workers = workers
+        webhook_queue.start()
+        for thread in list(webhook_queue._threads):
+            thread.join()
+
+    return webhook_queue
@@ -1,170 +1,192 @@
 from flask import jsonify, current_app
-from src.integrations.whatsapp_api import send_whatsapp_message
-from src.ai_processor import process_message_with_ai
-from src.models import Dealership, Vehicle
+from src.integrations.whatsapp_api import send_whatsapp_message, send_whatsapp_batch
+from src.ai_processor import next_results_page, process_message_with_ai
+from src.services.webhook_dispatcher import dispatch_webhook_messages, iter_webhook_messages
+from src.models import Vehicle
+from src.services.dealership_router import resolve_dealership_id
+from src.services.conversation_session import get_session
+from src.services.vehicle_cards import get_vehicle_card
+from src.database import db
 from sqlalchemy import or_, and_
+from src.text_utils import normalize_search_text
 
 def handle_whatsapp_webhook(request):
+    """Recebe o POST da Meta, enfileira o payload bruto e responde imediatamente.
+
+    O processamento (IA + envios) acontece nos workers da fila; ver
+    src/services/webhook_queue.py e process_webhook_payload.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
         current_app.logger.info(f"Payload recebido: {data}")
         if not data or 'entry' not in data:
             return jsonify({'error': 'Invalid webhook payload'}), 400
-        entry = data['entry'][0]
-        changes = entry.get('changes', [])
-        if not changes:
-            return jsonify({'error': 'No changes in webhook payload'}), 400
-        value = changes[0].get('value', {})
-        messages = value.get('messages', [])
-        if not messages:
+        if next(iter_webhook_messages(data), None) is None:
             # É um status, não uma mensagem de usuário
             return jsonify({'status': 'ignored'}), 200
-        message = messages[0]
-        sender_phone_number = message['from']
-        
-        # Trata diferentes tipos de mensagem
-        if message.get('type') == 'interactive':
-            interactive = message['interactive']
-            if interactive.get('type') == 'button_reply':
-                button_id = interactive['button_reply']['id']
-                button_title = interactive['button_reply']['title'].strip().lower()
-                
-                # Trata cliques específicos nos botões
-                if button_id.startswith('quero_saber_mais_'):
-                    modelo = button_id.replace('quero_saber_mais_', '').replace('*', '').strip()
-                    dealership = Dealership.query.first()
-                    if dealership:
-                        veiculo = Vehicle.query.filter(
-                            and_(
-                                Vehicle.dealership_id == dealership.id,
-                                Vehicle.modelo.ilike(f"%{modelo}%"),
-                                Vehicle.vendido == False
-                            )
-                        ).first()
-                        if veiculo:
-                            mensagem = f"*{veiculo.marca} {veiculo.modelo} {veiculo.ano_modelo}*\n\n" \
-                                       f"Características Técnicas:\n" \
-                                       f"• Motor: {veiculo.motor if hasattr(veiculo, 'motor') else 'Não informado'}\n" \
-                                       f"• Câmbio: {veiculo.cambio}\n" \
-                                       f"• Combustível: {veiculo.combustivel}\n" \
-                                       f"• Quilometragem: {veiculo.quilometragem:,} km\n\n" \
-                                       f"Itens de Série:\n" \
-                                       f"• {veiculo.itens_opcionais.replace(';', '\n• ') if veiculo.itens_opcionais else 'Não informado'}\n\n" \
-                                       f"Preço: R$ {veiculo.preco:,.2f}\n\n" \
-                                       f"Gostaria de:\n" \
-                                       f"• Ver mais fotos?"
-                            send_whatsapp_message(sender_phone_number, mensagem)
-                            # Se houver fotos, envia a primeira
-                            if veiculo.link_fotos:
-                                fotos = [url.strip() for url in veiculo.link_fotos.split(';') if url.strip()]
-                                if fotos:
-                                    send_whatsapp_message(sender_phone_number, "Aqui está uma foto do veículo:", fotos[0])
-                            # Botão para ver mais fotos
-                            buttons = [
-                                {
-                                    "type": "reply",
-                                    "reply": {
-                                        "id": f"ver_mais_fotos_{veiculo.modelo.lower()}",
-                                        "title": "Ver mais fotos"
-                                    }
-                                },
-                                {
-                                    "type": "reply",
-                                    "reply": {
-                                        "id": "nao_obrigado",
-                                        "title": "Não, obrigado"
-                                    }
-                                }
-                            ]
-                            send_whatsapp_message(sender_phone_number, "O que deseja fazer agora?", buttons=buttons)
-                        else:
-                            mensagem = f"Desculpe, não encontrei informações detalhadas sobre o {modelo}. " \
-                                     f"Posso te ajudar com outro modelo?"
-                            send_whatsapp_message(sender_phone_number, mensagem)
+        current_app.extensions['webhook_queue'].enqueue(data)
+        return jsonify({'status': 'queued'}), 200
+    except Exception as e:
+        # Sem 200 a Meta reenvia o payload mais tarde
+        current_app.logger.error(f"Erro ao enfileirar webhook WhatsApp: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def process_webhook_payload(data):
+    """Processa um payload do webhook retirado da fila (roda nos workers).
+
+    Todas as mensagens do lote são tratadas, não só a primeira.
+    """
+    return dispatch_webhook_messages(data, handle_incoming_message)
+
+def find_button_vehicle(dealership_id, sender_phone_number, ref):
+    """Veículo referenciado por um botão.
+
+    Os botões carregam o id do veículo (leitura pela chave primária). Botões
+    enviados antes disso carregam só uma palavra do modelo: procura primeiro
+    entre os veículos da última busca da conversa e, sem sessão, no estoque.
+    """
+    if ref.isdigit():
+        veiculo = db.session.get(Vehicle, int(ref))
+        if veiculo and veiculo.dealership_id == dealership_id and not veiculo.vendido:
+            return veiculo
+        return None
+    termo = normalize_search_text(ref)
+    for vehicle_id in get_session(dealership_id, sender_phone_number).get('vehicle_ids', []):
+        veiculo = db.session.get(Vehicle, vehicle_id)
+        if veiculo and not veiculo.vendido and termo in (veiculo.modelo_busca or ''):
+            return veiculo
+    return Vehicle.query.filter(
+        and_(
+            Vehicle.dealership_id == dealership_id,
+            Vehicle.modelo_busca.like(f"%{termo}%"),
+            Vehicle.vendido == False
+        )
+    ).first()
+
+def reply_button(button_id, title):
+    return {"type": "reply", "reply": {"id": button_id, "title": title}}
+
+def send_vehicle_results(sender_phone_number, dealership_id, resultados, phone_number_id=None):
+    """Envia a página de resultados: um cartão por veículo, com os botões
+    daquele veículo, e o botão "Ver mais resultados" se a busca tiver mais."""
+    steps = [{
+        'message': resultado['text'],
+        'buttons': [
+            reply_button(f"quero_saber_mais_{resultado['vehicle_id']}", "Quero saber mais"),
+            reply_button(f"ver_mais_fotos_{resultado['vehicle_id']}", "Ver mais fotos"),
+            reply_button("nao_obrigado", "Não, obrigado"),
+        ]
+    } for resultado in resultados]
+    if get_session(dealership_id, sender_phone_number).get('cursor'):
+        steps.append({
+            'message': "Tenho mais opções com essas características. Quer ver?",
+            'buttons': [reply_button("ver_mais_resultados", "Ver mais resultados"),
+                        reply_button("nao_obrigado", "Não, obrigado")]
+        })
+    send_whatsapp_batch(sender_phone_number, steps, phone_number_id=phone_number_id)
+
+def handle_incoming_message(message, metadata=None):
+    """Responde a uma única mensagem recebida pelo WhatsApp.
+
+    A concessionária é a dona do número que recebeu a mensagem (metadata do
+    webhook), e a resposta sai por esse mesmo número.
+    """
+    sender_phone_number = message['from']
+    dealership_id = resolve_dealership_id(metadata)
+    phone_number_id = (metadata or {}).get('phone_number_id')
+    
+    # Trata diferentes tipos de mensagem
+    if message.get('type') == 'interactive':
+        interactive = message['interactive']
+        if interactive.get('type') == 'button_reply':
+            button_id = interactive['button_reply']['id']
+            button_title = interactive['button_reply']['title'].strip().lower()
+            
+            # Trata cliques específicos nos botões
+            if button_id.startswith('quero_saber_mais_'):
+                modelo = button_id.replace('quero_saber_mais_', '').replace('*', '').strip()
+                if dealership_id is not None:
+                    veiculo = find_button_vehicle(dealership_id, sender_phone_number, modelo)
+                    if veiculo:
+                        card = get_vehicle_card(veiculo)
+                        # Detalhe, foto e botões precisam chegar nessa ordem
+                        steps = [{'message': card['detail']}]
+                        # Se houver fotos, envia a primeira
+                        if card['photos']:
+                            steps.append({'message': "Aqui está uma foto do veículo:", 'image_url': card['photos'][0]})
+                        # Botão para ver mais fotos
+                        buttons = [
+                            reply_button(f"ver_mais_fotos_{veiculo.id}", "Ver mais fotos"),
+                            reply_button("nao_obrigado", "Não, obrigado"),
+                        ]
+                        steps.append({'message': "O que deseja fazer agora?", 'buttons': buttons})
+                        send_whatsapp_batch(sender_phone_number, steps, phone_number_id=phone_number_id)
                     else:
-                        mensagem = "Desculpe, houve um erro ao buscar as informações. Tente novamente mais tarde."
-                        send_whatsapp_message(sender_phone_number, mensagem)
-                    return jsonify({'status': 'ok'})
-                elif button_id.startswith('ver_mais_fotos_'):
-                    modelo = button_id.replace('ver_mais_fotos_', '').replace('*', '').strip()
-                    dealership = Dealership.query.first()
-                    if dealership:
-                        veiculo = Vehicle.query.filter(
-                            and_(
-                                Vehicle.dealership_id == dealership.id,
-                                Vehicle.modelo.ilike(f"%{modelo}%"),
-                                Vehicle.vendido == False
-                            )
-                        ).first()
-                        if veiculo and veiculo.link_fotos:
-                            fotos = [url.strip() for url in veiculo.link_fotos.split(';') if url.strip()]
-                            if fotos:
-                                for idx, foto in enumerate(fotos):
-                                    send_whatsapp_message(sender_phone_number, f"Foto {idx+1} do {veiculo.modelo}", foto)
-                            else:
-                                send_whatsapp_message(sender_phone_number, "Não há mais fotos disponíveis para este veículo.")
+                        mensagem = f"Desculpe, não encontrei informações detalhadas sobre esse veículo. " \
+                                 f"Posso te ajudar com outro modelo?"
+                        send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+                else:
+                    mensagem = "Desculpe, houve um erro ao buscar as informações. Tente novamente mais tarde."
+                    send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+                return 'ok'
+            elif button_id.startswith('ver_mais_fotos_'):
+                modelo = button_id.replace('ver_mais_fotos_', '').replace('*', '').strip()
+                if dealership_id is not None:
+                    veiculo = find_button_vehicle(dealership_id, sender_phone_number, modelo)
+                    if veiculo and veiculo.link_fotos:
+                        fotos = get_vehicle_card(veiculo)['photos']
+                        if fotos:
+                            # As fotos são independentes: enviadas em paralelo
+                            send_whatsapp_batch(sender_phone_number, [[
+                                {'message': f"Foto {idx+1} do {veiculo.modelo}", 'image_url': foto}
+                                for idx, foto in enumerate(fotos)
+                            ]], phone_number_id=phone_number_id)
                         else:
-                            send_whatsapp_message(sender_phone_number, "Não há mais fotos disponíveis para este veículo.")
+                            send_whatsapp_message(sender_phone_number, "Não há mais fotos disponíveis para este veículo.", phone_number_id=phone_number_id)
                     else:
-                        send_whatsapp_message(sender_phone_number, "Desculpe, houve um erro ao buscar as fotos. Tente novamente mais tarde.")
-                    return jsonify({'status': 'ok'})
-                elif button_id == 'nao_obrigado':
-                    mensagem = "Entendi! Se precisar de mais informações sobre nossos veículos, é só me chamar. " \
-                             "Estou à disposição para ajudar você a encontrar o carro ideal! 😊"
-                    send_whatsapp_message(sender_phone_number, mensagem)
-                    return jsonify({'status': 'ok'})
-                incoming_msg = button_title
-            elif interactive.get('type') == 'list_reply':
-                incoming_msg = interactive['list_reply']['title'].strip().lower()
-            else:
-                incoming_msg = ''
-        elif message.get('type') == 'text':
-            incoming_msg = message['text']['body'].strip().lower()
+                        send_whatsapp_message(sender_phone_number, "Não há mais fotos disponíveis para este veículo.", phone_number_id=phone_number_id)
+                else:
+                    send_whatsapp_message(sender_phone_number, "Desculpe, houve um erro ao buscar as fotos. Tente novamente mais tarde.", phone_number_id=phone_number_id)
+                return 'ok'
+            elif button_id == 'ver_mais_resultados':
+                resultados = next_results_page(dealership_id, sender_phone_number) if dealership_id is not None else None
+                if resultados and resultados[0].get('vehicle_id'):
+                    send_vehicle_results(sender_phone_number, dealership_id, resultados, phone_number_id)
+                else:
+                    send_whatsapp_message(sender_phone_number, "Não tenho mais resultados para essa busca. "
+                                          "Me diga o que procura e faço uma nova busca!", phone_number_id=phone_number_id)
+                return 'ok'
+            elif button_id == 'nao_obrigado':
+                mensagem = "Entendi! Se precisar de mais informações sobre nossos veículos, é só me chamar. " \
+                         "Estou à disposição para ajudar você a encontrar o carro ideal! 😊"
+                send_whatsapp_message(sender_phone_number, mensagem, phone_number_id=phone_number_id)
+                return 'ok'
+            incoming_msg = button_title
+        elif interactive.get('type') == 'list_reply':
+            incoming_msg = interactive['list_reply']['title'].strip().lower()
         else:
             incoming_msg = ''
-            
-        dealership = Dealership.query.first()
-        if not dealership:
-            return jsonify({'error': 'Dealership not found'}), 404
-            
-        resposta = process_message_with_ai(dealership.id, incoming_msg)
-        # Só envia botões se houver veículos encontrados
-        if isinstance(resposta, list) and resposta and not resposta[0]['text'].startswith('😕'):
-            primeiro_veiculo = resposta[0]
-            mensagem = primeiro_veiculo['text']
-            buttons = [
-                {
-                    "type": "reply",
-                    "reply": {
-                        "id": f"quero_saber_mais_{primeiro_veiculo['text'].split()[1].lower()}",
-                        "title": "Quero saber mais"
-                    }
-                },
-                {
-                    "type": "reply",
-                    "reply": {
-                        "id": f"ver_mais_fotos_{primeiro_veiculo['text'].split()[1].lower()}",
-                        "title": "Ver mais fotos"
-                    }
-                },
-                {
-                    "type": "reply",
-                    "reply": {
-                        "id": "nao_obrigado",
-                        "title": "Não, obrigado"
-                    }
-                }
-            ]
-            send_whatsapp_message(sender_phone_number, mensagem, buttons=buttons)
+    elif message.get('type') == 'text':
+        incoming_msg = message['text']['body'].strip().lower()
+    else:
+        incoming_msg = ''
+        
+    if dealership_id is None:
+        current_app.logger.warning(
+            f"Mensagem de {sender_phone_number} descartada: nenhuma concessionária para o "
+            f"phone_number_id {phone_number_id} (número {(metadata or {}).get('display_phone_number')})")
+        return 'no_dealership'
+        
+    resposta = process_message_with_ai(dealership_id, incoming_msg, sender=sender_phone_number)
+    # Só envia botões se houver veículos encontrados
+    if isinstance(resposta, list) and resposta and resposta[0].get('vehicle_id'):
+        send_vehicle_results(sender_phone_number, dealership_id, resposta, phone_number_id)
+    else:
+        # Garante que sempre envia texto puro
+        if isinstance(resposta, list) and resposta:
+            send_whatsapp_message(sender_phone_number, resposta[0]['text'], phone_number_id=phone_number_id)
+        elif isinstance(resposta, dict) and 'text' in resposta:
+            send_whatsapp_message(sender_phone_number, resposta['text'], phone_number_id=phone_number_id)
         else:
-            # Garante que sempre envia texto puro
-            if isinstance(resposta, list) and resposta:
-                send_whatsapp_message(sender_phone_number, resposta[0]['text'])
-            elif isinstance(resposta, dict) and 'text' in resposta:
-                send_whatsapp_message(sender_phone_number, resposta['text'])
-            else:
-                send_whatsapp_message(sender_phone_number, resposta)
-        return jsonify({'status': 'ok'})
-    except Exception as e:
-        current_app.logger.error(f"Erro no webhook WhatsApp: {str(e)}")
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+            send_whatsapp_message(sender_phone_number, resposta, phone_number_id=phone_number_id)
+    return 'ok' 
\ No newline at end of file
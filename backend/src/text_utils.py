@@ -0,0 +1,23 @@
+"""Normalização de texto compartilhada (chaves de cache, extração, busca)."""
+import re
+import unicodedata
+
+
+def strip_accents(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_message(user_message):
+    """Normaliza uma mensagem: minúsculas, sem acentos, espaços colapsados e
+    sem pontuação nas pontas ("Tem Corolla?" == "tem corolla")."""
+    text = strip_accents(user_message).lower()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' \t\n.,;:!?¿¡…"\'')
+
+
+def normalize_search_text(value):
+    """Forma gravada nas colunas *_busca: minúsculas, sem acentos, espaços simples."""
+    if value is None:
+        return None
+    return re.sub(r'\s+', ' ', strip_accents(str(value)).lower()).strip()
@@ -0,0 +1,84 @@
+"""Opcionais e fotos do veículo: separação e forma canônica.
+
+`itens_opcionais` e `link_fotos` continuam gravados como texto separado por
+`;` (é o que a API e as planilhas enviam). As tabelas vehicle_options e
+vehicle_photos são derivadas deles com as funções abaixo, usadas pelo
+modelo, pela importação em lote e pela migração que preencheu as tabelas.
+"""
+from functools import lru_cache
+
+from src.text_utils import normalize_search_text
+
+# Opcionais reconhecidos pela busca da conversa
+KNOWN_OPCIONAIS = [
+    "ar condicionado", "direção hidráulica", "direção elétrica", "vidros elétricos", "teto solar", "rodas de liga leve", "banco de couro", "sensor de estacionamento", "câmera de ré", "piloto automático", "airbag", "freios abs", "multimídia", "gps", "alarme", "travas elétricas"
+]
+
+OPTION_MAX_LENGTH = 255
+
+# Variações comuns nas planilhas (normalizadas) -> opcional conhecido (normalizado)
+OPTION_ALIASES = {
+    'ar-condicionado': 'ar condicionado',
+    'ar cond': 'ar condicionado',
+    'ar cond.': 'ar condicionado',
+    'a/c': 'ar condicionado',
+    'ar condicionado digital': 'ar condicionado',
+    'dir. hidraulica': 'direcao hidraulica',
+    'dir hidraulica': 'direcao hidraulica',
+    'dir. eletrica': 'direcao eletrica',
+    'vidro eletrico': 'vidros eletricos',
+    'trava eletrica': 'travas eletricas',
+    'rodas de liga': 'rodas de liga leve',
+    'roda de liga leve': 'rodas de liga leve',
+    'rodas liga leve': 'rodas de liga leve',
+    'bancos de couro': 'banco de couro',
+    'banco em couro': 'banco de couro',
+    'bancos em couro': 'banco de couro',
+    'sensor de re': 'sensor de estacionamento',
+    'sensores de estacionamento': 'sensor de estacionamento',
+    'camera de estacionamento': 'camera de re',
+    'controle de cruzeiro': 'piloto automatico',
+    'airbags': 'airbag',
+    'air bag': 'airbag',
+    'air bags': 'airbag',
+    'abs': 'freios abs',
+    'freio abs': 'freios abs',
+    'central multimidia': 'multimidia',
+    'kit multimidia': 'multimidia',
+    'navegador': 'gps',
+    'teto solar panoramico': 'teto solar',
+}
+
+_KNOWN = {normalize_search_text(option): option for option in KNOWN_OPCIONAIS}
+
+
+@lru_cache(maxsize=4096)
+def canonical_option(item):
+    """(chave, rótulo) do opcional: a chave é a forma normalizada do opcional
+    conhecido (ou do próprio texto, se desconhecido); o rótulo é o nome
+    conhecido ou o texto como veio. Guardada em cache: os mesmos opcionais
+    se repetem em quase todo o estoque."""
+    label = (item or '').strip()[:OPTION_MAX_LENGTH]
+    key = normalize_search_text(label)
+    key = OPTION_ALIASES.get(key, key)
+    return key, _KNOWN.get(key, label)
+
+
+def split_options(itens_opcionais):
+    """Opcionais distintos de `itens_opcionais`, na ordem: [(chave, rótulo)]."""
+    options = {}
+    for item in (itens_opcionais or '').split(';'):
+        if item.strip():
+            key, label = canonical_option(item)
+            options.setdefault(key, label)
+    return list(options.items())
+
+
+def split_photos(link_fotos):
+    """URLs de `link_fotos`, na ordem, sem vazios."""
+    return [url.strip() for url in (link_fotos or '').split(';') if url.strip()]
+
+
+def option_labels(itens_opcionais):
+    """Rótulos dos opcionais de `itens_opcionais`, como exibidos na API."""
+    return [label for _, label in split_options(itens_opcionais)]
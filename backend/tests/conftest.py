@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+# Os testes não escrevem em logs/backend.log (definido antes de importar o app)
+os.environ.setdefault('LOG_FILE', '')
+
+from src.main import app, db
+
+
+@pytest.fixture
+def client():
+    """Cliente de teste com o banco criado e apagado a cada teste.
+
+    Os arquivos que precisam de mais preparação (workers, índices) sobrescrevem
+    este fixture pedindo `client` e fazendo o ajuste antes do yield.
+    """
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            db.create_all()
+            yield client
+            db.session.remove()
+            db.drop_all()
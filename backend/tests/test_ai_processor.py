@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import pytest
+import src.ai_processor as ai_processor
+from src import metrics
+from src.ai_processor import KNOWN_OPCIONAIS, ExtractionParseError, extract_search_params, normalize_message
+from src.services.fuzzy_match import FuzzyIndex
+from src.services.intent_extractor import extract_fast_path
+
+VOCABULARY = {
+    'marca': {'toyota': 'Toyota', 'honda': 'Honda'},
+    'modelo': {'corolla': 'Corolla', 'corolla cross': 'Corolla Cross', 'civic': 'Civic'},
+}
+
+# Estoque para o casamento aproximado: (marca, modelo, versão)
+FUZZY = FuzzyIndex()
+for marca, modelo, versao in [('Toyota', 'Corolla', 'XEi'), ('Toyota', 'Corolla Cross', 'XRE'),
+                              ('Honda', 'Civic', 'EXL'), ('Hyundai', 'HB20', 'Comfort'),
+                              ('Volkswagen', 'T-Cross', 'Highline'), ('Chevrolet', 'Onix Plus', 'LTZ')]:
+    FUZZY.add('marca', marca)
+    FUZZY.add('modelo', modelo)
+    FUZZY.add('versao', versao, modelo=modelo)
+
+class FakeModel:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return SimpleNamespace(text=self.responses.pop(0))
+
+@pytest.fixture
+def dealership():
+    return SimpleNamespace(id=1, name='Test Dealership')
+
+@pytest.fixture(autouse=True)
+def clear_cache(monkeypatch):
+    monkeypatch.setattr(ai_processor, 'get_inventory_vocabulary', lambda dealership_id: VOCABULARY)
+    monkeypatch.setattr(ai_processor, 'get_inventory_matcher', lambda dealership_id: None)
+    ai_processor.extraction_cache.clear()
+    yield
+    ai_processor.extraction_cache.clear()
+
+def test_normalize_message():
+    """Variações de caixa, acento, espaço e pontuação geram a mesma chave"""
+    assert normalize_message('  Tem   COROLLA? ') == 'tem corolla'
+    assert normalize_message('Não, obrigado!') == normalize_message('nao, obrigado')
+
+def test_extraction_is_cached_by_normalized_text(dealership, monkeypatch):
+    """Mensagens repetidas não voltam ao Gemini"""
+    fake = FakeModel('```json {"modelo": "hb20"} ```')
+    monkeypatch.setattr(ai_processor, 'model', fake)
+    assert extract_search_params(dealership, 'tem hb20?') == {'modelo': 'hb20'}
+    assert extract_search_params(dealership, 'Tem HB20') == {'modelo': 'hb20'}
+    assert len(fake.prompts) == 1
+
+def test_prompt_version_invalidates_cache(dealership, monkeypatch):
+    """Mudar a versão do prompt ignora as extrações antigas"""
+    fake = FakeModel('{"intent": "other"}', '{"intent": "other"}')
+    monkeypatch.setattr(ai_processor, 'model', fake)
+    extract_search_params(dealership, 'vocês financiam?')
+    monkeypatch.setattr(ai_processor, 'PROMPT_VERSION', 'test')
+    extract_search_params(dealership, 'vocês financiam?')
+    assert len(fake.prompts) == 2
+
+def test_parse_errors_are_not_cached(dealership, monkeypatch):
+    """Respostas inválidas do Gemini não ficam no cache"""
+    fake = FakeModel('não sei', '{}')
+    monkeypatch.setattr(ai_processor, 'model', fake)
+    with pytest.raises(ExtractionParseError):
+        extract_search_params(dealership, 'xyz')
+    assert extract_search_params(dealership, 'xyz') == {}
+    assert len(fake.prompts) == 2
+
+@pytest.mark.parametrize('message, expected', [
+    ('Oi, bom dia!', {'intent': 'greeting'}),
+    ('Não, obrigado', {'intent': 'other'}),
+    ('tem corolla prata até 80 mil?', {'modelo': 'Corolla', 'cor': 'prata', 'preco_max': 80000.0}),
+    ('corolla cross 2020 pra cima', {'modelo': 'Corolla Cross', 'ano_min': 2020}),
+    ('honda até 50 mil km', {'marca': 'Honda', 'quilometragem_max': 50000}),
+    ('civic com teto solar', {'modelo': 'Civic', 'opcionais': ['teto solar']}),
+    ('entre 2018 e 2021', {'ano_min': 2018, 'ano_max': 2021}),
+])
+def test_fast_path_extraction(message, expected):
+    """Mensagens simples são resolvidas pelas regras, sem IA"""
+    assert extract_fast_path(message, VOCABULARY, KNOWN_OPCIONAIS) == expected
+
+@pytest.mark.parametrize('message', ['vocês financiam?', 'quero algo econômico pra família', 'até 80'])
+def test_fast_path_falls_back_to_ai(message):
+    """Texto que as regras não explicam vai para o Gemini"""
+    assert extract_fast_path(message, VOCABULARY, KNOWN_OPCIONAIS) is None
+
+def test_fast_path_skips_gemini(dealership, monkeypatch):
+    """Um acerto do fast path não chama o modelo nem o cache"""
+    fake = FakeModel()
+    monkeypatch.setattr(ai_processor, 'model', fake)
+    metrics.reset()
+    assert extract_search_params(dealership, 'tem civic?') == {'modelo': 'Civic'}
+    assert fake.prompts == []
+    assert metrics.get('ai.fast_path.hits') == 1
+
+@pytest.mark.parametrize('message, expected', [
+    ('tem corola?', {'modelo': 'Corolla'}),
+    ('hb 20 até 60 mil', {'modelo': 'HB20', 'preco_max': 60000.0}),
+    ('volks', {'marca': 'Volkswagen'}),
+    ('civik prata', {'modelo': 'Civic', 'cor': 'prata'}),
+    ('tcross', {'modelo': 'T-Cross'}),
+    ('onix plus ltz', {'modelo': 'Onix Plus'}),
+    ('chevy', {'marca': 'Chevrolet'}),
+])
+def test_fast_path_fuzzy_matching(message, expected):
+    """Erros de digitação, espaços e apelidos caem no valor do estoque"""
+    assert extract_fast_path(message, VOCABULARY, KNOWN_OPCIONAIS, match_term=FUZZY.best) == expected
+
+@pytest.mark.parametrize('message', ['vocês financiam?', 'quero algo econômico pra família'])
+def test_fuzzy_matching_ignores_unrelated_words(message):
+    """Palavras sem nada parecido no estoque continuam indo para o Gemini"""
+    assert extract_fast_path(message, VOCABULARY, KNOWN_OPCIONAIS, match_term=FUZZY.best) is None
@@ -1,12 +1,21 @@
 import pytest
+from sqlalchemy import event
 from src.main import app, db
 from src.models import User, Dealership, Vehicle
+from src.services.inventory_version import version_cache
+from src.services.vehicle_list_cache import list_cache
+from src import metrics
 import json
+import time
+from datetime import datetime, timedelta
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    # Os testes gravam veículos direto no banco, sem as rotas que trocam a versão
+    version_cache.clear()
+    list_cache.clear()
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -149,4 +158,166 @@ def test_get_vehicles(client):
     assert response.status_code == 200
     data = json.loads(response.data)
     assert len(data) == 1
-    assert data[0]['marca'] == 'Honda' 
\ No newline at end of file
+    assert data[0]['marca'] == 'Honda' 
+def test_vehicle_options_are_normalized_and_filterable(client):
+    """Opcionais e fotos vão para as tabelas filhas e filtram a listagem"""
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    corolla = Vehicle(dealership_id=dealership.id, marca='Toyota', modelo='Corolla',
+                      itens_opcionais='Ar-condicionado; Teto Solar;Isofix;teto solar',
+                      link_fotos='https://f/1.jpg; ;https://f/2.jpg')
+    civic = Vehicle(dealership_id=dealership.id, marca='Honda', modelo='Civic', itens_opcionais='A/C')
+    db.session.add_all([corolla, civic])
+    db.session.commit()
+
+    assert sorted((o.option, o.label) for o in corolla.options) == [
+        ('ar condicionado', 'ar condicionado'), ('isofix', 'Isofix'), ('teto solar', 'teto solar')]
+    assert [(p.position, p.url) for p in corolla.photos] == [(0, 'https://f/1.jpg'), (1, 'https://f/2.jpg')]
+
+    response = client.put(f'/api/vehicles/{civic.id}', json={'itens_opcionais': 'Ar condicionado;Teto solar'})
+    assert response.status_code == 200
+    assert sorted(o.option for o in db.session.get(Vehicle, civic.id).options) == ['ar condicionado', 'teto solar']
+
+    def listed(opcionais):
+        response = client.get(f'/vehicles/?dealership_id={dealership.id}&opcionais={opcionais}')
+        assert response.status_code == 200
+        return sorted(v['modelo'] for v in response.get_json())
+
+    assert listed('ar condicionado') == ['Civic', 'Corolla']
+    assert listed('Teto Solar,Isofix') == ['Corolla']
+    assert listed('freios abs') == []
+
+def test_vehicle_list_pages_by_cursor_and_streams(client):
+    """A listagem pagina por cursor, seleciona campos e exporta em streaming"""
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    db.session.add_all([Vehicle(dealership_id=dealership.id, marca='Fiat', modelo=f'Uno {i}', preco=20000.0 + i)
+                        for i in range(5)])
+    db.session.add(Vehicle(dealership_id=dealership.id, marca='Fiat', modelo='Vendido', vendido=True))
+    db.session.commit()
+
+    url = f'/vehicles/?dealership_id={dealership.id}&fields=modelo,preco&limit=2'
+    modelos, pages = [], 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert all(set(vehicle) == {'modelo', 'preco'} for vehicle in page)
+        modelos += [vehicle['modelo'] for vehicle in page]
+        pages += 1
+        link = response.headers.get('Link')
+        url = link[1:link.index('>')] if link else None
+    assert pages == 3
+    assert modelos == [f'Uno {i}' for i in range(5)]
+
+    response = client.get(f'/vehicles/?dealership_id={dealership.id}&fields=id,modelo&format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['modelo'] for line in lines] == [f'Uno {i}' for i in range(5)]
+
+    response = client.get(f'/vehicles/?dealership_id={dealership.id}&fields=modelo&format=json')
+    assert len(json.loads(response.data)) == 5
+
+    assert client.get(f'/vehicles/?dealership_id={dealership.id}&fields=senha').status_code == 400
+    assert client.get(f'/vehicles/?dealership_id={dealership.id}&cursor=xyz').status_code == 400
+
+    response = client.get('/debug/vehicles?limit=4&fields=id,vendido')
+    data = response.get_json()
+    assert data['count'] == 4 and data['next_cursor']
+    rest = client.get(f"/debug/vehicles?cursor={data['next_cursor']}").get_json()
+    assert [v['vendido'] for v in rest['vehicles']] == [False, True] and rest['next_cursor'] is None
+
+def test_vehicle_list_answers_conditional_get_from_the_version_cache(client):
+    """Sem mudanças no estoque a consulta condicional responde 304 sem ler veículos"""
+    version_cache.clear()
+    dealership_id = client.post('/dealerships/', json={
+        'name': 'Test Dealership', 'whatsapp_number': '5511999999999',
+        'email': 'test@dealership.com', 'cnpj': '12345678901234'}).get_json()['id']
+    client.post('/vehicles/', json={'dealership_id': dealership_id, 'marca': 'Fiat', 'modelo': 'Uno'})
+    url = f'/vehicles/?dealership_id={dealership_id}'
+
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache' and first.last_modified is not None
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+        since = client.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert again.status_code == 304 and again.headers['ETag'] == first.headers['ETag']
+    assert since.status_code == 304
+    assert not any('vehicles' in statement for statement in statements)
+
+    other = client.get(url + '&fields=id', headers={'If-None-Match': first.headers['ETag']})
+    assert other.status_code == 200 and other.headers['ETag'] != first.headers['ETag']
+
+    client.post('/vehicles/', json={'dealership_id': dealership_id, 'marca': 'Fiat', 'modelo': 'Mobi'})
+    changed = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and len(changed.get_json()) == 2
+
+    dealerships = client.get('/dealerships/')
+    assert client.get('/dealerships/', headers={'If-None-Match': dealerships.headers['ETag']}).status_code == 304
+
+def test_vehicle_list_is_served_from_cache_until_a_write(client):
+    """Listagens repetidas saem do cache; cadastro, edição e venda invalidam"""
+    dealership_id = client.post('/dealerships/', json={
+        'name': 'Test Dealership', 'whatsapp_number': '5511999999999',
+        'email': 'test@dealership.com', 'cnpj': '12345678901234'}).get_json()['id']
+    uno_id = client.post('/vehicles/', json={'dealership_id': dealership_id, 'marca': 'Fiat', 'modelo': 'Uno',
+                                             'cambio': 'Manual', 'preco': 30000.0}).get_json()['id']
+    url = f'/vehicles/?dealership_id={dealership_id}&cambio=Manual&max_price=50000'
+    modelos = lambda response: [vehicle['modelo'] for vehicle in response.get_json()]
+
+    metrics.reset()
+    assert modelos(client.get(url)) == ['Uno']
+    assert modelos(client.get(f'/vehicles/?max_price=50000.0&marca=&cambio=Manual&dealership_id={dealership_id}')) == ['Uno']
+    assert metrics.get('http.vehicle_list_cache.hits') == 1
+
+    client.post('/vehicles/', json={'dealership_id': dealership_id, 'marca': 'Fiat', 'modelo': 'Mobi',
+                                    'cambio': 'Manual', 'preco': 45000.0})
+    assert modelos(client.get(url)) == ['Uno', 'Mobi']
+    client.put(f'/api/vehicles/{uno_id}', json={'preco': 60000.0})
+    assert modelos(client.get(url)) == ['Mobi']
+    client.put(f'/api/vehicles/{uno_id}', json={'preco': 20000.0})
+    client.put(f'/api/vehicles/{uno_id}/mark-sold')
+    assert modelos(client.get(url)) == ['Mobi']
+    assert metrics.get('http.vehicle_list_cache.hits') == 1
+
+def test_conditional_get_sees_expired_destaque_and_moved_vehicles(client):
+    """Destaque vencido e veículo transferido mudam a versão, sem falso 304"""
+    ids = [client.post('/dealerships/', json={
+        'name': f'Dealership {n}', 'whatsapp_number': f'551199999999{n}',
+        'email': f'test{n}@dealership.com', 'cnpj': f'1234567890123{n}'}).get_json()['id'] for n in range(2)]
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    featured = Vehicle(dealership_id=ids[0], marca='Fiat', modelo='Uno', destaque=True,
+                       destaque_ate=datetime.utcnow() + timedelta(seconds=1))
+    db.session.add_all([featured] + [Vehicle(dealership_id=ids[0], marca='Fiat', modelo=modelo,
+                                             data_atualizacao=hour_ago) for modelo in ('Mobi', 'Palio')])
+    db.session.commit()
+    version_cache.clear()
+
+    url = f'/vehicles/?dealership_id={ids[0]}&destaque=1'
+    first = client.get(url)
+    assert [v['modelo'] for v in first.get_json()] == ['Uno'] and first.last_modified is None
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    time.sleep(1.1)
+    expired = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert expired.status_code == 200 and expired.get_json() == []
+
+    db.session.delete(featured)
+    db.session.commit()
+    version_cache.clear()
+    url = f'/vehicles/?dealership_id={ids[0]}'
+    before = client.get(url)
+    mobi_id = before.get_json()[0]['id']
+    client.put(f'/api/vehicles/{mobi_id}', json={'dealership_id': ids[1]})
+    since = client.get(url, headers={'If-Modified-Since': before.headers['Last-Modified']})
+    assert since.status_code == 200 and [v['modelo'] for v in since.get_json()] == ['Palio']
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+from src.main import app, db
+from src.models import Dealership, Vehicle
+import src.ai_processor as ai_processor
+import src.services.intent_extractor as intent_extractor
+import src.services.inventory_index as inventory_index
+from src.ai_processor import rank_vehicles_in_db, search_vehicles_in_db
+from src.services.inventory_index import get_inventory_index, invalidate_inventory_index
+
+@pytest.fixture
+def client(client):
+    invalidate_inventory_index()
+    yield client
+    invalidate_inventory_index()
+
+@pytest.fixture
+def dealership(client):
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    return dealership
+
+@pytest.fixture
+def vehicles(dealership):
+    rows = [
+        ('Toyota', 'Corolla', 2020, 95000.0, 40000, 'Prata', 'Ar condicionado;Teto solar'),
+        ('Toyota', 'Corolla Cross', 2022, 150000.0, 15000, 'Branco', 'Ar condicionado'),
+        ('Volkswagen', 'Gol', 2015, 35000.0, 120000, 'Prata', None),
+        ('Volkswagen', 'Golf', 2018, 89000.0, 60000, 'Preto', 'Teto solar;Banco de couro'),
+        ('Honda', 'Civic', 2019, 99000.0, 55000, 'Cinza Grafite', 'Banco de couro'),
+        ('Honda', 'City', 2021, None, 30000, 'Prata', None),
+    ]
+    for marca, modelo, ano, preco, km, cor, opcionais in rows:
+        db.session.add(Vehicle(dealership_id=dealership.id, marca=marca, modelo=modelo, ano_modelo=ano,
+                               preco=preco, quilometragem=km, cor=cor, itens_opcionais=opcionais))
+    db.session.add(Vehicle(dealership_id=dealership.id, marca='Toyota', modelo='Corolla', ano_modelo=2017,
+                           preco=70000.0, quilometragem=90000, cor='Prata', vendido=True))
+    db.session.commit()
+    return Vehicle.query.order_by(Vehicle.id).all()
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'modelo': 'corolla'},
+    {'modelo': 'gol'},
+    {'modelo': 'Corolla Cross'},
+    {'marca': 'TOYOTA', 'preco_max': 100000},
+    {'cor': 'prata'},
+    {'cor': 'grafite'},
+    {'ano_min': 2019, 'ano_max': 2021},
+    {'preco_min': 90000},
+    {'quilometragem_max': 55000},
+    {'opcionais': ['teto solar']},
+    {'opcionais': ['A/C', 'bancos em couro']},
+    {'marca': 'honda', 'quilometragem_max': 100000, 'cor': 'prata'},
+    {'modelo': 'fusca'},
+])
+def test_index_matches_database_search(dealership, vehicles, params):
+    """O índice em memória devolve os mesmos veículos da busca no banco"""
+    expected = [v.id for v in search_vehicles_in_db(dealership.id, params)]
+    assert [v.id for v in get_inventory_index(dealership.id).search(params)] == expected
+
+def test_opcionais_rank_by_canonical_keys(dealership, vehicles):
+    """Apelidos e acentos dos opcionais contam na pontuação, no índice e no banco"""
+    params = {'opcionais': ['ar-condicionado', 'Teto Solar']}
+    for ranked in (rank_vehicles_in_db(dealership.id, params, limit=3),
+                   get_inventory_index(dealership.id).search_ranked(params, limit=3)):
+        assert [v.modelo for _, v in ranked] == ['Corolla', 'Golf', 'Corolla Cross']
+
+def test_keyset_pages_match_database(dealership, vehicles):
+    """Páginas pelo cursor: sem alvo de preço/ano, destaques e depois menor preço (sem preço no fim)"""
+    golf = next(v for v in vehicles if v.modelo == 'Golf')
+    golf.destaque = True
+    db.session.commit()
+    invalidate_inventory_index()
+
+    index = get_inventory_index(dealership.id)
+    pages, after = [], None
+    while True:
+        page = index.search_ranked({}, limit=2, after=after)
+        assert [(key, v.id) for key, v in page] == \
+            [(key, v.id) for key, v in rank_vehicles_in_db(dealership.id, {}, limit=2, after=after)]
+        if not page:
+            break
+        pages.append([v.modelo for _, v in page])
+        after = page[-1][0]
+    assert pages == [['Golf', 'Gol'], ['Corolla', 'Civic'], ['Corolla Cross', 'City']]
+
+def test_vehicle_writes_update_index(client, dealership, vehicles):
+    """Criação, edição e venda pelas rotas atualizam o índice carregado"""
+    index = get_inventory_index(dealership.id)
+    assert len(index) == 6
+
+    response = client.post('/vehicles/', json={'dealership_id': dealership.id, 'marca': 'Fiat',
+                                               'modelo': 'Uno', 'preco': 25000.0})
+    assert response.status_code == 201
+    assert [v.modelo for v in index.search({'marca': 'fiat'})] == ['Uno']
+
+    gol = vehicles[2]
+    client.put(f'/api/vehicles/{gol.id}', json={'preco': 30000.0})
+    assert [v.id for v in index.search({'preco_min': 29000, 'preco_max': 32000})] == [gol.id]
+
+    client.put(f'/api/vehicles/{gol.id}/mark-sold')
+    assert index.search({'modelo': 'gol'}) == []
+    assert 'gol' not in index.vocabulary()['modelo']
+    assert get_inventory_index(dealership.id) is index
+
+def test_opcionais_map_follows_writes(client, dealership, vehicles):
+    """O mapa chave canônica -> ids dos opcionais é montado na carga e acompanha as escritas"""
+    corolla, cross, golf = vehicles[0], vehicles[1], vehicles[3]
+    index = get_inventory_index(dealership.id)
+    assert index.opcionais['ar condicionado'] == {corolla.id, cross.id}
+    assert index.opcionais['teto solar'] == {corolla.id, golf.id}
+
+    client.put(f'/api/vehicles/{golf.id}', json={'itens_opcionais': 'A/C'})
+    client.put(f'/api/vehicles/{corolla.id}/mark-sold')
+    assert index.opcionais['ar condicionado'] == {cross.id, golf.id}
+    assert 'teto solar' not in index.opcionais
+    params = {'opcionais': ['ar-condicionado', 'teto solar']}
+    assert [(key, v.id) for key, v in index.search_ranked(params, limit=3)] == \
+        [(key, v.id) for key, v in rank_vehicles_in_db(dealership.id, params, limit=3)]
+
+def test_resolve_params_fixes_typos(client, dealership, vehicles):
+    """Marca/modelo sem veículo viram o valor mais parecido; o índice acompanha as escritas"""
+    index = get_inventory_index(dealership.id)
+    assert index.resolve_params({'modelo': 'corola', 'marca': 'volks', 'preco_max': 100000}) == \
+        {'modelo': 'Corolla', 'marca': 'Volkswagen', 'preco_max': 100000}
+    assert index.resolve_params({'modelo': 'gol'}) == {'modelo': 'gol'}
+    assert index.resolve_params({'modelo': 'fusca'}) == {'modelo': 'fusca'}
+    assert index.resolve_params({'modelo': 'civik'}) == {'modelo': 'Civic'}
+
+    client.put(f'/api/vehicles/{vehicles[4].id}/mark-sold')
+    assert index.resolve_params({'modelo': 'civik'}) == {'modelo': 'civik'}
+    client.post('/vehicles/', json={'dealership_id': dealership.id, 'marca': 'Hyundai', 'modelo': 'HB20',
+                                    'versao': 'Comfort', 'preco': 60000.0})
+    assert index.resolve_params({'modelo': 'hb 20'}) == {'modelo': 'HB20'}
+    assert index.resolve_params({'modelo': 'confort'}) == {'modelo': 'HB20'}
+
+def test_disabled_index_is_never_built(dealership, vehicles, monkeypatch):
+    """Com INVENTORY_INDEX_ENABLED=false a conversa e o extrator vão ao banco"""
+    monkeypatch.setattr(ai_processor, 'INVENTORY_INDEX_ENABLED', False)
+    monkeypatch.setattr(intent_extractor, 'INVENTORY_INDEX_ENABLED', False)
+    monkeypatch.setattr(inventory_index, 'InventoryIndex', None)  # qualquer construção falharia
+    assert [v.modelo for v in ai_processor.search_page(dealership.id, {'modelo': 'civic'})] == ['Civic']
+    assert intent_extractor.get_inventory_vocabulary(dealership.id)['modelo']['corolla cross'] == 'Corolla Cross'
+    assert intent_extractor.get_inventory_matcher(dealership.id) is None
+
+def test_concurrent_rebuild_loads_once_and_keeps_writes(dealership, vehicles, monkeypatch):
+    """Só uma thread recarrega o índice; escritas durante a carga entram no índice novo"""
+    loads, real_index = [], inventory_index.InventoryIndex
+    civic = next(v for v in vehicles if v.modelo == 'Civic')
+
+    def slow_index(rows):
+        loads.append(1)
+        civic.preco = 12345.0  # escrita que chega no meio da carga
+        inventory_index.update_inventory_index(civic)
+        time.sleep(0.2)
+        return real_index(rows)
+    monkeypatch.setattr(inventory_index, 'InventoryIndex', slow_index)
+
+    results = []
+    def search():
+        with app.app_context():
+            results.append(get_inventory_index(dealership.id))
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1 and all(index is results[0] for index in results)
+    assert results[0].vehicles[civic.id].preco == 12345.0
@@ -0,0 +1,54 @@
+import json
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+import src.serializers as serializers
+from src.main import db
+from src.models import Dealership, Vehicle
+from src.serializers import Serializer, columns_serializer, compile_serializer, dumps
+
+def test_compiled_serializer_converts_by_column_type():
+    """Datas viram isoformat (None continua None) e conversões próprias recebem também None"""
+    serialize = compile_serializer(Vehicle, ('id', 'destaque_ate', 'data_cadastro', 'link_fotos'),
+                                   {'link_fotos': lambda value: (value or '').split(';') if value else []})
+    row = namedtuple('Row', 'id destaque_ate data_cadastro link_fotos')
+    assert serialize(row(1, None, datetime(2026, 1, 2, 3, 4), None)) == {
+        'id': 1, 'destaque_ate': None, 'data_cadastro': '2026-01-02T03:04:00', 'link_fotos': []}
+
+def test_positional_serializer_reads_rows_by_index():
+    """Linhas do Core são lidas pela posição, na ordem dos campos"""
+    assert columns_serializer(Vehicle, ('marca', 'preco'), positional=True)(('Fiat', 25000.0)) == {
+        'marca': 'Fiat', 'preco': 25000.0}
+    assert columns_serializer(Vehicle, ('marca',), positional=True).many([('Fiat',), ('Ford',)]) == [
+        {'marca': 'Fiat'}, {'marca': 'Ford'}]
+    with pytest.raises(ValueError):
+        Serializer(['preco) or (1'])
+
+def test_dumps_without_orjson(monkeypatch):
+    """Sem orjson, o json da biblioteca padrão gera o mesmo documento"""
+    data = [{'marca': 'Citroën', 'preco': 1.5, 'destaque': True, 'cor': None}]
+    encoded = dumps(data)
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert json.loads(dumps(data)) == json.loads(encoded) == data
+
+def test_vehicle_to_dict_and_dealership_list(client):
+    """to_dict compilado mantém o formato; a listagem de concessionárias sai das colunas"""
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    vehicle = Vehicle(dealership_id=dealership.id, marca='Fiat', modelo='Uno', itens_opcionais='A/C;Isofix')
+    db.session.add(vehicle)
+    db.session.commit()
+
+    data = vehicle.to_dict()
+    assert data['itens_opcionais'] == ['ar condicionado', 'Isofix'] and data['link_fotos'] == []
+    assert data['data_cadastro'] == vehicle.data_cadastro.isoformat() and data['data_venda'] is None
+
+    response = client.get('/dealerships/')
+    assert response.status_code == 200
+    assert response.get_json() == [{
+        'id': dealership.id, 'name': 'Test Dealership', 'whatsapp_number': '5511999999999',
+        'whatsapp_phone_number_id': None, 'email': 'test@dealership.com', 'cnpj': '12345678901234',
+        'address': None, 'city': None, 'state': None, 'phone': None, 'website': None, 'active': True}]
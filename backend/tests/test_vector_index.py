@@ -0,0 +1,121 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from src.main import app, db
+from src.models import Dealership, Vehicle
+import src.services.vector_index as vector_index
+import src.ai_processor as ai_processor
+from src.ai_processor import search_page
+from src.services.embeddings import HashingEmbedder
+from src.services.inventory_index import invalidate_inventory_index
+from src.services.vector_index import VectorIndex, get_vector_index, semantic_scores, write_vector_index
+
+@pytest.fixture
+def client(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, 'EMBEDDING_INDEX_DIR', str(tmp_path / 'vectors'))
+    monkeypatch.setattr(vector_index, 'SEMANTIC_SEARCH_ENABLED', True)
+    monkeypatch.setattr(app.extensions['vector_index'], 'num_workers', 0)  # os testes rodam os builds
+    vector_index._loaded.clear()
+    invalidate_inventory_index()
+    yield client
+    vector_index._loaded.clear()
+    invalidate_inventory_index()
+
+@pytest.fixture
+def vehicles(client):
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    rows = [
+        ('Chevrolet', 'Onix Plus', 'LT 1.0', '1.0', 'Flex', 80000.0, 'Sedan com ótimo porta-malas e isofix'),
+        ('Toyota', 'Hilux', 'SRX 4x4 Diesel Cabine Dupla', '2.8', 'Diesel', 250000.0, None),
+        ('BMW', '320i', 'M Sport', '2.0 Turbo', 'Gasolina', 260000.0, 'Banco de couro e teto solar'),
+        ('Fiat', 'Mobi', 'Like', '1.0', 'Flex', 55000.0, 'Hatch compacto'),
+    ]
+    for marca, modelo, versao, motor, combustivel, preco, observacoes in rows:
+        db.session.add(Vehicle(dealership_id=dealership.id, marca=marca, modelo=modelo, versao=versao, motor=motor,
+                               combustivel=combustivel, preco=preco, observacoes=observacoes))
+    db.session.commit()
+    vector_index.build_vector_index(dealership.id)
+    return dealership, {v.modelo: v for v in Vehicle.query.all()}
+
+def test_ivf_search_matches_exact_search(tmp_path):
+    """Com todas as listas percorridas o IVF devolve o mesmo que a busca exata"""
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(3000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = np.arange(1, 3001) * 10
+    index = VectorIndex(write_vector_index(str(tmp_path / 'ivf'), ids, vectors, {'model': 'test'}, nlist=20))
+    assert len(index) == 3000 and index.meta['nlist'] == 20
+    query = vectors[7]
+    found, scores = index.search(query, k=10, nprobe=20)
+    exact = ids[np.argsort(-(vectors @ query))[:10]]
+    assert found.tolist() == exact.tolist()
+    assert found[0] == 80 and np.all(np.diff(scores) <= 0)
+    approximate, _ = index.search(query, k=10, nprobe=5)
+    assert approximate[0] == 80
+
+def test_hashing_embedder_maps_descriptions_to_vehicles():
+    """Conceitos aproximam a descrição do cliente das características do veículo"""
+    embedder = HashingEmbedder()
+    vehicles = embedder.encode_vehicles(['Chevrolet. Onix Plus. LT 1.0. Flex. Sedan com isofix',
+                                         'Toyota. Hilux. SRX 4x4. Diesel. Cabine dupla'])
+    assert np.argmax(vehicles @ embedder.encode_query('carro econômico pra família')) == 0
+    assert np.argmax(vehicles @ embedder.encode_query('SUV pra estrada de terra')) == 1
+    assert np.allclose(np.linalg.norm(vehicles, axis=1), 1)
+
+def test_semantic_search_is_hybrid(client, vehicles):
+    """A descrição ordena os candidatos; os filtros continuam valendo"""
+    dealership, by_modelo = vehicles
+    assert search_page(dealership.id, {'descricao': 'SUV pra estrada de terra'})[0].modelo == 'Hilux'
+    assert search_page(dealership.id, {'descricao': 'carro econômico pra família'})[0].modelo == 'Onix Plus'
+    cheap = search_page(dealership.id, {'descricao': 'SUV pra estrada de terra', 'preco_max': 100000})
+    assert by_modelo['Hilux'].id not in [v.id for v in cheap]
+
+    scores = semantic_scores(dealership.id, 'algo esportivo e potente')
+    assert max(scores, key=scores.get) == by_modelo['320i'].id and max(scores.values()) == 1.0
+
+def test_vector_index_is_built_in_background(client, vehicles):
+    """A busca não constrói o índice: agenda o build e responde sem o bônus semântico"""
+    dealership, _ = vehicles
+    builder = app.extensions['vector_index']
+    vector_index._loaded.clear()
+    shutil.rmtree(vector_index.index_path(dealership.id))
+
+    assert semantic_scores(dealership.id, 'SUV pra estrada de terra') == {}
+    assert get_vector_index(dealership.id) is None
+    assert builder.run_pending() == 1
+    assert len(get_vector_index(dealership.id)) == 4
+    assert semantic_scores(dealership.id, 'SUV pra estrada de terra')
+    assert builder.run_pending() == 0
+
+def test_vector_index_is_rebuilt_and_swapped(client, vehicles, monkeypatch):
+    """Escritas no estoque agendam um novo índice, trocado por inteiro quando fica pronto"""
+    dealership, _ = vehicles
+    first = get_vector_index(dealership.id)
+    assert len(first) == 4 and get_vector_index(dealership.id) is first
+
+    response = client.post('/vehicles/', json={'dealership_id': dealership.id, 'marca': 'Jeep',
+                                                   'modelo': 'Renegade', 'versao': 'Trailhawk 4x4'})
+    assert response.status_code == 201
+    assert get_vector_index(dealership.id) is first  # o anterior vale até o novo ficar pronto
+    assert app.extensions['vector_index'].run_pending() == 1
+    second = get_vector_index(dealership.id)
+    assert second is not first and len(second) == 5
+    assert os.path.realpath(os.path.join(vector_index.index_path(dealership.id), 'current')) == second.path
+    assert first.vectors.shape == (4, first.meta['dim'])  # a versão anterior continua legível
+
+    monkeypatch.setattr(vector_index, 'SEMANTIC_SEARCH_ENABLED', False)
+    assert semantic_scores(dealership.id, 'SUV pra estrada de terra') == {}
+
+def test_semantic_fallback_needs_a_match(client, vehicles, monkeypatch):
+    """Mensagem sem filtros só vira busca semântica se parecer com algum veículo"""
+    dealership, by_modelo = vehicles
+    monkeypatch.setattr(ai_processor, 'extract_search_params', lambda dealership, message: {})
+    reply = ai_processor.process_message_with_ai(dealership.id, 'xyzzy qwerty')
+    assert len(reply) == 1 and reply[0]['text'].startswith('Não entendi')
+    reply = ai_processor.process_message_with_ai(dealership.id, 'SUV pra estrada de terra')
+    assert reply[0]['vehicle_id'] == by_modelo['Hilux'].id
@@ -0,0 +1,322 @@
+import io
+import os
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from src.main import app, db
+from src.models import Dealership, ImportJob, Vehicle, VehicleOption
+import src.services.import_jobs as import_jobs
+from src.services.import_jobs import ImportJobRunner
+from src.services.inventory_index import get_inventory_index
+from src.services.inventory_version import inventory_version
+import src.services.vehicle_import as vehicle_import
+from src.services.vehicle_import import VehicleImport, iter_vehicle_frames, resolve_columns
+
+CSV_HEADER = 'MARCA,modelo,Versao,Ano Fabricacao,ANO MODELO,Quilometragem,Estado,Câmbio,Combustivel,Cor,Preço,Final Placa,Itens Opcionais\n'
+
+@pytest.fixture
+def client(client, tmp_path):
+    runner = app.extensions['import_jobs']
+    runner.num_workers = 0  # Os testes processam os jobs manualmente
+    runner.storage_dir = str(tmp_path / 'imports')
+    return client
+
+@pytest.fixture
+def dealership(client):
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    return dealership
+
+def upload(client, dealership, content, filename='estoque.csv', mode='append'):
+    """Envia a planilha, processa o job e retorna o status final."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    response = client.post('/api/upload/vehicles', content_type='multipart/form-data', data={
+        'dealership_id': str(dealership.id),
+        'mode': mode,
+        'file': (io.BytesIO(content), filename),
+    })
+    assert response.status_code == 202
+    assert app.extensions['import_jobs'].run_pending() == 1
+    return client.get(response.get_json()['status_url']).get_json()
+
+def test_resolve_columns_ignores_case_and_accents():
+    """O mapeamento de colunas é resolvido uma vez, sem caixa nem acento"""
+    columns = resolve_columns(['MARCA', 'Modelo', 'Preco', 'Ano Fabricação', 'Desconhecida'])
+    assert columns == {'marca': ['MARCA'], 'modelo': ['Modelo'], 'ano_fabricacao': ['Ano Fabricação'],
+                       'preco': ['Preco']}
+
+def test_upload_imports_valid_rows_and_reports_errors(client, dealership):
+    """Linhas válidas são gravadas em lote; as inválidas voltam com o número da linha"""
+    data = upload(client, dealership, CSV_HEADER +
+        'Toyota,Corolla,XEi,2022,2023,15000,Usado,Automático,Flex,Prata,"R$ 120.000,00",5,Ar condicionado;Teto solar\n'
+        'Honda,Civic,EXL,2023,2023,,Novo,Automático,Flex,Preto,145000,7,\n'
+        ',Gol,1.0,2015,2015,90000,Usado,Manual,Flex,Branco,35000,1,\n'
+        'Fiat,Uno,Way,2014,1800,80000,Usado,Manual,Flex,Branco,25.000,2,\n'
+        'VW,Polo,TSI,2021,2021,-5,Usado,Manual,Flex,Azul,80000,3,\n'
+        'VW,Virtus,TSI,2021,2021,20000,Seminovo,Manual,Flex,Azul,80000,3,\n')
+    assert data['status'] == 'done'
+    assert data['inserted'] == 2
+    assert data['rows'] == 6
+    assert data['error_rows'] == 4
+    assert data['rows_per_second'] > 0
+    assert data['errors'] == [
+        'Error in row 4: Missing required field: marca',
+        'Error in row 5: Invalid ano_modelo: must be between 1900 and %d' % (pd.Timestamp.now().year + 1),
+        'Error in row 6: Quilometragem cannot be negative',
+        'Error in row 7: Estado must be either "Novo" or "Usado"',
+    ]
+
+    corolla, civic = Vehicle.query.order_by(Vehicle.id).all()
+    assert corolla.preco == 120000.0
+    assert corolla.ano_modelo == 2023
+    assert corolla.final_placa == '5'
+    assert corolla.itens_opcionais == 'Ar condicionado;Teto solar'
+    assert corolla.modelo_busca == 'corolla'
+    assert corolla.vendido is False
+    assert civic.quilometragem == 0
+    assert civic.itens_opcionais is None
+
+def test_import_fills_vehicle_options(client, dealership):
+    """A gravação em lote também preenche vehicle_options"""
+    upload(client, dealership, CSV_HEADER +
+        'Toyota,Corolla,XEi,2022,2023,15000,Usado,Automático,Flex,Prata,120000,5,Ar cond.;Teto solar\n')
+    corolla = Vehicle.query.filter_by(modelo='Corolla').one()
+    options = VehicleOption.query.filter_by(vehicle_id=corolla.id).order_by(VehicleOption.option).all()
+    assert [(o.option, o.label) for o in options] == [('ar condicionado', 'ar condicionado'),
+                                                      ('teto solar', 'teto solar')]
+
+def test_upload_without_valid_rows(client, dealership):
+    """Sem nenhuma linha válida o job termina como falho"""
+    data = upload(client, dealership, CSV_HEADER + ',,,,,,,,,,,,\n')
+    assert data['status'] == 'failed'
+    assert data['error'] == 'No vehicles were processed'
+    assert data['errors'] == ['Error in row 2: Missing required field: marca']
+
+def test_import_numbers_rows_across_frames_and_chunks(client, dealership):
+    """Blocos do mesmo arquivo continuam a numeração das linhas"""
+    frames = [pd.DataFrame({'Marca': ['Fiat'] * 3, 'Modelo': ['Uno', 'Mobi', 'Argo']}),
+              pd.DataFrame({'Marca': ['Fiat', None], 'Modelo': ['Toro', 'Pulse']})]
+    progress = []
+    result = VehicleImport(dealership.id, chunk_size=2, on_progress=lambda i: progress.append(i.rows)).run(frames)
+    assert progress == [3, 5]
+    assert result['rows'] == 5
+    assert result['inserted'] == 4
+    assert result['errors'] == ['Error in row 6: Missing required field: marca']
+    assert Vehicle.query.count() == 4
+
+def test_iter_vehicle_frames_streams_csv_and_xlsx(tmp_path):
+    """CSV e XLSX são lidos em blocos do tamanho pedido"""
+    csv_file = SimpleNamespace(filename='estoque.csv', stream=io.BytesIO(
+        ('Marca,Modelo\n' + 'Fiat,Uno\n' * 5).encode('utf-8')))
+    assert [len(frame) for frame in iter_vehicle_frames(csv_file, chunk_size=2)] == [2, 2, 1]
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Marca', 'Modelo', 'Ano Modelo', 'Preço'])
+    for i in range(5):
+        sheet.append(['Fiat', 'Uno', 2020, 30000.5])
+    sheet.append([None, None, None, None])
+    sheet.append(['Fiat', 'Mobi'])
+    path = tmp_path / 'estoque.xlsx'
+    workbook.save(path)
+    with open(path, 'rb') as stream:
+        frames = list(iter_vehicle_frames(SimpleNamespace(filename='estoque.xlsx', stream=stream), chunk_size=3))
+    assert [len(frame) for frame in frames] == [3, 2, 1]
+    assert list(frames[0].columns) == ['Marca', 'Modelo', 'Ano Modelo', 'Preço']
+    assert frames[2].iloc[0].tolist() == ['Fiat', 'Mobi', None, None]
+
+def test_upload_xlsx(client, dealership, tmp_path):
+    """Upload de XLSX passa pelo leitor em modo read-only"""
+    workbook = Workbook()
+    workbook.active.append(['Marca', 'Modelo', 'Ano Modelo', 'Quilometragem', 'Preço'])
+    workbook.active.append(['Toyota', 'Corolla', 2023, 15000, 120000])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    assert upload(client, dealership, buffer.getvalue(), filename='estoque.xlsx')['status'] == 'done'
+    vehicle = Vehicle.query.one()
+    assert (vehicle.modelo, vehicle.ano_modelo, vehicle.quilometragem, vehicle.preco) == ('Corolla', 2023, 15000, 120000.0)
+
+def test_import_caps_stored_error_messages(client, dealership, monkeypatch):
+    """Arquivos com muitos erros não acumulam mensagens sem limite"""
+    monkeypatch.setattr(vehicle_import, 'IMPORT_MAX_ERRORS', 2)
+    result = VehicleImport(dealership.id).run([pd.DataFrame({'Marca': [None] * 5, 'Modelo': ['Uno'] * 5})])
+    assert result['error_rows'] == 5
+    assert len(result['errors']) == 2
+
+SYNC_HEADER = 'SKU,Marca,Modelo,Versão,Ano Modelo,Final Placa,Preço\n'
+
+def test_sync_applies_only_the_diff(client, dealership):
+    """O modo sync insere, atualiza e marca vendidos só o que mudou"""
+    manual = Vehicle(dealership_id=dealership.id, marca='Honda', modelo='Civic', versao='EXL',
+                     ano_modelo=2023, final_placa='7', preco=145000.0, quilometragem=0)
+    db.session.add(manual)
+    db.session.commit()
+
+    first = upload(client, dealership, SYNC_HEADER +
+        'A1,Toyota,Corolla,XEi,2023,5,120000\n'
+        ',Honda,Civic,EXL,2023,7,145000\n'
+        ',VW,Gol,1.0,2015,1,35000\n', mode='sync')
+    assert (first['inserted'], first['updated'], first['unchanged'], first['marked_sold']) == (2, 0, 1, 0)
+
+    corolla = Vehicle.query.filter_by(sku='A1').one()
+    corolla_updated_at = corolla.data_atualizacao
+    civic_updated_at = db.session.get(Vehicle, manual.id).data_atualizacao
+
+    second = upload(client, dealership, SYNC_HEADER +
+        'A1,Toyota,Corolla,XEi 2.0,2023,5,118000\n'
+        ',Honda,Civic,EXL,2023,7,145000\n'
+        ',Fiat,Uno,Way,2014,2,25000\n', mode='sync')
+    assert (second['inserted'], second['updated'], second['unchanged'], second['marked_sold']) == (1, 1, 1, 1)
+
+    db.session.expire_all()
+    corolla = Vehicle.query.filter_by(sku='A1').one()
+    assert (corolla.versao, corolla.preco) == ('XEi 2.0', 118000.0)
+    assert corolla.data_atualizacao >= corolla_updated_at
+    assert db.session.get(Vehicle, manual.id).data_atualizacao == civic_updated_at
+    gol = Vehicle.query.filter_by(modelo='Gol').one()
+    assert gol.vendido is True and gol.data_venda is not None
+    assert Vehicle.query.count() == 4
+
+def test_sync_skips_sold_marking_when_rows_fail(client, dealership):
+    """Com linhas inválidas, nenhum veículo ausente é marcado como vendido"""
+    import_frames = lambda *rows: [pd.DataFrame(list(rows), columns=['Marca', 'Modelo', 'Ano Modelo'])]
+    vehicle_import.import_vehicles(dealership.id, import_frames(('Fiat', 'Uno', '2014'), ('VW', 'Gol', '2015')),
+                                   mode='sync')
+    result = vehicle_import.import_vehicles(dealership.id, import_frames(('Fiat', 'Uno', '2014'), (None, 'Gol', '2015')),
+                                            mode='sync')
+    assert result['error_rows'] == 1
+    assert result['sold_marking_skipped'] is True
+    assert Vehicle.query.filter_by(vendido=True).count() == 0
+
+def test_sync_only_touches_the_columns_in_the_file(client, dealership):
+    """Colunas ausentes da planilha ficam como estão nos veículos já cadastrados"""
+    vehicle = Vehicle(dealership_id=dealership.id, marca='Fiat', modelo='Uno', ano_modelo=2014, preco=25000.0,
+                      quilometragem=80000, observacoes='Único dono', link_fotos='https://fotos/1.jpg')
+    db.session.add(vehicle)
+    db.session.commit()
+
+    result = upload(client, dealership, 'Marca,Modelo,Ano Modelo,Preço\nFiat,Uno,2014,24000\n', mode='sync')
+    assert (result['inserted'], result['updated'], result['marked_sold']) == (0, 1, 0)
+
+    db.session.expire_all()
+    vehicle = db.session.get(Vehicle, vehicle.id)
+    assert vehicle.preco == 24000.0
+    assert (vehicle.quilometragem, vehicle.observacoes, vehicle.link_fotos) == (80000, 'Único dono',
+                                                                                'https://fotos/1.jpg')
+    assert [photo.url for photo in vehicle.photos] == ['https://fotos/1.jpg']
+
+def test_sync_of_an_empty_file_marks_nothing_sold(client, dealership):
+    """Planilha só com o cabeçalho não esvazia o estoque"""
+    upload(client, dealership, SYNC_HEADER + 'A1,Toyota,Corolla,XEi,2023,5,120000\n', mode='sync')
+
+    result = upload(client, dealership, SYNC_HEADER, mode='sync')
+    assert (result['rows'], result['marked_sold'], result['sold_marking_skipped']) == (0, 0, True)
+    assert Vehicle.query.filter_by(vendido=True).count() == 0
+
+def test_sync_adopts_a_new_sku_column(client, dealership):
+    """Passar a mandar SKU casa as linhas com os veículos já cadastrados sem SKU"""
+    upload(client, dealership, 'Marca,Modelo,Ano Modelo,Preço\nFiat,Uno,2014,25000\nVW,Gol,2015,35000\n',
+           mode='sync')
+    ids = {vehicle.modelo: vehicle.id for vehicle in Vehicle.query}
+
+    result = upload(client, dealership, 'SKU,Marca,Modelo,Ano Modelo,Preço\nU1,Fiat,Uno,2014,25000\n'
+                                        'G1,VW,Gol,2015,35000\n', mode='sync')
+    assert (result['inserted'], result['updated'], result['marked_sold']) == (0, 2, 0)
+    db.session.expire_all()
+    assert {vehicle.modelo: (vehicle.id, vehicle.sku) for vehicle in Vehicle.query} == {
+        'Uno': (ids['Uno'], 'U1'), 'Gol': (ids['Gol'], 'G1')}
+
+def test_upload_returns_job_and_reports_progress(client, dealership):
+    """O upload responde com o id do job; o status traz progresso e vazão"""
+    response = client.post('/api/upload/vehicles', content_type='multipart/form-data', data={
+        'dealership_id': str(dealership.id),
+        'file': (io.BytesIO((CSV_HEADER + 'Fiat,Uno,Way,2014,2014,80000,Usado,Manual,Flex,Branco,25000,2,\n' * 3)
+                            .encode('utf-8')), 'estoque.csv'),
+    })
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    job = db.session.get(ImportJob, job_id)
+    assert job.status == 'pending' and os.path.exists(job.file_path)
+    assert client.get(f'/api/upload/vehicles/{job_id}').get_json()['status'] == 'pending'
+    assert Vehicle.query.count() == 0
+
+    assert app.extensions['import_jobs'].run_pending() == 1
+
+    data = client.get(f'/api/upload/vehicles/{job_id}').get_json()
+    assert (data['status'], data['rows'], data['error_rows'], data['inserted']) == ('done', 3, 0, 3)
+    assert data['rows_per_second'] > 0
+    assert data['started_at'] and data['finished_at']
+    assert not os.path.exists(db.session.get(ImportJob, job_id).file_path)
+    assert client.get('/api/upload/vehicles/999').status_code == 404
+
+def test_failed_import_still_refreshes_the_inventory(client, dealership, monkeypatch):
+    """Blocos confirmados antes da falha aparecem no índice e mudam a versão do estoque"""
+    index = get_inventory_index(dealership.id)
+    version = inventory_version(dealership.id)['version']
+
+    def partial_import(dealership_id, frames, mode, on_progress):
+        db.session.add(Vehicle(dealership_id=dealership_id, marca='Fiat', modelo='Uno'))
+        db.session.commit()
+        raise RuntimeError('arquivo truncado')
+    monkeypatch.setattr(import_jobs, 'import_vehicles', partial_import)
+
+    data = upload(client, dealership, CSV_HEADER + 'Fiat,Uno,Way,2014,2014,80000,Usado,Manual,Flex,Branco,25000,2,\n')
+    assert (data['status'], data['error']) == ('failed', 'arquivo truncado')
+    assert get_inventory_index(dealership.id) is not index
+    assert len(get_inventory_index(dealership.id)) == 1
+    assert inventory_version(dealership.id)['version'] != version
+
+def test_import_job_is_claimed_once(client, dealership):
+    """Só um worker reserva o job; os parados em 'running' voltam para a fila"""
+    response = client.post('/api/upload/vehicles', content_type='multipart/form-data', data={
+        'dealership_id': str(dealership.id),
+        'file': (io.BytesIO((CSV_HEADER + 'Fiat,Uno,Way,2014,2014,80000,Usado,Manual,Flex,Branco,25000,2,\n')
+                            .encode('utf-8')), 'estoque.csv'),
+    })
+    job_id = response.get_json()['job_id']
+    runner = app.extensions['import_jobs']
+    assert runner.claim(job_id) is True
+    assert runner.claim(job_id) is False
+    assert runner.run(job_id) is False and runner.run_pending() == 0
+
+    ImportJob.query.filter_by(id=job_id).update({'locked_at': datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+    assert runner.run_pending() == 1
+    job = db.session.get(ImportJob, job_id)
+    assert (job.status, job.attempts, Vehicle.query.count()) == ('done', 2, 1)
+
+    stuck = ImportJob(dealership_id=dealership.id, filename='x.csv', file_path='/nao/existe.csv', status='running',
+                      attempts=runner.max_attempts, locked_at=datetime.utcnow() - timedelta(hours=1))
+    db.session.add(stuck)
+    db.session.commit()
+    assert runner.requeue_stale() == []
+    assert db.session.get(ImportJob, stuck.id).status == 'failed'
+
+def test_dealership_queue_does_not_hold_workers(tmp_path, monkeypatch):
+    """Jobs da mesma concessionária esperam na fila dela, sem ocupar thread do pool"""
+    runner = ImportJobRunner(app, str(tmp_path), num_workers=2)
+    release, started, order = threading.Event(), {}, []
+
+    def run(job_id):
+        order.append(job_id)
+        started[job_id].set()
+        if job_id == 1:
+            release.wait(5)
+    monkeypatch.setattr(runner, 'run', run)
+    for job_id in (1, 2, 3):
+        started[job_id] = threading.Event()
+    runner.schedule(1, dealership_id=10)
+    runner.schedule(2, dealership_id=10)
+    runner.schedule(3, dealership_id=20)
+    assert started[3].wait(5) and not started[2].is_set()
+    release.set()
+    assert started[2].wait(5)
+    runner._executor.shutdown(wait=True)
+    assert order.index(1) < order.index(2) and runner._queues == {}
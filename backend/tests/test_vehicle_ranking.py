@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+from src.services.vehicle_ranking import RANKING_COLUMNS, rank, ranking_frame
+
+NOW = datetime(2026, 10, 17, 12, 0)
+
+def vehicle(id, preco=None, ano_modelo=2020, preco_promocional=None, destaque=False, destaque_ate=None,
+            itens_opcionais=None):
+    return SimpleNamespace(id=id, preco=preco, preco_promocional=preco_promocional, ano_modelo=ano_modelo,
+                           destaque=destaque, destaque_ate=destaque_ate, itens_opcionais=itens_opcionais)
+
+def ranked_ids(vehicles, params, limit=10, after=None):
+    return [vehicle_id for vehicle_id, _ in rank(ranking_frame(vehicles), params, limit, after=after, now=NOW)]
+
+def test_price_target_uses_promotional_price():
+    """Mais perto do preço pedido primeiro; o preço promocional conta e ainda ganha bônus"""
+    vehicles = [vehicle(1, preco=60000.0), vehicle(2, preco=79000.0),
+                vehicle(3, preco=95000.0, preco_promocional=78000.0), vehicle(4)]
+    assert ranked_ids(vehicles, {'preco_max': 80000}) == [3, 2, 1, 4]
+
+def test_year_opcionais_and_destaque():
+    """Ano alvo, fração dos opcionais pedidos e destaque só enquanto vale"""
+    vehicles = [vehicle(1, ano_modelo=2015, itens_opcionais='Teto solar;Banco de couro'),
+                vehicle(2, ano_modelo=2023, itens_opcionais='Teto Solar'),
+                vehicle(3, ano_modelo=2023, destaque=True, destaque_ate=NOW - timedelta(days=1)),
+                vehicle(4, ano_modelo=2023, destaque=True, destaque_ate=NOW + timedelta(days=1))]
+    assert ranked_ids(vehicles, {'ano_min': 2020}) == [4, 2, 3, 1]
+    assert ranked_ids(vehicles, {'opcionais': ['teto solar', 'banco de couro']}) == [1, 4, 2, 3]
+
+def test_keyset_pages_cover_all_candidates_once():
+    """Paginando pela chave do último item, cada candidato aparece uma única vez"""
+    rng = np.random.default_rng(3)
+    vehicles = [vehicle(i, preco=float(rng.choice([50000, 60000, 70000])), ano_modelo=int(rng.integers(2015, 2025)),
+                        destaque=bool(i % 7 == 0)) for i in range(1, 101)]
+    frame = ranking_frame(vehicles)
+    seen, after = [], None
+    while True:
+        page = rank(frame, {'preco_max': 60000, 'ano_min': 2018}, 7, after=after, now=NOW)
+        if not page:
+            break
+        seen.extend(vehicle_id for vehicle_id, _ in page)
+        after = page[-1][1]
+    assert seen == [vehicle_id for vehicle_id, _ in rank(frame, {'preco_max': 60000, 'ano_min': 2018}, 100, now=NOW)]
+    assert sorted(seen) == list(range(1, 101))
+
+def test_ranking_frame_accepts_row_tuples():
+    """Linhas do banco (tuplas na ordem de RANKING_COLUMNS) viram o mesmo frame"""
+    row = (1, 50000.0, None, 2020, None, None, None)
+    assert len(RANKING_COLUMNS) == len(row)
+    frame = ranking_frame([row])
+    assert frame['destaque'].tolist() == [False]
+    assert frame['opcionais'].tolist() == [frozenset()]
+
+def test_opcionais_match_whole_canonical_keys():
+    """Opcionais comparados pela chave canônica: sem acento, com apelidos e sem casar trechos"""
+    vehicles = [vehicle(1, itens_opcionais='Direção Hidráulica;A/C'),
+                vehicle(2, itens_opcionais='direcao hidraulica;Ar-condicionado;Freios ABS'),
+                vehicle(3, itens_opcionais='Cabs estendida;Airbag de cortina')]
+    frame = ranking_frame(vehicles)
+    assert frame['opcionais'].tolist()[0] == {'direcao hidraulica', 'ar condicionado'}
+    assert ranked_ids(vehicles, {'opcionais': ['direção hidráulica', 'ar condicionado']})[:2] == [1, 2]
+    assert ranked_ids(vehicles, {'opcionais': ['abs']}) == [2, 1, 3]
+    assert ranked_ids(vehicles, {'opcionais': ['airbag']}) == [1, 2, 3]
@@ -0,0 +1,316 @@
+import pytest
+from types import SimpleNamespace
+from src.main import app, db
+from src.models import Dealership, Vehicle, WebhookJob
+import src.services.whatsapp_service as whatsapp_service
+from src.services.dealership_router import get_dealership_router
+from src.services.conversation_session import get_session, session_store
+from src.services.inventory_index import invalidate_inventory_index
+from src.services.vehicle_cards import card_cache, get_vehicle_card
+from src import cache, metrics
+from src.services.webhook_dispatcher import MessageDeduplicator
+from src.services.webhook_queue import LocalQueue
+import src.ai_processor as ai_processor
+
+@pytest.fixture
+def client(client):
+    app.extensions['webhook_queue'].num_workers = 0  # Os testes drenam a fila manualmente
+    app.config['WEBHOOK_DISPATCH_WORKERS'] = 1  # SQLite em memória usa uma única conexão
+    return client
+
+@pytest.fixture
+def sent_messages(monkeypatch):
+    sent = []
+    def fake_send(to_number, message, image_url=None, buttons=None, phone_number_id=None):
+        sent.append({'to': to_number, 'text': message, 'image': image_url, 'buttons': buttons,
+                     'from': phone_number_id})
+    def fake_send_batch(to_number, steps, phone_number_id=None):
+        for step in steps:
+            for item in (step if isinstance(step, list) else [step]):
+                fake_send(to_number, item['message'], item.get('image_url'), item.get('buttons'), phone_number_id)
+    monkeypatch.setattr(whatsapp_service, 'send_whatsapp_message', fake_send)
+    monkeypatch.setattr(whatsapp_service, 'send_whatsapp_batch', fake_send_batch)
+    monkeypatch.setattr(whatsapp_service, 'process_message_with_ai',
+                        lambda dealership_id, msg, sender=None: [{'text': f'resposta para {msg}', 'image': None, 'vehicle_id': 1}])
+    return sent
+
+@pytest.fixture
+def dealership(client):
+    dealership = Dealership(name='Test Dealership', whatsapp_number='5511999999999',
+                            email='test@dealership.com', cnpj='12345678901234')
+    db.session.add(dealership)
+    db.session.commit()
+    return dealership
+
+def text_message(message_id, sender, body):
+    return {'id': message_id, 'from': sender, 'type': 'text', 'text': {'body': body}}
+
+def webhook_payload(*messages):
+    return {'entry': [{'changes': [{'value': {'messages': list(messages)}}]}]}
+
+def test_webhook_enqueues_and_acks_immediately(client, dealership, sent_messages):
+    """O webhook só grava o payload; a IA e os envios rodam nos workers"""
+    response = client.post('/whatsapp/webhook', json=webhook_payload(
+        text_message('wamid.1', '5511988887777', 'tem corolla?')))
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'queued'
+    assert sent_messages == []
+    job = WebhookJob.query.one()
+    assert job.status == 'pending'
+
+    assert app.extensions['webhook_queue'].drain() == 1
+    assert len(sent_messages) == 1
+    assert sent_messages[0]['text'] == 'resposta para tem corolla?'
+    assert db.session.get(WebhookJob, job.id).status == 'done'
+
+def test_webhook_ignores_status_updates(client, dealership, sent_messages):
+    """Payloads só com status de entrega não entram na fila"""
+    response = client.post('/whatsapp/webhook', json={
+        'entry': [{'changes': [{'value': {'statuses': [{'id': 'wamid.1', 'status': 'delivered'}]}}]}]
+    })
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'ignored'
+    assert WebhookJob.query.count() == 0
+
+def test_webhook_invalid_payload(client):
+    """Payload sem entry é rejeitado"""
+    response = client.post('/whatsapp/webhook', json={'foo': 'bar'})
+    assert response.status_code == 400
+
+def test_failed_job_is_retried(client, dealership, monkeypatch):
+    """Falhas no processamento devolvem o job para a fila com o erro registrado"""
+    def broken_send(*args, **kwargs):
+        raise RuntimeError('graph api fora do ar')
+    monkeypatch.setattr(whatsapp_service, 'send_whatsapp_message', broken_send)
+    monkeypatch.setattr(whatsapp_service, 'send_whatsapp_batch', broken_send)
+    monkeypatch.setattr(whatsapp_service, 'process_message_with_ai',
+                        lambda dealership_id, msg, sender=None: [{'text': '*Toyota Corolla 2024*', 'image': None, 'vehicle_id': 1}])
+    client.post('/whatsapp/webhook', json=webhook_payload(
+        text_message('wamid.2', '5511988887777', 'oi')))
+
+    app.extensions['webhook_queue'].drain()
+    job = WebhookJob.query.one()
+    assert job.status == 'pending'
+    assert job.attempts == 1
+    assert 'graph api fora do ar' in job.last_error
+
+def test_local_queue_waits_retry_delay(monkeypatch):
+    """Na fila em memória, como na do banco, o job que falhou só volta depois de retry_delay * tentativas"""
+    now = [1000.0]
+    monkeypatch.setattr('src.services.webhook_queue.time', SimpleNamespace(monotonic=lambda: now[0]))
+    local = LocalQueue(max_attempts=3, retry_delay=5)
+    job_id = local.put({'entry': []})
+    assert local.claim() == (job_id, {'entry': []})
+    local.fail(job_id, 'graph api fora do ar')
+    assert local.claim() is None
+    assert local.pending_count() == 1
+    now[0] += 5
+    assert local.claim() == (job_id, {'entry': []})
+    local.fail(job_id, 'graph api fora do ar')
+    now[0] += 9
+    assert local.claim() is None
+    now[0] += 1
+    assert local.claim() == (job_id, {'entry': []})
+    local.fail(job_id, 'graph api fora do ar')
+    assert local.pending_count() == 0
+
+def test_webhook_processes_whole_batch(client, dealership, sent_messages):
+    """Todas as entries/changes/mensagens do lote são respondidas, sem duplicatas"""
+    payload = {'entry': [
+        {'changes': [{'value': {'messages': [
+            text_message('wamid.10', '5511911111111', 'tem onix?'),
+            text_message('wamid.11', '5511922222222', 'tem hb20?'),
+        ]}}]},
+        {'changes': [
+            {'value': {'statuses': [{'id': 'wamid.9', 'status': 'read'}]}},
+            {'value': {'messages': [
+                text_message('wamid.12', '5511911111111', 'e corolla?'),
+                text_message('wamid.11', '5511922222222', 'tem hb20?'),
+            ]}}
+        ]}
+    ]}
+    client.post('/whatsapp/webhook', json=payload)
+    app.extensions['webhook_queue'].drain()
+
+    assert len(sent_messages) == 3
+    first_sender = [m['text'] for m in sent_messages if m['to'] == '5511911111111']
+    assert first_sender == ['resposta para tem onix?', 'resposta para e corolla?']
+
+    # Reenvio do mesmo lote pela Meta não gera respostas repetidas
+    client.post('/whatsapp/webhook', json=payload)
+    app.extensions['webhook_queue'].drain()
+    assert len(sent_messages) == 3
+
+def test_deduplicator_is_shared_between_processes(monkeypatch):
+    """Com o backend redis, uma mensagem despachada por um processo é recusada pelos outros"""
+    store = {}
+
+    class FakeRedis:
+        @classmethod
+        def from_url(cls, url):
+            return cls()
+
+        def set(self, key, value, ex=None, nx=False):
+            if nx and key in store:
+                return None
+            store[key] = value
+            return True
+
+        def delete(self, key):
+            store.pop(key, None)
+
+    monkeypatch.setattr(cache, 'redis', SimpleNamespace(Redis=FakeRedis))
+    first, second = (MessageDeduplicator(ttl=60, backend='redis') for _ in range(2))
+    assert first.claim('wamid.30')
+    assert not second.claim('wamid.30')
+    first.release('wamid.30')  # falhou: a retentativa pode rodar em qualquer processo
+    assert second.claim('wamid.30')
+
+def test_webhook_routes_by_receiving_number(client, dealership, sent_messages, monkeypatch):
+    """Cada mensagem vai para a loja dona do número que a recebeu e a resposta sai por ele"""
+    other = Dealership(name='Outra Loja', whatsapp_number='5521988887777', whatsapp_phone_number_id='222',
+                       email='outra@dealership.com', cnpj='98765432109876')
+    db.session.add(other)
+    db.session.commit()
+    answered_by = []
+    monkeypatch.setattr(whatsapp_service, 'process_message_with_ai',
+                        lambda dealership_id, msg, sender=None: answered_by.append(dealership_id) or [{'text': f'resposta para {msg}', 'image': None, 'vehicle_id': 1}])
+
+    payload = {'entry': [{'changes': [
+        {'value': {'metadata': {'phone_number_id': '111', 'display_phone_number': '+55 11 99999-9999'},
+                   'messages': [text_message('wamid.20', '5511911111111', 'tem onix?')]}},
+        {'value': {'metadata': {'phone_number_id': '222', 'display_phone_number': '5521900000000'},
+                   'messages': [text_message('wamid.21', '5511922222222', 'tem hb20?')]}},
+        {'value': {'metadata': {'phone_number_id': '333', 'display_phone_number': '5531900000000'},
+                   'messages': [text_message('wamid.22', '5511933333333', 'tem gol?')]}},
+    ]}]}
+    assert get_dealership_router().resolve({'phone_number_id': '222'}) == other.id
+    client.post('/whatsapp/webhook', json=payload)
+    app.extensions['webhook_queue'].drain()
+
+    assert answered_by == [dealership.id, other.id]
+    assert [(m['to'], m['from']) for m in sent_messages] == [('5511911111111', '111'), ('5511922222222', '222')]
+
+def test_webhook_logs_unrouted_messages(client, dealership, sent_messages, caplog):
+    """Mensagem para um número de nenhuma loja é descartada com aviso do phone_number_id"""
+    other = Dealership(name='Outra Loja', whatsapp_number='5521988887777', whatsapp_phone_number_id='222',
+                       email='outra@dealership.com', cnpj='98765432109876')
+    dealership.whatsapp_phone_number_id = '111'
+    db.session.add(other)
+    db.session.commit()
+
+    payload = {'entry': [{'changes': [
+        {'value': {'metadata': {'phone_number_id': '333', 'display_phone_number': '5531900000000'},
+                   'messages': [text_message('wamid.23', '5511933333333', 'tem gol?')]}},
+    ]}]}
+    with caplog.at_level('WARNING'):
+        client.post('/whatsapp/webhook', json=payload)
+        app.extensions['webhook_queue'].drain()
+
+    assert sent_messages == []
+    assert any('phone_number_id 333' in record.getMessage() for record in caplog.records)
+
+def test_dealership_router_is_invalidated_on_commit(client, dealership):
+    """Criar ou alterar uma concessionária descarta o mapa em memória"""
+    router = get_dealership_router()
+    assert router.resolve({}) == dealership.id
+    assert get_dealership_router() is router
+
+    dealership.whatsapp_phone_number_id = '111'
+    db.session.commit()
+    router = get_dealership_router()
+    assert router.resolve({'phone_number_id': '111'}) == dealership.id
+
+    dealership.active = False
+    db.session.commit()
+    assert get_dealership_router().resolve({'phone_number_id': '111'}) is None
+
+def button_click(message_id, sender, button_id):
+    return {'id': message_id, 'from': sender, 'type': 'interactive',
+            'interactive': {'type': 'button_reply', 'button_reply': {'id': button_id, 'title': 'Quero saber mais'}}}
+
+def test_buttons_reference_the_vehicle_shown(client, dealership, sent_messages, monkeypatch):
+    """Os botões levam o id do veículo mostrado; o clique não refaz a busca pelo modelo"""
+    invalidate_inventory_index()
+    session_store.clear()
+    monkeypatch.setattr(whatsapp_service, 'process_message_with_ai', ai_processor.process_message_with_ai)
+    monkeypatch.setattr(ai_processor, 'model', None)  # o fast path resolve sem o Gemini
+    novo = Vehicle(dealership_id=dealership.id, marca='Toyota', modelo='Corolla', ano_modelo=2023,
+                   preco=150000.0, quilometragem=0, cambio='Automático', combustivel='Flex')
+    usado = Vehicle(dealership_id=dealership.id, marca='Toyota', modelo='Corolla', ano_modelo=2019,
+                    preco=90000.0, quilometragem=60000, cambio='Automático', combustivel='Flex')
+    db.session.add_all([novo, usado])
+    db.session.commit()
+
+    client.post('/whatsapp/webhook', json=webhook_payload(
+        text_message('wamid.30', '5511911111111', 'corolla até 100 mil')))
+    app.extensions['webhook_queue'].drain()
+    buttons = [button['reply']['id'] for button in sent_messages[-1]['buttons']]
+    assert buttons[:2] == [f'quero_saber_mais_{usado.id}', f'ver_mais_fotos_{usado.id}']
+    session = get_session(dealership.id, '5511911111111')
+    assert session['vehicle_ids'] == [usado.id]
+    assert session['filters']['modelo'] == 'Corolla' and session['filters']['preco_max'] == 100000
+    assert session['cursor'] is None  # uma página só
+
+    # Clique pelo id e botão antigo (só o modelo): ambos chegam ao Corolla 2019 mostrado
+    for message_id, button_id in (('wamid.31', f'quero_saber_mais_{usado.id}'), ('wamid.32', 'quero_saber_mais_corolla')):
+        del sent_messages[:]
+        client.post('/whatsapp/webhook', json=webhook_payload(button_click(message_id, '5511911111111', button_id)))
+        app.extensions['webhook_queue'].drain()
+        assert sent_messages[0]['text'].startswith('*Toyota Corolla 2019*')
+
+def test_see_more_results_pages_by_cursor(client, dealership, sent_messages, monkeypatch):
+    """"Ver mais resultados" traz a próxima página pelo cursor da sessão, sem chamar a IA de novo"""
+    invalidate_inventory_index()
+    session_store.clear()
+    monkeypatch.setattr(whatsapp_service, 'process_message_with_ai', ai_processor.process_message_with_ai)
+    monkeypatch.setattr(ai_processor, 'model', None)
+    monkeypatch.setattr(ai_processor, 'SEARCH_PAGE_SIZE', 2)
+    for ano, preco in ((2018, 80000.0), (2019, 90000.0), (2020, 100000.0)):
+        db.session.add(Vehicle(dealership_id=dealership.id, marca='Toyota', modelo='Corolla', ano_modelo=ano,
+                               preco=preco, quilometragem=10000, cambio='Automático', combustivel='Flex'))
+    db.session.commit()
+
+    client.post('/whatsapp/webhook', json=webhook_payload(text_message('wamid.40', '5511911111111', 'tem corolla?')))
+    app.extensions['webhook_queue'].drain()
+    assert [m['text'].split('\n')[0] for m in sent_messages[:2]] == ['*Toyota Corolla 2018*', '*Toyota Corolla 2019*']
+    assert [b['reply']['id'] for b in sent_messages[2]['buttons']] == ['ver_mais_resultados', 'nao_obrigado']
+
+    monkeypatch.setattr(ai_processor, 'extract_search_params', None)  # a próxima página não extrai de novo
+    del sent_messages[:]
+    client.post('/whatsapp/webhook', json=webhook_payload(button_click('wamid.41', '5511911111111', 'ver_mais_resultados')))
+    app.extensions['webhook_queue'].drain()
+    assert [m['text'].split('\n')[0] for m in sent_messages] == ['*Toyota Corolla 2020*']
+    assert get_session(dealership.id, '5511911111111')['cursor'] is None
+
+    del sent_messages[:]
+    client.post('/whatsapp/webhook', json=webhook_payload(button_click('wamid.42', '5511911111111', 'ver_mais_resultados')))
+    app.extensions['webhook_queue'].drain()
+    assert sent_messages[0]['text'].startswith('Não tenho mais resultados')
+
+def test_vehicle_cards_are_cached_until_update(client, dealership, sent_messages, monkeypatch):
+    """O cartão do veículo é renderizado uma vez e refeito quando o veículo muda"""
+    card_cache.clear()
+    metrics.reset()
+    vehicle = Vehicle(dealership_id=dealership.id, marca='Honda', modelo='Civic', ano_modelo=2021, preco=120000.0,
+                      quilometragem=30000, motor='2.0', itens_opcionais='Teto solar;Banco de couro',
+                      link_fotos=' https://img/1.jpg ; https://img/2.jpg;')
+    db.session.add(vehicle)
+    db.session.commit()
+
+    card = get_vehicle_card(vehicle)
+    assert card['photos'] == ['https://img/1.jpg', 'https://img/2.jpg']
+    assert 'Preço: R$ 120,000.00' in card['list'] and 'Quilometragem: 30,000 km' in card['list']
+    assert '• Teto solar\n• Banco de couro' in card['detail']
+    assert get_vehicle_card(vehicle) is card
+    assert (metrics.get('whatsapp.card_cache.misses'), metrics.get('whatsapp.card_cache.hits')) == (1, 1)
+
+    client.post('/whatsapp/webhook', json=webhook_payload(button_click('wamid.50', '5511911111111',
+                                                                       f'ver_mais_fotos_{vehicle.id}')))
+    app.extensions['webhook_queue'].drain()
+    assert [m['image'] for m in sent_messages] == card['photos']
+
+    client.put(f'/api/vehicles/{vehicle.id}', json={'preco': 110000.0, 'link_fotos': 'https://img/3.jpg'})
+    db.session.expire_all()
+    card = get_vehicle_card(db.session.get(Vehicle, vehicle.id))
+    assert 'Preço: R$ 110,000.00' in card['detail'] and card['photos'] == ['https://img/3.jpg']
@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from src.integrations.graph_client import GraphAPIClient, GraphAPIRateLimited, GraphRetryPolicy
+from src.integrations.whatsapp_api import build_message_payload
+from src.integrations.whatsapp_async import AsyncWhatsAppSender
+
+class StubGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Permite keep-alive
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        self.server.requests.append({'path': self.path, 'body': body, 'client': self.client_address})
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delays.pop(0) if self.server.delays else self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+        status, headers, payload = self.server.responses.pop(0) if self.server.responses else (200, {}, {})
+        data = json.dumps(payload or {'messages': [{'id': 'wamid.stub'}]}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGraphHandler)
+    server.requests = []
+    server.responses = []
+    server.lock = threading.Lock()
+    server.active = 0
+    server.max_active = 0
+    server.delay = 0
+    server.delays = []  # atraso de cada requisição, antes de cair em `delay`
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(stub_server):
+    host, port = stub_server.server_address
+    client = GraphAPIClient(base_url=f'http://{host}:{port}', token='test-token',
+                            backoff_base=0.001, backoff_max=0.01, max_rate_limit_wait=1)
+    yield client
+    client.close()
+
+def test_reuses_pooled_connection(client, stub_server):
+    """Vários envios reaproveitam a mesma conexão keep-alive"""
+    for i in range(3):
+        result = client.send_message('123', build_message_payload('5511999999999', f'msg {i}'))
+        assert result['messages'][0]['id'] == 'wamid.stub'
+    assert len(stub_server.requests) == 3
+    assert stub_server.requests[0]['path'] == '/v17.0/123/messages'
+    assert len({r['client'] for r in stub_server.requests}) == 1
+
+def test_retries_server_errors(client, stub_server):
+    """Erros 5xx são repetidos com backoff"""
+    stub_server.responses = [(503, {}, {'error': {'message': 'unavailable'}}),
+                             (500, {}, {'error': {'message': 'boom'}})]
+    client.send_message('123', build_message_payload('5511999999999', 'oi'))
+    assert len(stub_server.requests) == 3
+
+def test_honours_retry_after(client, stub_server):
+    """429 com Retry-After é repetido após a espera pedida"""
+    stub_server.responses = [(429, {'Retry-After': '0'}, {'error': {'code': 130429}})]
+    client.send_message('123', build_message_payload('5511999999999', 'oi'))
+    assert len(stub_server.requests) == 2
+
+def test_does_not_retry_client_errors(client, stub_server):
+    """Erros 4xx que não são de limite de taxa falham na hora"""
+    stub_server.responses = [(400, {}, {'error': {'code': 100, 'message': 'Invalid parameter'}})]
+    with pytest.raises(requests.HTTPError):
+        client.send_message('123', build_message_payload('5511999999999', 'oi'))
+    assert len(stub_server.requests) == 1
+
+def test_pauses_when_business_quota_is_exhausted(client, stub_server):
+    """O tempo de recuperação da cota (X-Business-Use-Case-Usage) pausa os envios"""
+    usage = json.dumps({'1234': [{'type': 'whatsapp', 'call_count': 100, 'total_cputime': 10,
+                                  'total_time': 10, 'estimated_time_to_regain_access': 5}]})
+    stub_server.responses = [(200, {'X-Business-Use-Case-Usage': usage}, None)]
+    client.send_message('123', build_message_payload('5511999999999', 'oi'))
+    assert client.usage == 100
+    with pytest.raises(GraphAPIRateLimited):
+        client.send_message('123', build_message_payload('5511999999999', 'oi de novo'))
+    assert len(stub_server.requests) == 1
+
+@pytest.fixture
+def async_sender(stub_server):
+    host, port = stub_server.server_address
+    sender = AsyncWhatsAppSender(base_url=f'http://{host}:{port}', token='test-token',
+                                 max_in_flight_per_recipient=4, backoff_base=0.001, backoff_max=0.01)
+    yield sender
+    sender.close()
+
+def test_async_sender_sends_photos_in_parallel(async_sender, stub_server):
+    """Fotos de um anúncio saem em paralelo, respeitando o limite por destinatário"""
+    stub_server.delay = 0.05
+    photos = [build_message_payload('5511999999999', f'Foto {i}', image_url=f'https://img/{i}.jpg')
+              for i in range(8)]
+    started = time.monotonic()
+    results = async_sender.send('123', '5511999999999', [photos])
+    elapsed = time.monotonic() - started
+    assert len(results[0]) == 8
+    assert len(stub_server.requests) == 8
+    assert stub_server.max_active == 4
+    assert elapsed < 8 * 0.05
+
+def test_async_sender_keeps_ordered_steps_in_order(async_sender, stub_server):
+    """Passos sequenciais chegam na ordem, um de cada vez"""
+    steps = [build_message_payload('5511999999999', f'msg {i}') for i in range(3)]
+    async_sender.send('123', '5511999999999', steps)
+    assert [r['body']['text']['body'] for r in stub_server.requests] == ['msg 0', 'msg 1', 'msg 2']
+    assert stub_server.max_active == 1
+
+def test_async_sender_retries_server_errors(async_sender, stub_server):
+    """O sender assíncrono também repete 5xx"""
+    stub_server.responses = [(502, {}, {'error': {'message': 'bad gateway'}})]
+    async_sender.send('123', '5511999999999', [build_message_payload('5511999999999', 'oi')])
+    assert len(stub_server.requests) == 2
+
+def test_async_sender_retries_timeouts(stub_server):
+    """Timeout e outros erros do aiohttp também são repetidos"""
+    host, port = stub_server.server_address
+    sender = AsyncWhatsAppSender(base_url=f'http://{host}:{port}', token='test-token', read_timeout=0.05,
+                                 backoff_base=0.001, backoff_max=0.01)
+    stub_server.delays = [0.2]
+    try:
+        sender.send('123', '5511999999999', [build_message_payload('5511999999999', 'oi')])
+    finally:
+        sender.close()
+    assert len(stub_server.requests) == 2
+
+def test_quota_pause_is_shared_between_clients(stub_server):
+    """Cota esgotada vista pelo cliente síncrono também segura o sender assíncrono"""
+    host, port = stub_server.server_address
+    policy = GraphRetryPolicy(backoff_base=0.001, backoff_max=0.01, max_rate_limit_wait=1)
+    client = GraphAPIClient(base_url=f'http://{host}:{port}', token='test-token', retry_policy=policy)
+    sender = AsyncWhatsAppSender(base_url=f'http://{host}:{port}', token='test-token', retry_policy=policy)
+    usage = json.dumps({'1234': [{'type': 'whatsapp', 'call_count': 100, 'estimated_time_to_regain_access': 5}]})
+    stub_server.responses = [(200, {'X-Business-Use-Case-Usage': usage}, None)]
+    try:
+        client.send_message('123', build_message_payload('5511999999999', 'oi'))
+        with pytest.raises(GraphAPIRateLimited):
+            sender.send('123', '5511999999999', [build_message_payload('5511999999999', 'oi de novo')])
+    finally:
+        client.close()
+        sender.close()
+    assert len(stub_server.requests) == 1